@@ -0,0 +1 @@
+"""Marconi Benchmarks"""
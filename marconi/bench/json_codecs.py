@@ -0,0 +1,133 @@
+# Copyright (c) 2013 Rackspace, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Micro-benchmark for the JSON codecs of the transport.
+
+Times each codec whose library is installed on the documents the
+API spends most of its time on: decoding a batch of posted messages,
+both whole and one message at a time, and encoding a page of listed
+messages, both whole and as a streamed response.
+
+Usage:
+
+    python -m marconi.bench.json_codecs [iterations]
+"""
+
+from __future__ import print_function
+
+import io
+import sys
+import timeit
+
+from marconi.common import config
+from marconi.queues.transport import utils
+
+PROJECT_CFG = config.project('marconi')
+
+PAGE_SIZE = 20
+
+
+def _message_body(n):
+    return {
+        'event': 'backup.completed',
+        'instance': {
+            'id': 'a0c3b5f2-%04d-4d3e-9f6c-0e5c2b7f1d42' % n,
+            'name': u'db-r\u00e9plica-%d' % n,
+            'flavor': {'ram': 8192, 'vcpus': 4, 'disk': 80},
+        },
+        'size_gb': 12.75 + n,
+        'tags': ['nightly', 'incremental', 'region:dfw'],
+        'ok': True,
+        'errors': None,
+    }
+
+
+def _documents():
+    posted = [{'ttl': 300, 'body': _message_body(n)}
+              for n in range(PAGE_SIZE)]
+
+    listed = {
+        'messages': [
+            {
+                'href': '/v1/queues/fizbit/messages/%024x' % n,
+                'ttl': 300,
+                'age': n,
+                'body': _message_body(n),
+            }
+            for n in range(PAGE_SIZE)
+        ],
+        'links': [
+            {
+                'rel': 'next',
+                'href': '/v1/queues/fizbit/messages?marker=%d' % PAGE_SIZE,
+            },
+        ],
+    }
+
+    return utils.get_codec('simplejson').dumps(posted), listed
+
+
+def _usec_per_call(func, iterations):
+    seconds = min(timeit.repeat(func, number=iterations, repeat=3))
+    return seconds / iterations * 1e6
+
+
+def run(iterations=1000):
+    """Runs the benchmark and prints the time per call, in usec."""
+    posted, listed = _documents()
+
+    def read():
+        utils.read_json(io.BytesIO(posted), len(posted))
+
+    def read_array():
+        list(utils.read_json_array(io.BytesIO(posted), len(posted)))
+
+    def write():
+        utils.to_json(listed)
+
+    def write_stream():
+        document = dict(listed, messages=iter(listed['messages']))
+        list(utils.to_json_stream(document))
+
+    calls = [
+        ('read_json', read),
+        ('read_json_array', read_array),
+        ('to_json', write),
+        ('to_json_stream', write_stream),
+    ]
+
+    print('%d messages posted (%d bytes), %d listed:' %
+          (PAGE_SIZE, len(posted), PAGE_SIZE))
+
+    for name in sorted(utils.CODECS):
+        try:
+            utils.get_codec(name)
+        except ImportError:
+            print('  %-12s not installed' % name)
+            continue
+
+        PROJECT_CFG.conf.set_override('json_codec', name,
+                                      group='drivers:transport')
+        try:
+            for call, func in calls:
+                print('  %-12s %-16s %8.2f usec' %
+                      (name, call, _usec_per_call(func, iterations)))
+        finally:
+            PROJECT_CFG.conf.clear_override('json_codec',
+                                            group='drivers:transport')
+
+
+if __name__ == '__main__':
+    run(*[int(arg) for arg in sys.argv[1:2]])
@@ -0,0 +1,461 @@
+# Copyright (c) 2013 Rackspace, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Load generator for the queues API.
+
+Drives a mix of producers, observers and claimers for a while, and
+reports the throughput and latency percentiles of each operation:
+
+    post    producers post batches of messages
+    list    observers list the messages, following the next links
+    claim   claimers claim batches of messages...
+    delete  ...and delete each of them under the claim
+
+The requests are either sent over HTTP to a running server, or made
+in-process to the WSGI app, with the storage driver of the config
+file (or of --storage). The SQLite driver can not be shared between
+threads, so in-process runs against it interleave the workers on a
+single thread instead.
+
+Usage:
+
+    marconi-bench [options] [--config-file marconi.conf]
+    marconi-bench --url http://localhost:8888 [options]
+"""
+
+from __future__ import print_function
+
+import abc
+import argparse
+import httplib
+import io
+import json
+import math
+import socket
+import sys
+import threading
+import time
+import urlparse
+import uuid
+import wsgiref.util
+
+from marconi.common import config
+from marconi.queues import bootstrap
+
+PROJECT_CFG = config.project('marconi')
+
+OPERATIONS = ('post', 'list', 'claim', 'delete')
+PERCENTILES = (50, 90, 99)
+
+
+class WSGIClient(object):
+    """Calls a WSGI app in-process.
+
+    :param app: The WSGI app
+    :param headers: Headers sent with each request
+    """
+
+    def __init__(self, app, headers):
+        self._app = app
+        self._environ = dict(('HTTP_' + name.upper().replace('-', '_'),
+                              value) for name, value in headers.items())
+
+    def request(self, method, path, body=None):
+        """Makes a request.
+
+        :returns: The status code, and the body of the response
+        """
+        path, sep, query = path.partition('?')
+        body = body or b''
+
+        env = {
+            'REQUEST_METHOD': method,
+            'SCRIPT_NAME': '',
+            'PATH_INFO': path,
+            'QUERY_STRING': query,
+            'CONTENT_TYPE': 'application/json',
+            'wsgi.input': io.BytesIO(body),
+        }
+
+        if body:
+            env['CONTENT_LENGTH'] = str(len(body))
+
+        env.update(self._environ)
+        wsgiref.util.setup_testing_defaults(env)
+
+        status = []
+
+        def start_response(status_line, headers, exc_info=None):
+            status.append(status_line)
+
+        result = self._app(env, start_response)
+
+        try:
+            data = b''.join(result)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+
+        return int(status[0][:3]), data
+
+
+class HTTPClient(object):
+    """Sends requests over a persistent HTTP connection.
+
+    :param url: Base URL of the server, e.g. http://localhost:8888
+    :param headers: Headers sent with each request
+    """
+
+    def __init__(self, url, headers):
+        parsed = urlparse.urlparse(url)
+
+        if parsed.scheme == 'https':
+            self._factory = httplib.HTTPSConnection
+        else:
+            self._factory = httplib.HTTPConnection
+
+        self._host = parsed.netloc
+        self._headers = dict(headers, **{'Content-Type': 'application/json'})
+        self._conn = None
+
+    def request(self, method, path, body=None):
+        """Makes a request, reconnecting if the last one failed.
+
+        :returns: The status code, and the body of the response
+        """
+        if self._conn is None:
+            self._conn = self._factory(self._host, timeout=60)
+
+        try:
+            self._conn.request(method, path, body, self._headers)
+            resp = self._conn.getresponse()
+            return resp.status, resp.read()
+
+        except (httplib.HTTPException, socket.error):
+            self._conn.close()
+            self._conn = None
+            raise
+
+
+class Stats(object):
+    """Latencies and number of messages of an operation."""
+
+    __slots__ = ('latencies', 'errors', 'messages')
+
+    def __init__(self):
+        self.latencies = []
+        self.errors = 0
+        self.messages = 0
+
+    def merge(self, other):
+        self.latencies.extend(other.latencies)
+        self.errors += other.errors
+        self.messages += other.messages
+
+
+class Worker(object):
+    """Makes requests to a queue, one operation per step.
+
+    :param client: The client sending the requests
+    :param queue_path: Path of the queue, e.g. /v1/queues/fizbit
+    :param batch: Number of messages posted, listed or claimed at once
+    """
+
+    __metaclass__ = abc.ABCMeta
+
+    def __init__(self, client, queue_path, batch):
+        self.client = client
+        self.queue_path = queue_path
+        self.batch = batch
+        self.stats = dict((operation, Stats()) for operation in OPERATIONS)
+
+    def _call(self, operation, method, path, body=None):
+        """Sends a request, and times it.
+
+        :returns: The status code and the JSON document of the
+            response, or (None, None) if it failed
+        """
+        stats = self.stats[operation]
+        start = time.time()
+
+        try:
+            status, data = self.client.request(method, path, body)
+        except (httplib.HTTPException, socket.error):
+            status, data = None, None
+
+        stats.latencies.append(time.time() - start)
+
+        if status is None or status >= 400:
+            stats.errors += 1
+            return None, None
+
+        return status, json.loads(data) if data else None
+
+    @abc.abstractmethod
+    def step(self):
+        """Makes the requests of one operation."""
+
+
+class Producer(Worker):
+
+    def __init__(self, client, queue_path, batch, message_size):
+        super(Producer, self).__init__(client, queue_path, batch)
+
+        message = {'ttl': 300, 'body': {'event': 'bench',
+                                        'data': 'x' * message_size}}
+        self._body = json.dumps([message] * batch)
+
+    def step(self):
+        status, document = self._call('post', 'POST',
+                                      self.queue_path + '/messages',
+                                      self._body)
+        if status == 201:
+            self.stats['post'].messages += len(document['resources'])
+
+
+class Observer(Worker):
+
+    def __init__(self, client, queue_path, batch):
+        super(Observer, self).__init__(client, queue_path, batch)
+        self._next = ('%s/messages?echo=true&include_claimed=true&limit=%d' %
+                      (queue_path, batch))
+
+    def step(self):
+        status, document = self._call('list', 'GET', self._next)
+
+        # NOTE: Keep the marker when there is nothing new, to wait
+        # for the next messages like an actual observer.
+        if status == 200:
+            self.stats['list'].messages += len(document['messages'])
+            for link in document['links']:
+                if link['rel'] == 'next':
+                    self._next = link['href']
+
+
+class Claimer(Worker):
+
+    def __init__(self, client, queue_path, batch):
+        super(Claimer, self).__init__(client, queue_path, batch)
+        self._body = json.dumps({'ttl': 60, 'grace': 60})
+
+    def step(self):
+        status, messages = self._call('claim', 'POST',
+                                      '%s/claims?limit=%d' %
+                                      (self.queue_path, self.batch),
+                                      self._body)
+        if status != 201:
+            return
+
+        self.stats['claim'].messages += len(messages)
+
+        for message in messages:
+            status, document = self._call('delete', 'DELETE',
+                                          message['href'])
+            if status == 204:
+                self.stats['delete'].messages += 1
+
+
+def run_threads(workers, duration):
+    """Runs each worker on a thread of its own."""
+    deadline = time.time() + duration
+
+    def loop(worker):
+        while time.time() < deadline:
+            worker.step()
+
+    threads = [threading.Thread(target=loop, args=(worker,))
+               for worker in workers]
+
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+
+def run_inline(workers, duration):
+    """Runs the workers in turn, on the current thread."""
+    deadline = time.time() + duration
+
+    while time.time() < deadline:
+        for worker in workers:
+            worker.step()
+
+
+def percentile(values, p):
+    """Returns the p-th percentile of sorted values (nearest rank)."""
+    if not values:
+        return None
+
+    rank = int(math.ceil(p / 100.0 * len(values)))
+    return values[max(rank, 1) - 1]
+
+
+def report(workers, elapsed, out=sys.stdout):
+    """Prints the throughput and latencies of each operation."""
+    print('%-8s %9s %7s %10s' % ('', 'requests', 'errors', 'msgs/sec') +
+          ''.join(' %8s' % ('p%d' % p) for p in PERCENTILES) +
+          ' %8s (ms)' % 'max', file=out)
+
+    for operation in OPERATIONS:
+        stats = Stats()
+        for worker in workers:
+            stats.merge(worker.stats[operation])
+
+        if not stats.latencies:
+            continue
+
+        latencies = sorted(stats.latencies)
+        columns = [percentile(latencies, p) for p in PERCENTILES]
+        columns.append(latencies[-1])
+
+        print('%-8s %9d %7d %10.1f' % (operation, len(latencies),
+                                       stats.errors,
+                                       stats.messages / elapsed) +
+              ''.join(' %8.2f' % (seconds * 1000) for seconds in columns),
+              file=out)
+
+
+def _parser():
+    parser = argparse.ArgumentParser(
+        prog='marconi-bench',
+        description='Load generator for the Marconi queues API. '
+                    'Without --url, the WSGI app is run in-process, '
+                    'per the config file.')
+
+    parser.add_argument('--url',
+                        help='base URL of a running server, e.g. '
+                             'http://localhost:8888')
+    parser.add_argument('--storage',
+                        help='storage driver of the in-process app, '
+                             'overriding the config file')
+    parser.add_argument('--duration', type=float, default=10.0,
+                        help='seconds to run for (default: 10)')
+    parser.add_argument('--producers', type=int, default=1)
+    parser.add_argument('--observers', type=int, default=1)
+    parser.add_argument('--claimers', type=int, default=1)
+    parser.add_argument('--queues', type=int, default=1,
+                        help='number of queues the workers are spread '
+                             'over (default: 1)')
+    parser.add_argument('--batch', type=int, default=10,
+                        help='messages per post, listing and claim '
+                             '(default: 10)')
+    parser.add_argument('--message-size', type=int, default=256,
+                        help='bytes of payload per message '
+                             '(default: 256)')
+    parser.add_argument('--project', default='bench',
+                        help='X-Project-ID of the requests')
+    parser.add_argument('--token',
+                        help='X-Auth-Token of the requests, if the '
+                             'server requires authentication')
+
+    return parser
+
+
+def main(argv):
+    """Runs a benchmark per the command line arguments.
+
+    Arguments not known to the benchmark, such as --config-file, are
+    passed on to the configuration of the in-process app.
+    """
+    parser = _parser()
+    args, rest = parser.parse_known_args(argv)
+
+    if args.url:
+        if rest:
+            parser.error('unrecognized arguments: ' + ' '.join(rest))
+
+        target = args.url
+
+        def client(headers):
+            return HTTPClient(args.url, headers)
+
+        inline = False
+
+    else:
+        boot = bootstrap.Bootstrap(cli_args=rest)
+
+        PROJECT_CFG.conf.set_override('transport', 'wsgi', group='drivers')
+        if args.storage:
+            PROJECT_CFG.conf.set_override('storage', args.storage,
+                                          group='drivers')
+
+        app = boot.transport.app
+        target = bootstrap.CFG.storage + ' (in-process)'
+
+        def client(headers):
+            return WSGIClient(app, headers)
+
+        inline = bootstrap.CFG.storage == 'sqlite'
+
+    def headers():
+        headers = {'X-Project-ID': args.project,
+                   'Client-ID': str(uuid.uuid4()),
+                   'Accept': 'application/json'}
+
+        if args.token:
+            headers['X-Auth-Token'] = args.token
+
+        return headers
+
+    run_id = uuid.uuid4().hex[:8]
+    queue_paths = ['/v1/queues/bench-%s-%d' % (run_id, n)
+                   for n in range(args.queues)]
+
+    admin = client(headers())
+    for path in queue_paths:
+        status, data = admin.request('PUT', path)
+        if status not in (201, 204):
+            print('Could not create %s: %d' % (path, status),
+                  file=sys.stderr)
+            return 1
+
+    workers = []
+    for kind, count in ((Producer, args.producers),
+                        (Observer, args.observers),
+                        (Claimer, args.claimers)):
+        for n in range(count):
+            queue_path = queue_paths[n % len(queue_paths)]
+
+            if kind is Producer:
+                worker = kind(client(headers()), queue_path, args.batch,
+                              args.message_size)
+            else:
+                worker = kind(client(headers()), queue_path, args.batch)
+
+            workers.append(worker)
+
+    print('%s: %d producers, %d observers, %d claimers on %d queue(s), '
+          '%d messages per batch, %.0f seconds%s' %
+          (target, args.producers, args.observers, args.claimers,
+           args.queues, args.batch, args.duration,
+           ', on one thread' if inline else ''))
+
+    start = time.time()
+
+    try:
+        if inline:
+            run_inline(workers, args.duration)
+        else:
+            run_threads(workers, args.duration)
+    finally:
+        elapsed = time.time() - start
+
+        for path in queue_paths:
+            admin.request('DELETE', path)
+
+    report(workers, elapsed)
+    return 0
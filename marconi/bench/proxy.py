@@ -0,0 +1,255 @@
+# Copyright (c) 2013 Rackspace, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Micro-benchmark for the overhead of the proxy.
+
+Runs the proxy app in-process, with an in-memory stand-in for Redis
+(marconi.tests.fake_redis) and stub partition nodes served over HTTP
+on the loopback interface, which answer every request at once with a
+canned response. Times, in msec per request:
+
+    lookup     finding the host of a queue in the catalogue
+    direct     requesting a message listing from a node, over a
+               persistent connection
+    proxied    the same request, forwarded by the proxy
+
+The difference between proxied and direct is the overhead of the
+proxy. Then, for catalogues of growing size, times the first page of
+the detailed queue listing and the full catalogue listing, both served
+by the proxy from the catalogue alone.
+
+The stand-in answers without a network round trip, which an actual
+Redis server costs for each command or pipeline of commands; the
+number of round trips per request is reported as well, to account for
+it.
+
+Usage:
+
+    python -m marconi.bench.proxy [iterations]
+"""
+
+from __future__ import print_function
+
+import json
+import socket
+import sys
+import threading
+import time
+
+import requests
+
+from marconi.bench import load
+from marconi.proxy import app as proxy_app
+from marconi.proxy.utils import helpers
+from marconi.queues.transport.wsgi import server
+from marconi.tests import fake_redis
+
+PROJECT = 'bench-project'
+NODES = 2
+NODE_THREADS = 8
+CATALOGUE_SIZES = (10, 100, 1000, 10000)
+
+_LISTING = json.dumps({
+    'messages': [{'href': '/v1/queues/bench/messages/%024x' % n,
+                  'ttl': 300, 'age': n, 'body': {'event': 'bench'}}
+                 for n in range(10)],
+    'links': [{'rel': 'next',
+               'href': '/v1/queues/bench/messages?marker=10'}],
+})
+
+
+def _stub_node(env, start_response):
+    """Answers like a Marconi node, without doing anything."""
+    length = int(env.get('CONTENT_LENGTH') or 0)
+    env['wsgi.input'].read(length)
+
+    if env['REQUEST_METHOD'] == 'PUT':
+        start_response('201 Created', [('Content-Length', '0')])
+        return []
+
+    if env['REQUEST_METHOD'] == 'DELETE':
+        start_response('204 No Content', [])
+        return []
+
+    start_response('200 OK', [('Content-Type', 'application/json'),
+                              ('Content-Length', str(len(_LISTING)))])
+    return [_LISTING]
+
+
+def start_node():
+    """Serves a stub node on an ephemeral port, from daemon threads.
+
+    The node keeps the connections alive between requests, as
+    marconi-server does.
+
+    :returns: The URL of the node, and its worker
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(('127.0.0.1', 0))
+    sock.listen(128)
+
+    port = sock.getsockname()[1]
+    worker = server.Worker(sock, _stub_node, '127.0.0.1', port,
+                           threads=NODE_THREADS)
+
+    thread = threading.Thread(target=worker.run)
+    thread.daemon = True
+    thread.start()
+
+    return 'http://127.0.0.1:%d' % port, worker
+
+
+class _Counting(object):
+    """Counts the round trips to a Redis client.
+
+    A pipeline of commands counts as one.
+    """
+
+    def __init__(self, client):
+        self.commands = 0
+        self._client = client
+
+    def __getattr__(self, name):
+        command = getattr(self._client, name)
+
+        def wrapper(*args, **kwargs):
+            self.commands += 1
+            return command(*args, **kwargs)
+
+        return wrapper
+
+
+def _msec_per_call(func, iterations, redis_client):
+    """Times a function.
+
+    :returns: The mean, p50 and p99 msec per call, and the number of
+        round trips to Redis per call
+    """
+    # NOTE: Warm up the caches and the connections first
+    for i in range(min(iterations, 10)):
+        func()
+
+    latencies = []
+    commands = redis_client.commands
+
+    for i in range(iterations):
+        start = time.time()
+        func()
+        latencies.append(time.time() - start)
+
+    latencies.sort()
+    return (sum(latencies) / iterations * 1000,
+            load.percentile(latencies, 50) * 1000,
+            load.percentile(latencies, 99) * 1000,
+            (redis_client.commands - commands) // iterations)
+
+
+def _check(status, expected, what):
+    if status != expected:
+        raise RuntimeError('%s failed with status %d' % (what, status))
+
+
+def _fill_catalogue(client, size, host):
+    client.delete('qs.%s' % PROJECT)
+
+    for n in range(size):
+        name = 'queue-%06d' % n
+        client.hmset('q.%s.%s' % (PROJECT, name), {'h': host, 'n': name})
+        client.zadd('qs.%s' % PROJECT, 0, name)
+
+
+def run(iterations=200):
+    """Runs the benchmark and prints the time per request, in msec."""
+    redis_client = _Counting(fake_redis.StrictRedis())
+    app = proxy_app.make_app(redis_client)
+    proxy = load.WSGIClient(app, {'X-Project-ID': PROJECT,
+                                  'Client-ID': 'bench',
+                                  'Accept': 'application/json'})
+
+    nodes, workers = zip(*[start_node() for n in range(NODES)])
+
+    try:
+        _run(redis_client, proxy, list(nodes), iterations)
+    finally:
+        for worker in workers:
+            worker.stop()
+
+
+def _run(redis_client, proxy, nodes, iterations):
+    status, body = proxy.request('PUT', '/v1/partitions/bench',
+                                 json.dumps({'nodes': nodes, 'weight': 1}))
+    _check(status, 201, 'Registering the partition')
+
+    status, body = proxy.request('PUT', '/v1/queues/bench')
+    _check(status, 201, 'Creating the queue')
+
+    path = '/v1/queues/bench/messages?echo=true'
+    host = helpers.get_host_by_project_and_queue(redis_client, PROJECT,
+                                                 'bench')
+    session = requests.Session()
+    session.headers.update({'X-Project-ID': PROJECT, 'Client-ID': 'bench'})
+
+    def lookup():
+        helpers.get_host_by_project_and_queue(redis_client, PROJECT,
+                                              'bench')
+
+    def direct():
+        session.get(host + path).content
+
+    def proxied():
+        proxy.request('GET', path)
+
+    print('Forwarded message listing, %d nodes (msec per request):' %
+          NODES)
+    print('  %-10s %8s %8s %8s %6s' % ('', 'mean', 'p50', 'p99', 'trips'))
+
+    results = {}
+    for name, func in (('lookup', lookup), ('direct', direct),
+                       ('proxied', proxied)):
+        results[name] = _msec_per_call(func, iterations, redis_client)
+        print('  %-10s %8.3f %8.3f %8.3f %6d' % ((name,) + results[name]))
+
+    print('  %-10s %8.3f' % ('overhead',
+                             results['proxied'][0] - results['direct'][0]))
+
+    print('Listings by catalogue size (mean msec per request):')
+    print('  %-10s %12s %6s %14s %6s' % ('queues', '/v1/queues', 'trips',
+                                         '/v1/catalogue', 'trips'))
+
+    for size in CATALOGUE_SIZES:
+        _fill_catalogue(redis_client, size, host)
+
+        def listing():
+            status, body = proxy.request('GET',
+                                         '/v1/queues?limit=10&detailed=true')
+            _check(status, 200, 'Listing the queues')
+
+        def catalogue():
+            status, body = proxy.request('GET', '/v1/catalogue')
+            _check(status, 200, 'Listing the catalogue')
+
+        # NOTE: Bounds the time spent on the larger catalogues
+        repeat = max(iterations * 10 // size, 3)
+
+        listed = _msec_per_call(listing, repeat, redis_client)
+        catalogued = _msec_per_call(catalogue, repeat, redis_client)
+
+        print('  %-10d %12.3f %6d %14.3f %6d' %
+              (size, listed[0], listed[3], catalogued[0], catalogued[3]))
+
+
+if __name__ == '__main__':
+    run(*[int(arg) for arg in sys.argv[1:2]])
@@ -0,0 +1,188 @@
+# Copyright (c) 2013 Rackspace, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Micro-benchmark for the per-call SQL overhead of the SQLite driver.
+
+Compares building the message listing SQL by concatenation on every
+call, as the controllers used to, against looking up the prebuilt
+variant; executing that SQL when its text varies, so that SQLite
+prepares it anew, against executing the same text, prepared once; and
+times the hot controller calls with the smallest statement cache and
+with the default one.
+
+Note that pysqlite keeps at least 5 statements, whatever the size
+asked for, so that no connection runs uncached.
+
+Usage:
+
+    python -m marconi.bench.sqlite_statements [iterations]
+"""
+
+from __future__ import print_function
+
+import itertools
+import sqlite3
+import sys
+import timeit
+
+from marconi.common import config
+from marconi.queues.storage import sqlite
+
+PROJECT_CFG = config.project('marconi')
+
+QUEUE = 'bench'
+PROJECT = 'bench-project'
+
+# NOTE: pysqlite raises any smaller cache size to this one
+MIN_CACHED_STATEMENTS = 5
+
+
+def _concatenated_list_sql(echo, marker, include_claimed):
+    """Builds the listing SQL the way it was done before prebuilding."""
+    sql = '''
+        select M.id, content, ttl, julianday() * 86400.0 - created
+          from Queues as Q join Messages as M
+            on M.qid = Q.id
+         where M.ttl > julianday() * 86400.0 - created
+           and Q.name = ? and Q.project = ?'''
+
+    if not echo:
+        sql += '''
+           and M.client != ?'''
+
+    if marker:
+        sql += '''
+           and M.id > ?'''
+
+    if not include_claimed:
+        sql += '''
+           and M.id not in (select msgid
+                              from Claims join Locked
+                                on id = cid)'''
+
+    sql += '''
+         limit ?'''
+
+    return sql
+
+
+def _connection(cached_statements):
+    """Returns a bare connection holding a few messages to list."""
+    conn = sqlite3.connect(':memory:', cached_statements=cached_statements)
+    conn.executescript('''
+        create table Queues (id integer primary key, project, name);
+        create table Messages (id integer primary key, qid, ttl,
+                               content, client, created);
+        create table Claims (id integer primary key);
+        create table Locked (cid, msgid);
+    ''')
+    conn.execute('''insert into Queues values (1, ?, ?)''',
+                 (PROJECT, QUEUE))
+    conn.executemany('''
+        insert into Messages
+             values (null, 1, 300, ?, 'bench', julianday() * 86400.0)''',
+                     [(str(n),) for n in range(20)])
+    return conn
+
+
+def _controllers(cached_statements):
+    PROJECT_CFG.conf.set_override('cached_statements', cached_statements,
+                                  group='drivers:storage:sqlite')
+    try:
+        driver = sqlite.Driver()
+    finally:
+        PROJECT_CFG.conf.clear_override('cached_statements',
+                                        group='drivers:storage:sqlite')
+
+    # NOTE: Instantiating a controller creates its tables
+    driver.claim_controller
+    driver.queue_controller.create(QUEUE, PROJECT)
+
+    messages = driver.message_controller
+    messages.post(QUEUE, [{'ttl': 300, 'body': {'n': n}}
+                          for n in range(20)],
+                  client_uuid='bench', project=PROJECT)
+
+    return driver.queue_controller, messages
+
+
+def _usec_per_call(func, iterations):
+    seconds = min(timeit.repeat(func, number=iterations, repeat=3))
+    return seconds / iterations * 1e6
+
+
+def run(iterations=2000):
+    """Runs the benchmark and prints the time per call, in usec."""
+    variants = [(False, True, False), (True, False, True)]
+    prebuilt = dict((v, _concatenated_list_sql(*v)) for v in variants)
+
+    def concatenate():
+        for variant in variants:
+            _concatenated_list_sql(*variant)
+
+    def lookup():
+        for variant in variants:
+            prebuilt[variant]
+
+    print('SQL construction, %d variants per call:' % len(variants))
+    print('  %-24s %8.2f usec' % ('concatenated',
+                                  _usec_per_call(concatenate, iterations)))
+    print('  %-24s %8.2f usec' % ('prebuilt',
+                                  _usec_per_call(lookup, iterations)))
+
+    sql = _concatenated_list_sql(True, False, True)
+    conn = _connection(256)
+    counter = itertools.count()
+
+    def prepared():
+        conn.execute(sql, (QUEUE, PROJECT, 10)).fetchall()
+
+    def reprepared():
+        # NOTE: The comment makes the text, hence the statement,
+        # differ on every call, so that the cache never serves it.
+        conn.execute(sql + ' -- %d' % next(counter),
+                     (QUEUE, PROJECT, 10)).fetchall()
+
+    print('Listing statement, cached_statements=256:')
+    print('  %-24s %8.2f usec' % ('prepared on every call',
+                                  _usec_per_call(reprepared, iterations)))
+    print('  %-24s %8.2f usec' % ('prepared once',
+                                  _usec_per_call(prepared, iterations)))
+
+    print('Controller calls:')
+    for cached_statements in (MIN_CACHED_STATEMENTS, 256):
+        queues, messages = _controllers(cached_statements)
+
+        def list_messages():
+            interaction = messages.list(QUEUE, PROJECT, limit=10,
+                                        echo=True)
+            list(next(interaction))
+
+        calls = [
+            ('MessageController.list', list_messages),
+            ('MessageController.first',
+             lambda: messages.first(QUEUE, PROJECT, sort=-1)),
+            ('QueueController.stats',
+             lambda: queues.stats(QUEUE, PROJECT)),
+        ]
+
+        for name, func in calls:
+            print('  %-24s %8.2f usec  (cached_statements=%d)' %
+                  (name, _usec_per_call(func, iterations),
+                   cached_statements))
+
+
+if __name__ == '__main__':
+    run(*[int(arg) for arg in sys.argv[1:2]])
@@ -0,0 +1,284 @@
+# Copyright (c) 2013 Rackspace, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Micro-benchmark for the controllers of a storage driver.
+
+Runs the controller calls exercised by tests/unit/storage/base.py
+against any driver registered under marconi.storage, at a given
+scale, and times each call:
+
+    queue_create    creates each queue
+    message_post    posts the messages to each queue, in batches
+    message_list    lists each page of each queue
+    queue_stats     gets the stats of each queue
+    claim_create    claims the messages of each queue, in batches...
+    message_delete  ...and deletes each of them under its claim
+    gc              collects garbage once, if the driver supports it
+    queue_delete    deletes each queue
+
+The results are written as JSON, so that runs can be compared; with
+--compare, the mean latency of each call is also compared to that of
+an earlier run.
+
+Usage:
+
+    python -m marconi.bench.storage [--storage mongodb]
+        [--config-file marconi.conf] [--queues 4] [--messages 1000]
+        [--batch 10] [--output results.json] [--compare baseline.json]
+"""
+
+from __future__ import print_function
+
+import argparse
+import datetime
+import json
+import platform
+import sys
+import time
+import uuid
+
+from marconi.bench import load
+from marconi.common import config
+from marconi.queues import bootstrap
+
+PROJECT_CFG = config.project('marconi')
+
+PROJECT = 'bench-project'
+CLAIM_METADATA = {'ttl': 60, 'grace': 60}
+
+
+class _Timings(object):
+    """Latencies of the calls made by a benchmark."""
+
+    def __init__(self):
+        self.latencies = []
+        self.messages = 0
+
+    def time(self, func, *args, **kwargs):
+        start = time.time()
+        result = func(*args, **kwargs)
+        self.latencies.append(time.time() - start)
+        return result
+
+    def summary(self):
+        latencies = sorted(self.latencies)
+        total = sum(latencies)
+
+        summary = {
+            'calls': len(latencies),
+            'total_s': round(total, 6),
+            'mean_ms': round(total / len(latencies) * 1000, 3),
+            'max_ms': round(latencies[-1] * 1000, 3),
+        }
+
+        for p in load.PERCENTILES:
+            summary['p%d_ms' % p] = round(
+                load.percentile(latencies, p) * 1000, 3)
+
+        if total:
+            summary['calls_per_sec'] = round(len(latencies) / total, 1)
+
+        if self.messages:
+            summary['messages'] = self.messages
+            if total:
+                summary['messages_per_sec'] = round(self.messages / total, 1)
+
+        return summary
+
+
+def _list_page(controller, queue, marker, batch):
+    results = controller.list(queue, project=PROJECT, marker=marker,
+                              limit=batch, echo=True,
+                              client_uuid=str(uuid.uuid4()))
+    page = list(next(results))
+    return page, next(results) if page else None
+
+
+def _list_all(controller, queue, batch, listed):
+    """Lists a queue page by page, timing each page."""
+    marker = None
+
+    while True:
+        page, marker = listed.time(_list_page, controller, queue, marker,
+                                   batch)
+        if not page:
+            return
+
+        listed.messages += len(page)
+
+
+def _claim_page(controller, queue, batch):
+    claim_id, messages = controller.create(queue, CLAIM_METADATA,
+                                           project=PROJECT, limit=batch)
+    return claim_id, list(messages)
+
+
+def run(driver, queues=4, messages=1000, batch=10):
+    """Runs the benchmarks against a storage driver.
+
+    :param driver: The storage driver
+    :param queues: (Default 4) number of queues
+    :param messages: (Default 1000) number of messages per queue
+    :param batch: (Default 10) messages per post, page and claim
+    :returns: The summary of each benchmark, by name
+    """
+    queue_controller = driver.queue_controller
+    message_controller = driver.message_controller
+    claim_controller = driver.claim_controller
+
+    names = ['bench-%s-%d' % (uuid.uuid4().hex[:8], n)
+             for n in range(queues)]
+    client_uuid = str(uuid.uuid4())
+    body = {'event': 'bench', 'data': 'x' * 256}
+
+    timings = {}
+
+    def timing(name):
+        return timings.setdefault(name, _Timings())
+
+    for name in names:
+        timing('queue_create').time(queue_controller.create, name,
+                                    project=PROJECT)
+
+    try:
+        for name in names:
+            posted = timing('message_post')
+            for n in range(0, messages, batch):
+                page = [{'ttl': 300, 'body': body}
+                        for i in range(min(batch, messages - n))]
+
+                posted.time(message_controller.post, name, page,
+                            client_uuid, project=PROJECT)
+                posted.messages += len(page)
+
+        for name in names:
+            _list_all(message_controller, name, batch,
+                      timing('message_list'))
+
+            timing('queue_stats').time(queue_controller.stats, name,
+                                       project=PROJECT)
+
+        for name in names:
+            claimed = timing('claim_create')
+            deleted = timing('message_delete')
+
+            while True:
+                claim_id, page = claimed.time(_claim_page, claim_controller,
+                                              name, batch)
+                if not page:
+                    break
+
+                claimed.messages += len(page)
+
+                for message in page:
+                    deleted.time(message_controller.delete, name,
+                                 message['id'], project=PROJECT,
+                                 claim=claim_id)
+                    deleted.messages += 1
+
+        try:
+            timing('gc').time(driver.gc)
+        except NotImplementedError:
+            del timings['gc']
+
+    finally:
+        for name in names:
+            timing('queue_delete').time(queue_controller.delete, name,
+                                        project=PROJECT)
+
+    # NOTE: Some calls are never made at some scales, e.g. deletes
+    # when no messages are posted.
+    return dict((name, value.summary()) for name, value in timings.items()
+                if value.latencies)
+
+
+def compare(results, baseline, out=sys.stdout):
+    """Prints the change in mean latency of each benchmark."""
+    print('%-16s %12s %12s %8s' % ('', 'baseline ms', 'mean ms', 'change'),
+          file=out)
+
+    for name in sorted(results['results']):
+        new = results['results'][name]['mean_ms']
+        try:
+            old = baseline['results'][name]['mean_ms']
+        except KeyError:
+            continue
+
+        change = (new - old) / old * 100 if old else 0.0
+        print('%-16s %12.3f %12.3f %+7.1f%%' % (name, old, new, change),
+              file=out)
+
+
+def main(argv):
+    """Runs the benchmarks per the command line arguments.
+
+    Arguments not known to the benchmark, such as --config-file, are
+    passed on to the configuration.
+    """
+    parser = argparse.ArgumentParser(
+        prog='python -m marconi.bench.storage',
+        description='Micro-benchmark for the storage drivers.')
+
+    parser.add_argument('--storage',
+                        help='storage driver, overriding the config file')
+    parser.add_argument('--queues', type=int, default=4)
+    parser.add_argument('--messages', type=int, default=1000,
+                        help='messages per queue (default: 1000)')
+    parser.add_argument('--batch', type=int, default=10,
+                        help='messages per post, page and claim '
+                             '(default: 10)')
+    parser.add_argument('--output',
+                        help='file to write the results to, instead of '
+                             'the standard output')
+    parser.add_argument('--compare',
+                        help='results of an earlier run to compare to')
+
+    args, rest = parser.parse_known_args(argv)
+
+    boot = bootstrap.Bootstrap(cli_args=rest)
+    if args.storage:
+        PROJECT_CFG.conf.set_override('storage', args.storage,
+                                      group='drivers')
+
+    results = {
+        'driver': bootstrap.CFG.storage,
+        'scale': {
+            'queues': args.queues,
+            'messages': args.messages,
+            'batch': args.batch,
+        },
+        'python': platform.python_version(),
+        'date': datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+        'results': run(boot.storage, args.queues, args.messages, args.batch),
+    }
+
+    document = json.dumps(results, indent=2, sort_keys=True,
+                          separators=(',', ': '))
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            output.write(document + '\n')
+    else:
+        print(document)
+
+    if args.compare:
+        with open(args.compare) as baseline:
+            compare(results, json.load(baseline), out=sys.stderr)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -20,6 +20,7 @@ import time
 
 from marconi.common import cli
 from marconi.common import config
+from marconi.common import metrics
 from marconi.openstack.common import log as logging
 from marconi.queues import bootstrap
 
@@ -47,6 +48,11 @@ def run():
         storage_driver = boot.storage
         gc_interval = storage_driver.gc_interval
 
+        # NOTE: The metrics of this process can only be sent to statsd
+        registry = metrics.from_config()
+        if registry is not None:
+            storage_driver.instrument(registry)
+
         # NOTE(kgriffs): Don't want all garbage collector
         # instances running at the same time (will peg the DB).
         offset = random.random() * gc_interval
@@ -0,0 +1,64 @@
+# Copyright (c) 2013 Rackspace, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Context of the request being served by the current thread.
+
+Once stored, the context is picked up by the loggers, so that every
+line logged while serving a request carries its ID, down to the
+storage drivers.
+"""
+
+import uuid
+
+from marconi.openstack.common import local
+
+
+def generate_request_id():
+    return 'req-' + str(uuid.uuid4())
+
+
+class RequestContext(object):
+    """Identifies a request, and the project it is made for.
+
+    :param request_id: (Default None) the request ID, or None to
+        generate one
+    :param tenant: (Default None) the project ID
+    """
+
+    __slots__ = ('request_id', 'tenant', '__weakref__')
+
+    def __init__(self, request_id=None, tenant=None):
+        self.request_id = request_id or generate_request_id()
+        self.tenant = tenant
+
+    def to_dict(self):
+        return {
+            'request_id': self.request_id,
+            'user': None,
+            'tenant': self.tenant,
+        }
+
+    def update_store(self):
+        """Makes this the context of the current thread.
+
+        Only a weak reference is stored, so the caller must keep a
+        reference to the context while serving the request.
+        """
+        local.store.context = self
+
+
+def get_current():
+    """Returns the context of the current thread, or None."""
+    return getattr(local.store, 'context', None)
@@ -0,0 +1,421 @@
+# Copyright (c) 2013 Rackspace, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Request and storage call metrics.
+
+Timers count calls and errors, and sort their latencies into a fixed
+histogram; histograms do the same for other values, and counters
+count events. They are kept in memory for the admin endpoint, and
+may also be sent to a statsd server as they are recorded.
+"""
+
+import bisect
+import functools
+import inspect
+import re
+import socket
+import threading
+import time
+import types
+
+from marconi.common import config
+
+CFG = config.namespace('metrics').from_options(
+    enabled=False,
+    statsd_host='',
+    statsd_port=8125,
+    statsd_prefix='marconi',
+)
+
+# NOTE: Upper bounds of the histogram buckets, in milliseconds; the
+# last bucket holds everything slower.
+BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+_BOUNDS = tuple(bound / 1000.0 for bound in BUCKETS)
+
+_STATSD_UNSAFE = re.compile(r'[^\w.-]+')
+
+
+class Timer(object):
+    """Counts the calls to something, and how long they took.
+
+    :param name: Name of the timer
+    :param emitter: (Default None) if given, each call is also sent
+        to it as it is recorded
+    """
+
+    __slots__ = ('name', 'count', 'errors', 'total', 'histogram',
+                 '_lock', '_emitter', '_key')
+
+    def __init__(self, name, emitter=None):
+        self.name = name
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.histogram = [0] * (len(_BOUNDS) + 1)
+
+        self._lock = threading.Lock()
+        self._emitter = emitter
+        self._key = emitter and emitter.key(name)
+
+    def record(self, seconds, error=False):
+        """Records a call.
+
+        :param seconds: How long the call took
+        :param error: Whether the call failed
+        """
+        bucket = bisect.bisect_left(_BOUNDS, seconds)
+
+        with self._lock:
+            self.count += 1
+            self.errors += error
+            self.total += seconds
+            self.histogram[bucket] += 1
+
+        if self._emitter is not None:
+            payload = '%s:%.3f|ms' % (self._key, seconds * 1000)
+            if error:
+                payload += '\n%s.errors:1|c' % self._key
+
+            self._emitter.send(payload)
+
+    def snapshot(self):
+        """Returns the counters, as a JSON-serializable dict."""
+        with self._lock:
+            count, errors, total = self.count, self.errors, self.total
+            histogram = list(self.histogram)
+
+        return {
+            'count': count,
+            'errors': errors,
+            'mean_ms': round(total * 1000 / count, 3) if count else None,
+            'histogram': [[bound, n] for bound, n in
+                          zip(BUCKETS + (None,), histogram)],
+        }
+
+
+class Histogram(object):
+    """Sorts the values taken by something into buckets.
+
+    :param name: Name of the histogram
+    :param buckets: Upper bounds of the buckets, in increasing order;
+        the last bucket holds the greater values
+    :param emitter: (Default None) if given, each value is also sent
+        to it as it is recorded
+    """
+
+    __slots__ = ('name', 'buckets', 'count', 'total', 'histogram',
+                 '_lock', '_emitter', '_key')
+
+    def __init__(self, name, buckets, emitter=None):
+        self.name = name
+        self.buckets = tuple(buckets)
+        self.count = 0
+        self.total = 0
+        self.histogram = [0] * (len(self.buckets) + 1)
+
+        self._lock = threading.Lock()
+        self._emitter = emitter
+        self._key = emitter and emitter.key(name)
+
+    def record(self, value):
+        """Records a value."""
+        bucket = bisect.bisect_left(self.buckets, value)
+
+        with self._lock:
+            self.count += 1
+            self.total += value
+            self.histogram[bucket] += 1
+
+        if self._emitter is not None:
+            self._emitter.send('%s:%s|h' % (self._key, value))
+
+    def snapshot(self):
+        """Returns the counters, as a JSON-serializable dict."""
+        with self._lock:
+            count, total = self.count, self.total
+            histogram = list(self.histogram)
+
+        return {
+            'count': count,
+            'mean': round(float(total) / count, 3) if count else None,
+            'histogram': [[bound, n] for bound, n in
+                          zip(self.buckets + (None,), histogram)],
+        }
+
+
+class Counter(object):
+    """Counts how often something happens.
+
+    :param name: Name of the counter
+    :param emitter: (Default None) if given, each increment is also
+        sent to it
+    """
+
+    __slots__ = ('name', 'value', '_lock', '_emitter', '_key')
+
+    def __init__(self, name, emitter=None):
+        self.name = name
+        self.value = 0
+
+        self._lock = threading.Lock()
+        self._emitter = emitter
+        self._key = emitter and emitter.key(name)
+
+    def increment(self, n=1):
+        with self._lock:
+            self.value += n
+
+        if self._emitter is not None:
+            self._emitter.send('%s:%d|c' % (self._key, n))
+
+    def snapshot(self):
+        return self.value
+
+
+class Registry(object):
+    """Holds the timers, histograms and counters, by name.
+
+    :param emitter: (Default None) passed on to the metrics
+    """
+
+    def __init__(self, emitter=None):
+        self._emitter = emitter
+        self._lock = threading.Lock()
+
+        self._timers = {}
+        self._histograms = {}
+        self._counters = {}
+
+    def _get(self, metrics, name, factory):
+        with self._lock:
+            try:
+                return metrics[name]
+            except KeyError:
+                metric = metrics[name] = factory()
+                return metric
+
+    def timer(self, name):
+        """Returns the timer with the given name, creating it if need be.
+
+        Look the metrics up once, rather than each time they are
+        recorded.
+        """
+        return self._get(self._timers, name,
+                         lambda: Timer(name, self._emitter))
+
+    def histogram(self, name, buckets):
+        """Returns the named histogram, creating it if need be.
+
+        :param buckets: Upper bounds of the buckets of a new histogram
+        """
+        return self._get(self._histograms, name,
+                         lambda: Histogram(name, buckets, self._emitter))
+
+    def counter(self, name):
+        """Returns the named counter, creating it if need be."""
+        return self._get(self._counters, name,
+                         lambda: Counter(name, self._emitter))
+
+    def snapshot(self):
+        """Returns the state of all the metrics, by kind and name."""
+        with self._lock:
+            metrics = {
+                'timers': self._timers.values(),
+                'histograms': self._histograms.values(),
+                'counters': self._counters.values(),
+            }
+
+        return dict((kind, dict((metric.name, metric.snapshot())
+                                for metric in values))
+                    for kind, values in metrics.iteritems())
+
+
+class StatsdEmitter(object):
+    """Sends the metrics to a statsd server over UDP, as recorded.
+
+    A call to a timer named "MessageController.post" is sent as:
+
+        <prefix>.MessageController.post:<milliseconds>|ms
+
+    followed by "<prefix>.MessageController.post.errors:1|c" if it
+    failed. Histograms are sent as "<prefix>.<name>:<value>|h", and
+    counters as "<prefix>.<name>:<increment>|c". The datagrams are
+    not acknowledged, so that sending them costs about as much as a
+    system call; send errors are ignored.
+
+    :param host: statsd host
+    :param port: statsd port
+    :param prefix: (Default 'marconi') prepended to the metric names
+    """
+
+    def __init__(self, host, port, prefix='marconi'):
+        self._address = (socket.gethostbyname(host), port)
+        self._prefix = prefix
+
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.setblocking(0)
+
+    def key(self, name):
+        """Returns the statsd name of a metric, with the prefix."""
+        return self._prefix + '.' + _STATSD_UNSAFE.sub('_', name).strip('_')
+
+    def send(self, payload):
+        try:
+            self._sock.sendto(payload, self._address)
+        except socket.error:
+            pass
+
+
+def from_config():
+    """Returns a registry configured per the metrics options.
+
+    :returns: a Registry, or None if metrics are disabled
+    """
+    if not CFG.enabled:
+        return None
+
+    emitter = None
+    if CFG.statsd_host:
+        emitter = StatsdEmitter(CFG.statsd_host, CFG.statsd_port,
+                                CFG.statsd_prefix)
+
+    return Registry(emitter)
+
+
+def measured_call(fn, run, finish, *args, **kwargs):
+    """Calls a function, along with any generator it returns.
+
+    Advancing a generator returned by the function is part of the
+    call, which only finishes once the generator is exhausted, closed
+    or has raised.
+
+    :param fn: The function to call
+    :param run: Runs each step of the call, as run(step, *args,
+        **kwargs): first the function, then each next() of its
+        generator, if any
+    :param finish: Called once the call is over, with the exception
+        that ended it, or None
+    :returns: What the function returned, or a generator over what
+        its generator yields
+    """
+    try:
+        result = run(fn, *args, **kwargs)
+    except Exception as ex:
+        finish(ex)
+        raise
+
+    if not isinstance(result, types.GeneratorType):
+        finish(None)
+        return result
+
+    return _measured_generator(result, run, finish)
+
+
+def _measured_generator(generator, run, finish):
+    error = None
+
+    try:
+        while True:
+            try:
+                item = run(next, generator)
+
+            except StopIteration:
+                return
+
+            except Exception as ex:
+                error = ex
+                raise
+
+            yield item
+
+    finally:
+        finish(error)
+
+
+def timed(fn, timer, is_error=None):
+    """Wraps a function, so that its calls are recorded by a timer.
+
+    Generators returned by the function are wrapped as well, so that
+    the time spent advancing them is added to the call, which is only
+    recorded once they are exhausted or closed (see measured_call).
+
+    :param fn: The function to wrap
+    :param timer: The timer recording the calls
+    :param is_error: (Default None) if given, a function telling
+        whether an exception raised by fn is to be counted as an
+        error; otherwise, they all are
+    """
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        elapsed = [0.0]
+
+        def run(step, *args, **kwargs):
+            start = time.time()
+            try:
+                return step(*args, **kwargs)
+            finally:
+                elapsed[0] += time.time() - start
+
+        def finish(ex):
+            timer.record(elapsed[0], ex is not None and
+                         (is_error is None or is_error(ex)))
+
+        return measured_call(fn, run, finish, *args, **kwargs)
+
+    # NOTE: Frameworks such as falcon check the arguments taken by
+    # the functions they call, and look them up here if wrapped.
+    wrapper.wrapped_argspec = getattr(fn, 'wrapped_argspec', None)
+    if wrapper.wrapped_argspec is None:
+        wrapper.wrapped_argspec = inspect.getargspec(fn)
+
+    return wrapper
+
+
+class Instrumented(object):
+    """Proxies an object, timing the calls to its public methods.
+
+    The timers are named "<prefix>.<method>", where the prefix
+    defaults to the name of the object's class; for example,
+    "MessageController.post". Other attributes are passed through.
+
+    :param obj: The object to proxy
+    :param registry: The registry holding the timers
+    :param prefix: (Default None) prefix of the timer names
+    :param is_error: (Default None) passed on to timed()
+    """
+
+    def __init__(self, obj, registry, prefix=None, is_error=None):
+        # NOTE: Proxies may report the class of the object they wrap
+        cls = obj.__class__
+
+        if prefix is None:
+            prefix = cls.__name__
+
+        self.__obj = obj
+
+        # NOTE: The methods are wrapped once, so that calling them
+        # costs no more than a lookup in the instance dict.
+        for name in dir(cls):
+            if (name.startswith('_') or
+                    not inspect.ismethod(getattr(cls, name))):
+                continue
+
+            timer = registry.timer(prefix + '.' + name)
+            setattr(self, name, timed(getattr(obj, name), timer, is_error))
+
+    def __getattr__(self, name):
+        return getattr(self.__obj, name)
@@ -20,7 +20,7 @@ Supports the following operator API:
 - [GET] /v1/catalogue
 
 Deploy requirements:
-- redis-server, default port
+- redis-server >= 2.8.9, default port
 - gunicorn
 - python >= 2.7
 - falcon
@@ -29,6 +29,9 @@ Deploy requirements:
 
 Running:
 - gunicorn marconi.proxy.app:app
+
+The [proxy] options of the marconi config take their defaults, unless
+the process serving the app loads the config before the first request.
 """
 import falcon
 import redis
@@ -41,41 +44,53 @@ from marconi.proxy.resources import partitions
 from marconi.proxy.resources import queues
 from marconi.proxy.resources import v1
 
-app = falcon.API()
-client = redis.StrictRedis()
 
-# TODO(cpp-cabrera): don't encode API version in routes -
-#                    let's handle this elsewhere
-# NOTE(cpp-cabrera): Proxy-specific routes
-app.add_route('/v1/partitions',
-              partitions.Listing(client))
-app.add_route('/v1/partitions/{partition}',
-              partitions.Resource(client))
-app.add_route('/v1/catalogue',
-              catalogue.Listing(client))
-app.add_route('/v1/catalogue/{queue}',
-              catalogue.Resource(client))
+def make_app(client):
+    """Builds the proxy app, keeping its catalogue in a Redis client.
+
+    :param client: A redis.StrictRedis, or an object serving the same
+        commands
+    """
+    app = falcon.API()
+
+    # TODO(cpp-cabrera): don't encode API version in routes -
+    #                    let's handle this elsewhere
+    # NOTE(cpp-cabrera): Proxy-specific routes
+    app.add_route('/v1/partitions',
+                  partitions.Listing(client))
+    app.add_route('/v1/partitions/{partition}',
+                  partitions.Resource(client))
+    app.add_route('/v1/catalogue',
+                  catalogue.Listing(client))
+    app.add_route('/v1/catalogue/{queue}',
+                  catalogue.Resource(client))
 
-# NOTE(cpp-cabrera): queue handling routes
-app.add_route('/v1/queues',
-              queues.Listing(client))
-app.add_route('/v1/queues/{queue}',
-              queues.Resource(client))
+    # NOTE(cpp-cabrera): queue handling routes
+    app.add_route('/v1/queues',
+                  queues.Listing(client))
+    app.add_route('/v1/queues/{queue}',
+                  queues.Resource(client))
 
-# NOTE(cpp-cabrera): Marconi forwarded routes
-app.add_route('/v1',
-              v1.Resource(client))
-app.add_route('/v1/health',
-              health.Resource(client))
-app.add_route('/v1/queues/{queue}/claims',
-              forward.ClaimCreate(client))
-app.add_route('/v1/queues/{queue}/claims/{cid}',
-              forward.Claim(client))
-app.add_route('/v1/queues/{queue}/messages',
-              forward.MessageBulk(client))
-app.add_route('/v1/queues/{queue}/messages/{mid}',
-              forward.Message(client))
-app.add_route('/v1/queues/{queue}/stats',
-              forward.Stats(client))
-app.add_route('/v1/queues/{queue}/metadata',
-              metadata.Resource(client))
+    # NOTE(cpp-cabrera): Marconi forwarded routes
+    app.add_route('/v1',
+                  v1.Resource(client))
+    app.add_route('/v1/health',
+                  health.Resource(client))
+    app.add_route('/v1/queues/{queue}/claims',
+                  forward.ClaimCreate(client))
+    app.add_route('/v1/queues/{queue}/claims/{cid}',
+                  forward.Claim(client))
+    app.add_route('/v1/queues/{queue}/messages',
+                  forward.MessageBulk(client))
+    app.add_route('/v1/queues/{queue}/messages/{mid}',
+                  forward.Message(client))
+    app.add_route('/v1/queues/{queue}/stats',
+                  forward.Stats(client))
+    app.add_route('/v1/queues/{queue}/metadata',
+                  metadata.Resource(client))
+
+    return app
+
+
+client = redis.StrictRedis()
+app = make_app(client)
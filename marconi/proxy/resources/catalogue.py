@@ -24,10 +24,11 @@ Storage maintains an entry for each queue as follows:
 "n" -> name
 "h" -> HTTP host
 
-A list of all queues is also stored as:
+The names of the queues of each project are also stored, as a sorted
+set ordered by name (each with a score of 0):
 
 {
-  qs.{project}: [{name}, {name}, {name}]
+  qs.{project}: {{name}, {name}, {name}}
 }
 """
 import json
@@ -45,16 +46,19 @@ class Listing(object):
 
     def on_get(self, request, response):
         project = helpers.get_project(request)
-        key = 'qs.%s' % project
+        key = helpers.get_queues_key(self.client, project)
         if not self.client.exists(key):
             response.status = falcon.HTTP_204
             return
 
+        queues = [q.decode('utf8') for q in self.client.zrange(key, 0, -1)]
+
+        pipe = self.client.pipeline(transaction=False)
+        for queue in queues:
+            pipe.hmget('q.%s.%s' % (project, queue), ['h', 'n', 'm'])
+
         resp = {}
-        for q in self.client.lrange(key, 0, -1):
-            hkey = 'q.%s.%s' % (project, q.decode('utf8'))
-            queue = q.decode('utf8')
-            h, n, m = self.client.hmget(hkey, ['h', 'n', 'm'])
+        for queue, (h, n, m) in zip(queues, pipe.execute()):
             if not all([h, n]):
                 continue
 
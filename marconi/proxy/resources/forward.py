@@ -30,7 +30,7 @@ class ClaimCreate(object):
 
     def on_post(self, request, response, queue):
         resp = helpers.forward(self.client, request, queue)
-        response.set_headers(resp.headers)
+        response.set_headers(http.headers(resp))
         response.status = http.status(resp.status_code)
         response.body = resp.content
 
@@ -42,7 +42,7 @@ class Claim(object):
 
     def _forward_claim(self, request, response, queue):
         resp = helpers.forward(self.client, request, queue)
-        response.set_headers(resp.headers)
+        response.set_headers(http.headers(resp))
         response.status = http.status(resp.status_code)
         response.body = resp.content
 
@@ -63,7 +63,7 @@ class MessageBulk(object):
 
     def _forward_message(self, request, response, queue):
         resp = helpers.forward(self.client, request, queue)
-        response.set_headers(resp.headers)
+        response.set_headers(http.headers(resp))
         response.status = http.status(resp.status_code)
         response.body = resp.content
 
@@ -84,7 +84,7 @@ class Message(object):
 
     def _forward_message(self, request, response, queue):
         resp = helpers.forward(self.client, request, queue)
-        response.set_headers(resp.headers)
+        response.set_headers(http.headers(resp))
         response.status = http.status(resp.status_code)
         response.body = resp.content
 
@@ -102,7 +102,7 @@ class Stats(object):
 
     def _forward_stats(self, request, response, queue):
         resp = helpers.forward(self.client, request, queue)
-        response.set_headers(resp.headers)
+        response.set_headers(http.headers(resp))
         response.status = http.status(resp.status_code)
         response.body = resp.content
 
@@ -15,8 +15,6 @@
 """health: queries the first node in the first partition for health
 responses.
 """
-import requests
-
 from marconi.proxy.utils import helpers
 from marconi.proxy.utils import http
 
@@ -27,6 +25,6 @@ class Resource(object):
 
     def on_get(self, request, response):
         node = helpers.get_first_host(self.client)
-        resp = requests.get(node + '/v1/health')
+        resp = http.request('get', node + '/v1/health')
         response.status = http.status(resp.status_code)
         response.body = resp.content
@@ -17,7 +17,6 @@ marconi queue metadata requests.
 """
 import falcon
 import msgpack
-import requests
 
 from marconi.proxy.utils import helpers
 from marconi.proxy.utils import http
@@ -49,5 +48,6 @@ class Resource(object):
             project = helpers.get_project(request)
             host = helpers.get_host_by_project_and_queue(self.client,
                                                          project, queue)
-            resp = requests.get(host + '/v1/queues/%s/metadata' % queue)
+            resp = http.request('get',
+                                host + '/v1/queues/%s/metadata' % queue)
             self.client.hset(key, 'm', msgpack.dumps(resp.json()))
@@ -25,15 +25,16 @@ consistent with the state of the entire deployment.
 For the case of accessing a particular queue, the catalogue is updated
 based on the operation. A DELETE removes entries from the catalogue. A
 PUT adds an entry to the catalogue. A GET asks marconi for an
-authoritative response.
+authoritative response. Either change to an entry is announced to the
+cache of the catalogue in every proxy worker.
 """
 import collections
 import json
 
 import falcon
 import msgpack
-import requests
 
+from marconi.proxy.utils import cache
 from marconi.proxy.utils import helpers
 from marconi.proxy.utils import http
 from marconi.proxy.utils import node
@@ -48,34 +49,42 @@ class Listing(object):
 
     def on_get(self, request, response):
         project = helpers.get_project(request)
-        key = 'qs.%s' % project
-        if not self.client.exists(key):
-            response.status = falcon.HTTP_204
-            return
+        key = helpers.get_queues_key(self.client, project)
 
         kwargs = {}
         request.get_param('marker', store=kwargs)
         request.get_param_as_int('limit', store=kwargs)
         request.get_param_as_bool('detailed', store=kwargs)
 
+        # NOTE: The queues are kept with equal scores, so that they
+        # are ranged in lexicographical order, starting after the
+        # marker; a page costs O(log n + limit).
+        start = '(' + kwargs['marker'] if 'marker' in kwargs else '-'
+        if 'limit' in kwargs:
+            names = self.client.zrangebylex(key, start, '+',
+                                            start=0, num=kwargs['limit'])
+        else:
+            names = self.client.zrangebylex(key, start, '+')
+
+        queues = [q.decode('utf8') for q in names]
+
+        if kwargs.get('detailed', None):
+            pipe = self.client.pipeline(transaction=False)
+            for queue in queues:
+                pipe.hget('q.%s.%s' % (project, queue), 'm')
+            metadata = pipe.execute()
+
         resp = collections.defaultdict(list)
-        for q in sorted(self.client.lrange(key, 0, -1)):
-            queue = q.decode('utf8')
-            if queue < kwargs.get('marker', 0):
-                continue
+        for i, queue in enumerate(queues):
             entry = {
                 'href': request.path + '/' + queue,
                 'name': queue
             }
             if kwargs.get('detailed', None):
-                qkey = 'q.%s.%s' % (project, queue)
-                data = self.client.hget(qkey, 'm')
-                metadata = msgpack.loads(data)
-                entry['metadata'] = metadata
+                data = metadata[i]
+                entry['metadata'] = msgpack.loads(data) if data else {}
             resp['queues'].append(entry)
             kwargs['marker'] = queue
-            if len(resp['queues']) == kwargs.get('limit', None):
-                break
 
         if not resp:
             response.status = falcon.HTTP_204
@@ -99,16 +108,10 @@ class Resource(object):
         return 'q.%s.%s' % (project, queue)
 
     def on_get(self, request, response, queue):
-        key = self._make_key(request, queue)
-        if not self.client.exists(key):
-            raise falcon.HTTPNotFound()
-
-        h, n = self.client.hmget(key, ['h', 'n'])
-        if not (h and n):
-            raise falcon.HTTPNotFound()
-
+        # NOTE: forward raises HTTPNotFound for a queue
+        # missing from the catalogue
         resp = helpers.forward(self.client, request, queue)
-        response.set_headers(resp.headers)
+        response.set_headers(http.headers(resp))
         response.status = http.status(resp.status_code)
         response.body = resp.content
 
@@ -122,7 +125,7 @@ class Resource(object):
         partition = node.weighted_select(self.client)
         host = node.round_robin(self.client, partition)
         url = '{host}/v1/queues/{queue}'.format(host=host, queue=queue)
-        resp = requests.put(url, headers=request._headers)
+        resp = http.request('put', url, headers=request._headers)
 
         # NOTE(cpp-cabrera): only catalogue a queue if a request is good
         if resp.ok:
@@ -130,7 +133,9 @@ class Resource(object):
                 'h': host,
                 'n': queue
             })
-            self.client.rpush('qs.%s' % project, queue)
+            self.client.zadd(helpers.get_queues_key(self.client, project),
+                             0, queue)
+            cache.catalogue(self.client).invalidate(project, queue)
 
         response.status = http.status(resp.status_code)
         response.body = resp.content
@@ -140,10 +145,12 @@ class Resource(object):
 
         project = helpers.get_project(request)
         resp = helpers.forward(self.client, request, queue)
-        response.set_headers(resp.headers)
+        response.set_headers(http.headers(resp))
         response.status = http.status(resp.status_code)
 
         # avoid deleting a queue if the request is bad
         if not resp.ok:
             self.client.hdel(key, queue)
-            self.client.lrem('qs.%s' % project, 1, queue)
+            self.client.zrem(helpers.get_queues_key(self.client, project),
+                             queue)
+            cache.catalogue(self.client).invalidate(project, queue)
@@ -13,8 +13,6 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 """v1: queries the first node in the first partition for a homedoc."""
-import requests
-
 from marconi.proxy.utils import helpers
 from marconi.proxy.utils import http
 
@@ -25,6 +23,6 @@ class Resource(object):
 
     def on_get(self, request, response):
         node = helpers.get_first_host(self.client)
-        resp = requests.get(node + '/v1')
+        resp = http.request('get', node + '/v1')
         response.status = http.status(resp.status_code)
         response.body = resp.content
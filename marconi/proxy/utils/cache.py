@@ -0,0 +1,181 @@
+# Copyright (c) 2013 Rackspace Hosting, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""cache: an in-process cache of the hosts of the catalogued queues.
+
+Each proxy worker keeps the host of the queues it routes to in a
+least-recently-used cache, so that forwarding a request does not cost
+a round trip to Redis. Entries expire after a while, and are dropped
+as soon as a change to the catalogue is announced on a Redis pub/sub
+channel, which every worker listens to:
+
+{
+  qc: msgpack([{project}, {queue}])
+}
+"""
+import collections
+import threading
+import time
+
+import msgpack
+
+from marconi.common import config
+from marconi.openstack.common import log as logging
+
+CFG = config.namespace('proxy').from_options(
+    catalogue_cache_size=10000,
+    catalogue_cache_ttl=30.0,
+)
+
+LOG = logging.getLogger(__name__)
+
+CHANNEL = 'qc'
+
+# NOTE: Seconds to wait before subscribing again, when the connection
+# to Redis is lost.
+_RETRY_DELAY = 1.0
+
+_catalogues = {}
+_catalogues_lock = threading.Lock()
+
+
+def _decode(value):
+    return value.decode('utf8') if isinstance(value, bytes) else value
+
+
+class Catalogue(object):
+    """The hosts of the queues, as found in the catalogue.
+
+    :param client: The Redis client holding the catalogue
+    :param size: Number of entries kept; 0 disables the cache
+    :param ttl: Seconds an entry is kept for
+    """
+
+    def __init__(self, client, size, ttl):
+        self._client = client
+        self._size = size
+        self._ttl = ttl
+
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+        # NOTE: Bumped by each invalidation, so that a lookup racing
+        # with one does not cache what it read before.
+        self._generation = 0
+        self._listener = None
+
+    def lookup(self, project, queue):
+        """Returns the host of a queue, or None if not catalogued."""
+        if not self._size:
+            return self._fetch(project, queue)
+
+        self._listen()
+
+        key = (project, queue)
+        now = time.time()
+
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None and entry[1] > now:
+                self._entries[key] = entry
+                return entry[0]
+
+            generation = self._generation
+
+        host = self._fetch(project, queue)
+        if host is None:
+            return None
+
+        with self._lock:
+            if generation == self._generation:
+                self._entries[key] = (host, now + self._ttl)
+                while len(self._entries) > self._size:
+                    self._entries.popitem(last=False)
+
+        return host
+
+    def invalidate(self, project, queue):
+        """Drops a queue from the cache of every worker.
+
+        To be called whenever the catalogue entry of the queue is
+        changed. The entry is dropped here at once, and from the other
+        workers once they receive the announcement.
+        """
+        self._forget(project, queue)
+        self._client.publish(CHANNEL, msgpack.dumps([project, queue]))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._generation += 1
+
+    def _fetch(self, project, queue):
+        host = self._client.hget('q.%s.%s' % (project, queue), 'h')
+        return host.decode('utf8') if host is not None else None
+
+    def _forget(self, project, queue):
+        with self._lock:
+            self._entries.pop((project, queue), None)
+            self._generation += 1
+
+    def _listen(self):
+        """Starts listening to the announcements, once."""
+        if self._listener is not None:
+            return
+
+        with self._lock:
+            if self._listener is None:
+                self._listener = threading.Thread(target=self._run)
+                self._listener.daemon = True
+                self._listener.start()
+
+    def _run(self):
+        while True:
+            try:
+                pubsub = self._client.pubsub()
+                pubsub.subscribe(CHANNEL)
+
+                for message in pubsub.listen():
+                    # NOTE: Announcements may have been missed while
+                    # not subscribed, so start afresh.
+                    if message['type'] == 'subscribe':
+                        self.clear()
+
+                    elif message['type'] == 'message':
+                        project, queue = msgpack.loads(message['data'])
+                        self._forget(_decode(project), _decode(queue))
+
+            except Exception as ex:
+                LOG.warning(_(u'Lost the catalogue announcements, '
+                              u'retrying: %s'), ex)
+
+            # NOTE: Nothing announced from now on can be relied on,
+            # until subscribed again.
+            self.clear()
+            time.sleep(_RETRY_DELAY)
+
+
+def catalogue(client):
+    """Returns the cached catalogue kept in a Redis client.
+
+    The catalogue is created on first use, per the [proxy] options,
+    and shared by all the threads of the process.
+    """
+    with _catalogues_lock:
+        if client not in _catalogues:
+            _catalogues[client] = Catalogue(client,
+                                            CFG.catalogue_cache_size,
+                                            CFG.catalogue_cache_ttl)
+
+        return _catalogues[client]
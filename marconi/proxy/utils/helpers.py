@@ -13,9 +13,22 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 """helpers: utilities for performing common operations for resources."""
+import collections
+import threading
+import weakref
+
 import falcon
 import msgpack
-import requests
+
+from marconi.proxy.utils import cache
+from marconi.proxy.utils import http
+
+# NOTE: The keys of the queue names known to be sorted sets, by
+# client, so that their type is not checked on every access. As many
+# are kept, least recently used first, as the catalogue cache holds
+# queues.
+_sorted_keys = weakref.WeakKeyDictionary()
+_sorted_keys_lock = threading.Lock()
 
 
 def get_first_host(client):
@@ -33,12 +46,45 @@ def get_first_host(client):
 def get_host_by_project_and_queue(client, project, queue):
     """Fetches the host address for a given project and queue.
 
+    The address is looked up in the cache of the catalogue first.
+
     :returns: a host address as stored or None if not found
     """
-    key = 'q.%s.%s' % (project, queue)
-    if not client.exists(key):
-        return None
-    return client.hget(key, 'h').decode('utf8')
+    return cache.catalogue(client).lookup(project, queue)
+
+
+def get_queues_key(client, project):
+    """Returns the key of the names of the queues of a project.
+
+    The names used to be kept in a list; such a list is converted to a
+    sorted set on first access.
+    """
+    key = 'qs.%s' % project
+
+    with _sorted_keys_lock:
+        known = _sorted_keys.setdefault(client, collections.OrderedDict())
+        if known.pop(key, None):
+            known[key] = True
+            return key
+
+    def convert(pipe):
+        if pipe.type(key) != b'list':
+            return
+
+        names = pipe.lrange(key, 0, -1)
+        pipe.multi()
+        pipe.delete(key)
+        if names:
+            pipe.zadd(key, *[arg for name in names for arg in (0, name)])
+
+    client.transaction(convert, key)
+
+    with _sorted_keys_lock:
+        known[key] = True
+        while len(known) > cache.CFG.catalogue_cache_size:
+            known.popitem(last=False)
+
+    return key
 
 
 def get_project(request):
@@ -64,6 +110,6 @@ def forward(client, request, queue):
     if request.query_string:
         url += '?' + request.query_string
     method = request.method.lower()
-    resp = requests.request(method, url, headers=request._headers,
-                            data=request.stream.read())
+    resp = http.request(method, url, headers=request._headers,
+                        data=request.stream.read())
     return resp
@@ -13,7 +13,31 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 """http: utilities for handling HTTP details."""
+import threading
+
 import falcon
+import requests
+import requests.adapters
+import requests.structures
+
+from marconi.common import config
+
+CFG = config.namespace('proxy').from_options(
+    pool_size=10,
+    pool_nodes=100,
+    connect_timeout=5.0,
+    read_timeout=60.0,
+)
+
+# NOTE: Headers describing a connection rather than the message; see
+# RFC 2616, section 13.5.1. The length of the body is set anew, by
+# falcon for the responses and by requests for the requests.
+_HOP_BY_HOP = frozenset(['connection', 'keep-alive', 'proxy-authenticate',
+                         'proxy-authorization', 'te', 'trailers',
+                         'transfer-encoding', 'upgrade', 'content-length'])
+
+_session = None
+_session_lock = threading.Lock()
 
 
 _code_map = dict((int(v.split()[0]), v)
@@ -27,3 +51,53 @@ def status(code):
     :raises: KeyError for an unknown HTTP status code
     """
     return _code_map[code]
+
+
+def session():
+    """Returns the session shared by all the requests to the nodes.
+
+    The session keeps a pool of persistent connections to each node,
+    so that requests do not pay for setting up a connection.
+    """
+    global _session
+
+    with _session_lock:
+        if _session is None:
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=CFG.pool_nodes,
+                pool_maxsize=CFG.pool_size)
+
+            _session = requests.Session()
+            _session.mount('http://', adapter)
+            _session.mount('https://', adapter)
+
+        return _session
+
+
+def request(method, url, **kwargs):
+    """Sends a request to a node, over a pooled connection.
+
+    Takes the same arguments as requests.request, and applies the
+    configured timeouts unless given.
+
+    :returns: a python-requests response object
+    """
+    kwargs.setdefault('timeout', (CFG.connect_timeout, CFG.read_timeout))
+
+    # NOTE: A "Connection: close" passed on from the client would
+    # close the pooled connection after the request.
+    if kwargs.get('headers'):
+        kwargs['headers'] = _end_to_end(kwargs['headers'])
+
+    return session().request(method, url, **kwargs)
+
+
+def headers(resp):
+    """Returns the headers of a node's response to pass on."""
+    return _end_to_end(resp.headers)
+
+
+def _end_to_end(headers):
+    return requests.structures.CaseInsensitiveDict(
+        (name, value) for name, value in headers.items()
+        if name.lower() not in _HOP_BY_HOP)
@@ -44,6 +44,16 @@ class DriverBase:
         """
         raise NotImplementedError
 
+    def instrument(self, registry):
+        """Records the driver's own metrics in a registry.
+
+        Called when metrics are enabled, before any controller is
+        used. Drivers without metrics of their own need not
+        override this method.
+
+        :param registry: A marconi.common.metrics.Registry
+        """
+
     @abc.abstractproperty
     def queue_controller(self):
         """Returns storage's queues controller."""
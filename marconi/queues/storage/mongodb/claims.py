@@ -163,6 +163,8 @@ class ClaimController(storage.ClaimBase):
                                        {'$set': {'c': meta}}, upsert=False,
                                        multi=True)['n']
 
+        self.driver.instruments.claim_shortfall(len(ids), updated)
+
         # NOTE(flaper87): Dirty hack!
         # This sets the expiration time to
         # `expires` on messages that would
@@ -15,13 +15,17 @@
 
 """Mongodb storage driver implementation."""
 
+import time
+
 import pymongo
 import pymongo.errors
 
 from marconi.openstack.common import log as logging
 from marconi.queues import storage
 from marconi.queues.storage.mongodb import controllers
+from marconi.queues.storage.mongodb import instruments
 from marconi.queues.storage.mongodb import options
+from marconi.queues.storage.mongodb import slowlog
 
 LOG = logging.getLogger(__name__)
 
@@ -32,6 +36,29 @@ class Driver(storage.DriverBase):
         # Lazy instantiation
         self._database = None
 
+        self.instruments = instruments.NullInstruments()
+        self.slowlog = slowlog.from_config()
+
+    def instrument(self, registry):
+        self.instruments = instruments.Instruments(registry)
+
+    def collection(self, name):
+        """Returns a collection of the DB, wrapped for diagnostics."""
+        collection = self.instruments.collection(self.db[name])
+
+        if self.slowlog is not None:
+            collection = self.slowlog.collection(collection)
+
+        return collection
+
+    def _controller(self, controller):
+        controller = self.instruments.controller(controller)
+
+        if self.slowlog is not None:
+            controller = self.slowlog.controller(controller)
+
+        return controller
+
     @property
     def db(self):
         """Property for lazy instantiation of mongodb's database."""
@@ -48,11 +75,16 @@ class Driver(storage.DriverBase):
     def gc(self):
         LOG.info(_(u'Performing garbage collection.'))
 
+        start = time.time()
+
         try:
             self.message_controller.remove_expired()
         except pymongo.errors.ConnectionFailure as ex:
             # Better luck next time...
             LOG.exception(ex)
+            self.instruments.gc_duration(time.time() - start, error=True)
+        else:
+            self.instruments.gc_duration(time.time() - start)
 
     @property
     def gc_interval(self):
@@ -60,12 +92,12 @@ class Driver(storage.DriverBase):
 
     @property
     def queue_controller(self):
-        return controllers.QueueController(self)
+        return self._controller(controllers.QueueController(self))
 
     @property
     def message_controller(self):
-        return controllers.MessageController(self)
+        return self._controller(controllers.MessageController(self))
 
     @property
     def claim_controller(self):
-        return controllers.ClaimController(self)
+        return self._controller(controllers.ClaimController(self))
@@ -0,0 +1,197 @@
+# Copyright (c) 2013 Rackspace, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Metrics of the MongoDB driver, for sizing the cluster.
+
+mongodb.<Controller>.<method>.round_trips (histogram)
+    Number of operations sent to the DB by each call to a controller
+    method, including the calls it makes to other controllers. Each
+    operation counts as one round trip; fetching more results from
+    a cursor does not count.
+
+mongodb.MessageController.post.attempts (histogram)
+    Number of inserts needed to post a batch of messages.
+
+mongodb.MessageController.post.marker_collisions (counter)
+    Number of inserts that failed because a parallel post to the
+    same queue took the same marker.
+
+mongodb.ClaimController.create.shortfall (counter)
+    Number of messages that were found claimable, but were claimed
+    by a parallel request before they could be.
+
+mongodb.gc (timer)
+    Duration of each garbage collection.
+"""
+
+import functools
+import threading
+import types
+
+from marconi.common import metrics
+
+ROUND_TRIP_BUCKETS = (1, 2, 3, 4, 5, 6, 8, 10, 15, 20, 50)
+ATTEMPT_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100)
+
+# NOTE: Collection methods that send an operation to the DB
+OPERATIONS = ('aggregate', 'count', 'distinct', 'find', 'find_and_modify',
+              'find_one', 'insert', 'remove', 'save', 'update')
+
+
+class _CallState(threading.local):
+    depth = 0
+    round_trips = 0
+
+
+class Instruments(object):
+    """Records the metrics of a MongoDB driver.
+
+    :param registry: The registry holding the metrics
+    """
+
+    def __init__(self, registry):
+        self._registry = registry
+        self._state = _CallState()
+
+        self._post_attempts = registry.histogram(
+            'mongodb.MessageController.post.attempts', ATTEMPT_BUCKETS)
+        self._marker_collisions = registry.counter(
+            'mongodb.MessageController.post.marker_collisions')
+        self._claim_shortfall = registry.counter(
+            'mongodb.ClaimController.create.shortfall')
+
+        self._gc = registry.timer('mongodb.gc')
+
+    def collection(self, collection):
+        """Counts the operations sent through a collection."""
+        return _Collection(collection, self._state)
+
+    def controller(self, controller):
+        """Counts the round trips made by each call to a controller."""
+        return _Controller(controller, self._registry, self._state)
+
+    def post_attempts(self, attempts):
+        self._post_attempts.record(attempts)
+
+    def marker_collision(self):
+        self._marker_collisions.increment()
+
+    def claim_shortfall(self, found, claimed):
+        if claimed < found:
+            self._claim_shortfall.increment(found - claimed)
+
+    def gc_duration(self, seconds, error=False):
+        self._gc.record(seconds, error)
+
+
+class NullInstruments(object):
+    """Records nothing, when metrics are disabled."""
+
+    def collection(self, collection):
+        return collection
+
+    def controller(self, controller):
+        return controller
+
+    def post_attempts(self, attempts):
+        pass
+
+    def marker_collision(self):
+        pass
+
+    def claim_shortfall(self, found, claimed):
+        pass
+
+    def gc_duration(self, seconds, error=False):
+        pass
+
+
+class _Collection(object):
+
+    def __init__(self, collection, state):
+        self.__collection = collection
+
+        for name in OPERATIONS:
+            setattr(self, name,
+                    _counted(getattr(collection, name), state))
+
+    def __getattr__(self, name):
+        return getattr(self.__collection, name)
+
+
+def _counted(operation, state):
+    def wrapper(*args, **kwargs):
+        state.round_trips += 1
+        return operation(*args, **kwargs)
+
+    return wrapper
+
+
+class _Controller(object):
+
+    def __init__(self, controller, registry, state):
+        self.__controller = controller
+
+        cls = controller.__class__
+        prefix = 'mongodb.' + cls.__name__ + '.'
+
+        for name in dir(cls):
+            if (name.startswith('_') or
+                    not isinstance(getattr(cls, name), types.MethodType)):
+                continue
+
+            histogram = registry.histogram(prefix + name + '.round_trips',
+                                           ROUND_TRIP_BUCKETS)
+            setattr(self, name,
+                    _per_call(getattr(controller, name), histogram, state))
+
+    def __getattr__(self, name):
+        return getattr(self.__controller, name)
+
+    # NOTE: Lets metrics.Instrumented, and the checks made by callers,
+    # see the class of the controller rather than the proxy's.
+    @property
+    def __class__(self):
+        return self.__controller.__class__
+
+
+def _per_call(method, histogram, state):
+    """Records the round trips of the outermost controller calls.
+
+    The round trips of the generators returned by the calls are added
+    as they are advanced, and recorded once they are exhausted or
+    closed.
+    """
+
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        if state.depth:
+            return method(*args, **kwargs)
+
+        round_trips = [0]
+
+        def run(step, *args, **kwargs):
+            state.depth, state.round_trips = 1, round_trips[0]
+            try:
+                return step(*args, **kwargs)
+            finally:
+                state.depth, round_trips[0] = 0, state.round_trips
+
+        def finish(ex):
+            histogram.record(round_trips[0])
+
+        return metrics.measured_call(method, run, finish, *args, **kwargs)
+
+    return wrapper
@@ -97,10 +97,11 @@ class MessageController(storage.MessageBase):
         self._queue_controller = self.driver.queue_controller
         self._db = self.driver.db
         self._retry_range = range(options.CFG.max_attempts)
+        self._instruments = self.driver.instruments
 
         # Make sure indexes exist before,
         # doing anything.
-        self._col = self._db['messages']
+        self._col = self.driver.collection('messages')
 
         self._ensure_indexes()
 
@@ -547,6 +548,8 @@ class MessageController(storage.MessageBase):
                     aggregated_results.extend(ids)
                     ids = aggregated_results
 
+                self._instruments.post_attempts(attempt + 1)
+
                 # Log a message if we retried, for debugging perf issues
                 if attempt != 0:
                     message = _(u'%(attempts)d attempt(s) required to post '
@@ -565,9 +568,8 @@ class MessageController(storage.MessageBase):
                 # NOTE(kgriffs): This can be used in conjunction with the
                 # log line, above, that is emitted after all messages have
                 # been posted, to guage how long it is taking for messages
-                # to be posted to a given queue, or overall.
-                #
-                # TODO(kgriffs): Add transaction ID to help match up loglines
+                # to be posted to a given queue, or overall. Both lines
+                # carry the ID of the request set by the transport.
                 if attempt == 0:
                     message = _(u'First attempt failed while '
                                 u'adding messages to queue %s '
@@ -575,9 +577,9 @@ class MessageController(storage.MessageBase):
 
                     LOG.debug(message)
 
-                # TODO(kgriffs): Record stats of how often retries happen,
-                # and how many attempts, on average, are required to insert
-                # messages.
+                # NOTE: How often retries happen, and how many attempts
+                # are required on average, is recorded by the instruments.
+                self._instruments.marker_collision()
 
                 # NOTE(kgriffs): Slice prepared_messages. We have to interpret
                 # the error message to get the duplicate key, which gives
@@ -622,6 +624,8 @@ class MessageController(storage.MessageBase):
 
         LOG.warning(message)
 
+        self._instruments.post_attempts(options.CFG.max_attempts)
+
         succeeded_ids = map(str, aggregated_results)
         raise exceptions.MessageConflict(queue_name, project, succeeded_ids)
 
@@ -42,6 +42,17 @@ OPTIONS = {
 
     # Frequency of message garbage collections, in seconds
     'gc_interval': 5 * 60,
+
+    # Controller calls taking longer than this many seconds are
+    # logged, with the explain plans of their queries; 0 disables
+    # the slow call log.
+    'slow_call_threshold': 0.0,
+
+    # Fraction of the controller calls timed for the slow call log
+    'slow_call_sample_rate': 0.1,
+
+    # Seconds before the same shape of query is explained again
+    'slow_call_explain_interval': 60,
 }
 
 CFG = config.namespace('drivers:storage:mongodb').from_options(**OPTIONS)
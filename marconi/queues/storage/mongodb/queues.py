@@ -52,7 +52,7 @@ class QueueController(storage.QueueBase):
     def __init__(self, *args, **kwargs):
         super(QueueController, self).__init__(*args, **kwargs)
 
-        self._col = self.driver.db['queues']
+        self._col = self.driver.collection('queues')
         # NOTE(flaper87): This creates a unique compound index for
         # project and name. Using project as the first field of the
         # index allows for querying by project and project+name.
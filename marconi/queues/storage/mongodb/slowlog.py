@@ -0,0 +1,320 @@
+# Copyright (c) 2013 Rackspace, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Log of the slow controller calls, with the plans of their queries.
+
+A sample of the controller calls is timed, along with the operations
+they send to the DB. When a call takes longer than the threshold, it
+is logged as a warning listing each operation with the shape of its
+query (the values replaced by their type) and, for queries, a summary
+of their explain plan: the index used, and the number of keys and
+documents scanned.
+
+The plans are only requested for slow calls, and at most once per
+interval for each shape of query sent by an operation to a collection,
+so that slow calls do not all make another round trip. Only finds are
+explained: the plan of a write is not the one of a find with the same
+query, for it may be planned differently.
+"""
+
+import random
+import threading
+import time
+import types
+
+import pymongo.errors
+
+from marconi.common import metrics
+from marconi.openstack.common import log as logging
+from marconi.queues.storage.mongodb import instruments
+from marconi.queues.storage.mongodb import options
+
+LOG = logging.getLogger(__name__)
+
+# NOTE: Bounds the memory used by calls making many operations, such
+# as listings of many queues.
+MAX_OPERATIONS = 20
+
+# NOTE: Operations whose plan explain() reproduces
+_EXPLAINED = ('find', 'find_one')
+
+
+class _Trace(threading.local):
+    operations = None
+
+
+class SlowLog(object):
+    """Logs the controller calls taking longer than a threshold.
+
+    :param threshold: Duration of the calls to log, in seconds
+    :param sample_rate: (Default 1.0) fraction of the calls to time
+    :param explain_interval: (Default 60) seconds before the same
+        shape of query is explained again
+    """
+
+    def __init__(self, threshold, sample_rate=1.0, explain_interval=60):
+        self._threshold = threshold
+        self._sample_rate = sample_rate
+        self._explain_interval = explain_interval
+        self._trace = _Trace()
+
+        # (collection, operation, query shape) => time last explained
+        self._explained = {}
+        self._lock = threading.Lock()
+
+    def collection(self, collection):
+        """Records the operations sent through a collection."""
+        return _Collection(collection, self._trace)
+
+    def controller(self, controller):
+        """Times a sample of the calls to a controller."""
+        return _Controller(controller, self)
+
+    def _sampled(self):
+        return (self._trace.operations is None and
+                random.random() < self._sample_rate)
+
+    def _check(self, call):
+        if call.elapsed < self._threshold:
+            return
+
+        lines = [_(u'Slow call to %(name)s: %(ms)d ms, %(count)d '
+                   u'operation(s)') % {'name': call.name,
+                                       'ms': call.elapsed * 1000,
+                                       'count': len(call.operations)}]
+
+        lines.extend(u'  ' + operation.describe(self._explainable(operation))
+                     for operation in call.operations)
+
+        LOG.warning(u'\n'.join(lines))
+
+    def _explainable(self, operation):
+        if (operation.name not in _EXPLAINED or
+                not isinstance(operation.query, dict)):
+            return False
+
+        key = (operation.collection.name, operation.name,
+               repr(shape(operation.query)))
+        now = time.time()
+
+        with self._lock:
+            if self._explained.get(key, 0) + self._explain_interval > now:
+                return False
+
+            self._explained[key] = now
+            return True
+
+
+class _Call(object):
+    """A sampled call, and the operations it sent."""
+
+    __slots__ = ('name', 'elapsed', 'operations', '_trace')
+
+    def __init__(self, name, trace):
+        self.name = name
+        self.elapsed = 0.0
+        self.operations = []
+        self._trace = trace
+
+    def run(self, fn, *args, **kwargs):
+        self._trace.operations = self.operations
+        start = time.time()
+
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            self.elapsed += time.time() - start
+            self._trace.operations = None
+
+
+class _Operation(object):
+    """An operation sent to a collection, and its result."""
+
+    __slots__ = ('collection', 'name', 'args', 'kwargs', 'query',
+                 'result')
+
+    def __init__(self, collection, name, args, kwargs):
+        self.collection = collection
+        self.name = name
+        self.args = args
+        self.kwargs = kwargs
+        self.result = None
+
+        if args:
+            self.query = args[0]
+        else:
+            self.query = kwargs.get('spec', kwargs.get('query'))
+
+    def describe(self, explain):
+        """Returns the operation, its query shape and plan summary.
+
+        :param explain: Whether to request the plan of the query
+        """
+        description = u'%s %s' % (self.name, self.collection.name)
+        if self.query is not None:
+            description += u' %s' % shape(self.query)
+
+        if not explain:
+            return description
+
+        try:
+            # NOTE: Cursors keep the hint, sort and limit applied to
+            # them after the find, and explain a clone of themselves;
+            # find_one() passes its arguments on to a find of one.
+            if self.name == 'find':
+                plan = self.result.explain()
+            else:
+                plan = self.collection.find(*self.args,
+                                            **self.kwargs).limit(-1).explain()
+
+        except pymongo.errors.PyMongoError as ex:
+            return description + u': ' + _(u'explain failed (%s)') % ex
+
+        return description + u': ' + (
+            _(u'index %(index)s, %(keys)s keys and %(docs)s documents '
+              u'scanned, %(returned)s returned') % summarize(plan))
+
+
+class _Collection(object):
+
+    def __init__(self, collection, trace):
+        self.__collection = collection
+
+        for name in instruments.OPERATIONS:
+            setattr(self, name, _recorded(collection, name, trace))
+
+    def __getattr__(self, name):
+        return getattr(self.__collection, name)
+
+
+def _recorded(collection, name, trace):
+    operation = getattr(collection, name)
+
+    def wrapper(*args, **kwargs):
+        operations = trace.operations
+        if operations is None or len(operations) >= MAX_OPERATIONS:
+            return operation(*args, **kwargs)
+
+        record = _Operation(collection, name, args, kwargs)
+        operations.append(record)
+
+        record.result = operation(*args, **kwargs)
+        return record.result
+
+    return wrapper
+
+
+class _Controller(object):
+
+    def __init__(self, controller, slowlog):
+        self.__controller = controller
+
+        cls = controller.__class__
+
+        for name in dir(cls):
+            if (name.startswith('_') or
+                    not isinstance(getattr(cls, name), types.MethodType)):
+                continue
+
+            setattr(self, name, _timed(getattr(controller, name),
+                                       cls.__name__ + '.' + name, slowlog))
+
+    def __getattr__(self, name):
+        return getattr(self.__controller, name)
+
+    @property
+    def __class__(self):
+        return self.__controller.__class__
+
+
+def _timed(method, name, slowlog):
+    """Times a sample of the calls, including returned generators.
+
+    Calls made while a sampled call is in progress count toward it,
+    and are not sampled on their own.
+    """
+
+    def wrapper(*args, **kwargs):
+        if not slowlog._sampled():
+            return method(*args, **kwargs)
+
+        call = _Call(name, slowlog._trace)
+
+        def finish(ex):
+            slowlog._check(call)
+
+        return metrics.measured_call(method, call.run, finish,
+                                     *args, **kwargs)
+
+    return wrapper
+
+
+def shape(query):
+    """Returns the shape of a query, with its values replaced by types.
+
+    For example, {'p': 'x', 'k': {'$gt': 5}} is shaped as
+    {'p': 'unicode', 'k': {'$gt': 'int'}}.
+    """
+    if isinstance(query, dict):
+        return dict((key, shape(value)) for key, value in query.items())
+
+    if isinstance(query, (list, tuple)):
+        return [shape(value) for value in query[:1]]
+
+    return type(query).__name__
+
+
+def summarize(plan):
+    """Returns the index used and the number of keys and documents
+    scanned and returned by a query, from its explain plan.
+
+    :param plan: The output of explain(), in the format of MongoDB
+        2.x or 3.x
+    """
+    if 'cursor' in plan:
+        # NOTE: MongoDB 2.x names the index in the cursor, e.g.
+        # "BtreeCursor p_1_q_1_k_1", or "BasicCursor" for a scan.
+        return {
+            'index': plan['cursor'],
+            'keys': plan.get('nscanned'),
+            'docs': plan.get('nscannedObjects'),
+            'returned': plan.get('n'),
+        }
+
+    stage = plan.get('queryPlanner', {}).get('winningPlan', {})
+    while stage.get('stage') != 'IXSCAN' and 'inputStage' in stage:
+        stage = stage['inputStage']
+
+    stats = plan.get('executionStats', {})
+
+    return {
+        'index': stage.get('indexName', stage.get('stage')),
+        'keys': stats.get('totalKeysExamined'),
+        'docs': stats.get('totalDocsExamined'),
+        'returned': stats.get('nReturned'),
+    }
+
+
+def from_config():
+    """Returns a slow log configured per the MongoDB options.
+
+    :returns: a SlowLog, or None if the threshold is 0
+    """
+    if not options.CFG.slow_call_threshold > 0:
+        return None
+
+    return SlowLog(options.CFG.slow_call_threshold,
+                   options.CFG.slow_call_sample_rate,
+                   options.CFG.slow_call_explain_interval)
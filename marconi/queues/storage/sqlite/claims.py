@@ -26,39 +26,98 @@ CFG = config.namespace('limits:storage').from_options(
 class ClaimController(base.ClaimBase):
     def __init__(self, driver):
         self.driver = driver
-        self.driver.run('''
-            create table
-            if not exists
-            Claims (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                qid INTEGER,
-                ttl INTEGER,
-                created DATETIME,  -- seconds since the Julian day
-                FOREIGN KEY(qid) references Queues(id) on delete cascade
-            )
-        ''')
-        self.driver.run('''
-            create table
-            if not exists
-            Locked (
-                cid INTEGER,
-                msgid INTEGER,
-                FOREIGN KEY(cid) references Claims(id) on delete cascade,
-                FOREIGN KEY(msgid) references Messages(id) on delete cascade
-            )
-        ''')
+
+        for shard in self.driver.shards:
+            shard.run('''
+                create table
+                if not exists
+                Claims (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    qid INTEGER,
+                    ttl INTEGER,
+                    created DATETIME,  -- seconds since the Julian day
+                    FOREIGN KEY(qid) references Queues(id) on delete cascade
+                )
+            ''')
+            shard.run('''
+                create table
+                if not exists
+                Locked (
+                    cid INTEGER,
+                    msgid INTEGER,
+                    FOREIGN KEY(cid) references Claims(id)
+                        on delete cascade,
+                    FOREIGN KEY(msgid) references Messages(id)
+                        on delete cascade
+                )
+            ''')
+
+            # Keep the queue's stats counters in sync
+            shard.run('''
+                create trigger
+                if not exists
+                CountersOnClaimInsert after insert on Claims
+                begin
+                    update Counters
+                       set expires = case when expires < new.created + new.ttl
+                                          then expires
+                                          else new.created + new.ttl end
+                     where qid = new.qid;
+                end
+            ''')
+            shard.run('''
+                create trigger
+                if not exists
+                CountersOnClaimUpdate after update on Claims
+                begin
+                    update Counters
+                       set expires = case when expires < new.created + new.ttl
+                                          then expires
+                                          else new.created + new.ttl end
+                     where qid = new.qid;
+                end
+            ''')
+            shard.run('''
+                create trigger
+                if not exists
+                CountersOnLock after insert on Locked
+                begin
+                    update Counters
+                       set claimed = claimed + 1
+                     where qid = (select qid from Claims
+                                   where id = new.cid);
+                end
+            ''')
+
+            # NOTE: When the rows are deleted by a cascade, either the
+            # claim or the message is already gone, but not both.
+            shard.run('''
+                create trigger
+                if not exists
+                CountersOnUnlock after delete on Locked
+                begin
+                    update Counters
+                       set claimed = claimed - 1
+                     where qid = ifnull((select qid from Claims
+                                          where id = old.cid),
+                                        (select qid from Messages
+                                          where id = old.msgid));
+                end
+            ''')
 
     def get(self, queue, claim_id, project):
         if project is None:
             project = ''
 
+        shard = self.driver.shard(project, queue)
+
         cid = utils.cid_decode(claim_id)
         if cid is None:
             raise exceptions.ClaimDoesNotExist(claim_id, queue, project)
 
-        with self.driver('deferred'):
+        with shard('deferred'):
             try:
-                id, ttl, age = self.driver.get('''
+                id, ttl, age = shard.get('''
                     select C.id, C.ttl, julianday() * 86400.0 - C.created
                       from Queues as Q join Claims as C
                         on Q.id = C.qid
@@ -72,7 +131,7 @@ class ClaimController(base.ClaimBase):
                         'ttl': ttl,
                         'age': int(age),
                     },
-                    self.__get(id)
+                    self.__get(shard, id)
                 )
 
             except utils.NoResult:
@@ -83,30 +142,32 @@ class ClaimController(base.ClaimBase):
         if project is None:
             project = ''
 
+        shard = self.driver.shard(project, queue)
+
         if limit is None:
             limit = CFG.default_message_paging
 
-        with self.driver('immediate'):
+        with shard('immediate'):
             try:
-                qid = utils.get_qid(self.driver, queue, project)
+                qid = utils.get_qid(shard, queue, project)
             except exceptions.QueueDoesNotExist:
                 return None, iter([])
 
             # Clean up all expired claims in this queue
 
-            self.driver.run('''
+            shard.run('''
                 delete from Claims
                  where ttl <= julianday() * 86400.0 - created
                    and qid = ?''', qid)
 
-            self.driver.run('''
+            shard.run('''
                 insert into Claims
                 values (null, ?, ?, julianday() * 86400.0)
             ''', qid, metadata['ttl'])
 
-            id = self.driver.lastrowid
+            id = shard.lastrowid
 
-            self.driver.run('''
+            shard.run('''
                 insert into Locked
                 select last_insert_rowid(), id
                   from Messages left join Locked
@@ -117,12 +178,12 @@ class ClaimController(base.ClaimBase):
                  limit ?''', qid, limit)
 
             messages_ttl = metadata['ttl'] + metadata['grace']
-            self.__update_claimed(id, messages_ttl)
+            self.__update_claimed(shard, id, messages_ttl)
 
-            return (utils.cid_encode(id), self.__get(id))
+            return (utils.cid_encode(id), self.__get(shard, id))
 
-    def __get(self, cid):
-        records = self.driver.run('''
+    def __get(self, shard, cid):
+        records = shard.run('''
             select id, content, ttl, julianday() * 86400.0 - created
               from Messages join Locked
                 on msgid = id
@@ -141,14 +202,16 @@ class ClaimController(base.ClaimBase):
         if project is None:
             project = ''
 
+        shard = self.driver.shard(project, queue)
+
         id = utils.cid_decode(claim_id)
         if id is None:
             raise exceptions.ClaimDoesNotExist(claim_id, queue, project)
 
-        with self.driver('deferred'):
+        with shard('deferred'):
 
             # still delay the cleanup here
-            self.driver.run('''
+            shard.run('''
                 update Claims
                    set created = julianday() * 86400.0,
                        ttl = ?
@@ -158,16 +221,16 @@ class ClaimController(base.ClaimBase):
                                where project = ? and name = ?)
             ''', metadata['ttl'], id, project, queue)
 
-            if not self.driver.affected:
+            if not shard.affected:
                 raise exceptions.ClaimDoesNotExist(claim_id,
                                                    queue,
                                                    project)
 
-            self.__update_claimed(id, metadata['ttl'])
+            self.__update_claimed(shard, id, metadata['ttl'])
 
-    def __update_claimed(self, cid, ttl):
+    def __update_claimed(self, shard, cid, ttl):
         # Precondition: cid is not expired
-        self.driver.run('''
+        shard.run('''
             update Messages
                set created = julianday() * 86400.0,
                    ttl = ?
@@ -180,11 +243,13 @@ class ClaimController(base.ClaimBase):
         if project is None:
             project = ''
 
+        shard = self.driver.shard(project, queue)
+
         cid = utils.cid_decode(claim_id)
         if cid is None:
             return
 
-        self.driver.run('''
+        shard.run('''
             delete from Claims
              where id = ?
                and qid = (select id from Queues
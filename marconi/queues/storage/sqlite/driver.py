@@ -15,6 +15,7 @@
 
 import contextlib
 import sqlite3
+import zlib
 
 import msgpack
 
@@ -24,30 +25,27 @@ from marconi.queues.storage.sqlite import controllers
 from marconi.queues.storage.sqlite import utils
 
 CFG = config.namespace('drivers:storage:sqlite').from_options(
-    database=':memory:')
+    database=':memory:',
+    shards=1,
+    cached_statements=256)
 
 
-class Driver(storage.DriverBase):
+class Shard(object):
+    """Wraps the connection to one of the SQLite database files.
 
-    def __init__(self):
-        self.__path = CFG.database
+    :param path: the database file, or ':memory:'
+    :param cached_statements: the number of compiled statements
+        kept by the connection
+    """
+
+    def __init__(self, path, cached_statements=100):
+        self.__path = path
         self.__conn = sqlite3.connect(self.__path,
-                                      detect_types=sqlite3.PARSE_DECLTYPES)
+                                      detect_types=sqlite3.PARSE_DECLTYPES,
+                                      cached_statements=cached_statements)
         self.__db = self.__conn.cursor()
         self.run('''PRAGMA foreign_keys = ON''')
 
-    @staticmethod
-    def pack(o):
-        """Converts a Python variable to a custom SQlite `DOCUMENT`.
-
-        :param o: a Python str, unicode, int, long, float, bool, None
-                  or a dict or list of %o
-        """
-        return buffer(msgpack.dumps(o))
-
-    sqlite3.register_converter('DOCUMENT', lambda s:
-                               msgpack.loads(s, encoding='utf-8'))
-
     def run(self, sql, *args):
         """Performs a SQL query.
 
@@ -99,6 +97,55 @@ class Driver(storage.DriverBase):
             self.__conn.rollback()
             raise
 
+
+class Driver(storage.DriverBase):
+
+    def __init__(self):
+        if CFG.shards < 1:
+            raise ValueError(u'shards must be a positive integer')
+
+        if CFG.shards == 1 or CFG.database == ':memory:':
+            paths = [CFG.database] * CFG.shards
+        else:
+            paths = ['%s.%d' % (CFG.database, n) for n in range(CFG.shards)]
+
+        self.__shards = [Shard(path, CFG.cached_statements)
+                         for path in paths]
+
+    @staticmethod
+    def pack(o):
+        """Converts a Python variable to a custom SQlite `DOCUMENT`.
+
+        :param o: a Python str, unicode, int, long, float, bool, None
+                  or a dict or list of %o
+        """
+        return buffer(msgpack.dumps(o))
+
+    sqlite3.register_converter('DOCUMENT', lambda s:
+                               msgpack.loads(s, encoding='utf-8'))
+
+    @property
+    def shards(self):
+        """Returns all the shards, for schema setup and fan-out queries."""
+        return self.__shards
+
+    def shard(self, project, queue):
+        """Returns the shard which stores the given queue.
+
+        Queues are spread over the database files by a hash of their
+        project and name, so that all the rows of a queue, including
+        its messages and claims, live in the same file.
+
+        :param project: Project id, '' for none
+        :param queue: Name of the queue
+        """
+        if len(self.__shards) == 1:
+            return self.__shards[0]
+
+        key = (u'%s/%s' % (project, queue)).encode('utf-8')
+        return self.__shards[(zlib.crc32(key) & 0xffffffff) %
+                             len(self.__shards)]
+
     @property
     def queue_controller(self):
         return controllers.QueueController(self)
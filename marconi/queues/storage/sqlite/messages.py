@@ -13,6 +13,8 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import itertools
+
 from marconi.common import config
 from marconi.openstack.common import timeutils
 from marconi.queues.storage import base
@@ -27,31 +29,150 @@ CFG = config.namespace('limits:storage').from_options(
 class MessageController(base.MessageBase):
     def __init__(self, driver):
         self.driver = driver
-        self.driver.run('''
-            create table
-            if not exists
-            Messages (
-                id INTEGER,
-                qid INTEGER,
-                ttl INTEGER,
-                content DOCUMENT,
-                client TEXT,
-                created DATETIME,  -- seconds since the Julian day
-                PRIMARY KEY(id),
-                FOREIGN KEY(qid) references Queues(id) on delete cascade
-            )
-        ''')
+
+        for shard in self.driver.shards:
+            shard.run('''
+                create table
+                if not exists
+                Messages (
+                    id INTEGER,
+                    qid INTEGER,
+                    ttl INTEGER,
+                    content DOCUMENT,
+                    client TEXT,
+                    created DATETIME,  -- seconds since the Julian day
+                    PRIMARY KEY(id),
+                    FOREIGN KEY(qid) references Queues(id) on delete cascade
+                )
+            ''')
+            shard.run('''
+                create index
+                if not exists
+                MessagesByQueue on Messages (qid, id)
+            ''')
+
+            # Keep the queue's stats counters in sync
+            shard.run('''
+                create trigger
+                if not exists
+                CountersOnMessageInsert after insert on Messages
+                begin
+                    update Counters
+                       set total = total + 1,
+                           head = min(ifnull(head, new.id), new.id),
+                           tail = max(ifnull(tail, new.id), new.id),
+                           expires = case when expires < new.created + new.ttl
+                                          then expires
+                                          else new.created + new.ttl end
+                     where qid = new.qid;
+                end
+            ''')
+            shard.run('''
+                create trigger
+                if not exists
+                CountersOnMessageUpdate after update on Messages
+                begin
+                    update Counters
+                       set expires = case when expires < new.created + new.ttl
+                                          then expires
+                                          else new.created + new.ttl end
+                     where qid = new.qid;
+                end
+            ''')
+            shard.run('''
+                create trigger
+                if not exists
+                CountersOnMessageDelete after delete on Messages
+                begin
+                    update Counters
+                       set total = total - 1,
+                           head = case when head = old.id
+                                       then (select min(id) from Messages
+                                              where qid = old.qid)
+                                       else head end,
+                           tail = case when tail = old.id
+                                       then (select max(id) from Messages
+                                              where qid = old.qid)
+                                       else tail end
+                     where qid = old.qid;
+                end
+            ''')
+
+            # Scratch table for the bulk operations.  Binding the
+            # IDs through a table keeps the SQL text constant, so the
+            # statements are compiled only once no matter how many IDs
+            # are given, and `seq` remembers the requested order.
+            shard.run('''
+                create temp table
+                if not exists
+                BulkIds (
+                    seq INTEGER,
+                    id INTEGER UNIQUE,
+                    PRIMARY KEY(seq)
+                )
+            ''')
+
+        # NOTE: Build every variant of the queries whose SQL depends
+        # on the arguments once, so that the hot paths send the same
+        # strings on each call and always hit the statement cache.
+        self.__first_sql = dict((sort, self.__make_first_sql(sort))
+                                for sort in (1, -1))
+
+        self.__list_sql = dict(
+            (variant, self.__make_list_sql(*variant))
+            for variant in itertools.product((True, False), repeat=3))
+
+    @staticmethod
+    def __make_first_sql(sort):
+        return '''
+            select id, content, ttl, created,
+                   julianday() * 86400.0 - created
+              from Messages
+             where ttl > julianday() * 86400.0 - created
+               and qid = ?
+          order by id %s
+             limit 1''' % ('DESC' if sort == -1 else 'ASC')
+
+    @staticmethod
+    def __make_list_sql(echo, marker, include_claimed):
+        sql = '''
+            select M.id, content, ttl, julianday() * 86400.0 - created
+              from Queues as Q join Messages as M
+                on M.qid = Q.id
+             where M.ttl > julianday() * 86400.0 - created
+               and Q.name = ? and Q.project = ?'''
+
+        if not echo:
+            sql += '''
+               and M.client != ?'''
+
+        if marker:
+            sql += '''
+               and M.id > ?'''
+
+        if not include_claimed:
+            sql += '''
+               and M.id not in (select msgid
+                                  from Claims join Locked
+                                    on id = cid)'''
+
+        sql += '''
+             limit ?'''
+
+        return sql
 
     def get(self, queue, message_id, project):
         if project is None:
             project = ''
 
+        shard = self.driver.shard(project, queue)
+
         mid = utils.msgid_decode(message_id)
         if mid is None:
             raise exceptions.MessageDoesNotExist(message_id, queue, project)
 
         try:
-            content, ttl, age = self.driver.get('''
+            content, ttl, age = shard.get('''
                 select content, ttl, julianday() * 86400.0 - created
                   from Queues as Q join Messages as M
                     on qid = Q.id
@@ -73,20 +194,21 @@ class MessageController(base.MessageBase):
         if project is None:
             project = ''
 
-        message_ids = ','.join(
-            ["'%s'" % id for id in
-             map(utils.msgid_decode, message_ids) if id is not None]
-        )
+        shard = self.driver.shard(project, queue)
 
-        sql = '''
-            select M.id, content, ttl, julianday() * 86400.0 - created
-              from Queues as Q join Messages as M
-                on qid = Q.id
-             where ttl > julianday() * 86400.0 - created
-               and M.id in (%s) and project = ? and name = ?
-        ''' % message_ids
+        with shard('deferred'):
+            self.__load_bulk_ids(shard, message_ids)
+
+            records = shard.run('''
+                select M.id, content, ttl, julianday() * 86400.0 - created
+                  from BulkIds as B join Messages as M
+                    on M.id = B.id
+                  join Queues as Q
+                    on qid = Q.id
+                 where ttl > julianday() * 86400.0 - created
+                   and project = ? and name = ?
+              order by B.seq''', project, queue).fetchall()
 
-        records = self.driver.run(sql, project, queue)
         for id, content, ttl, age in records:
             yield {
                 'id': utils.msgid_encode(id),
@@ -99,25 +221,17 @@ class MessageController(base.MessageBase):
         if project is None:
             project = ''
 
-        with self.driver('deferred'):
-            sql = '''
-                select id, content, ttl, created,
-                       julianday() * 86400.0 - created
-                  from Messages
-                 where ttl > julianday() * 86400.0 - created
-                   and qid = ?
-              order by id %s
-                 limit 1'''
-
-            if sort not in (1, -1):
-                raise ValueError(u'sort must be either 1 (ascending) '
-                                 u'or -1 (descending)')
+        if sort not in (1, -1):
+            raise ValueError(u'sort must be either 1 (ascending) '
+                             u'or -1 (descending)')
 
-            sql = sql % ('DESC' if sort == -1 else 'ASC')
+        shard = self.driver.shard(project, queue)
 
-            args = [utils.get_qid(self.driver, queue, project)]
+        with shard('deferred'):
+            sql = self.__first_sql[sort]
+            args = [utils.get_qid(shard, queue, project)]
 
-            records = self.driver.run(sql, *args)
+            records = shard.run(sql, *args)
 
             try:
                 id, content, ttl, created, age = next(records)
@@ -144,37 +258,22 @@ class MessageController(base.MessageBase):
         if project is None:
             project = ''
 
-        with self.driver('deferred'):
-            sql = '''
-                select M.id, content, ttl, julianday() * 86400.0 - created
-                  from Queues as Q join Messages as M
-                    on M.qid = Q.id
-                 where M.ttl > julianday() * 86400.0 - created
-                   and Q.name = ? and Q.project = ?'''
+        shard = self.driver.shard(project, queue)
 
+        with shard('deferred'):
+            sql = self.__list_sql[bool(echo), bool(marker),
+                                  bool(include_claimed)]
             args = [queue, project]
 
             if not echo:
-                sql += '''
-                   and M.client != ?'''
                 args += [client_uuid]
 
             if marker:
-                sql += '''
-                   and M.id > ?'''
                 args += [utils.marker_decode(marker)]
 
-            if not include_claimed:
-                sql += '''
-                   and M.id not in (select msgid
-                                      from Claims join Locked
-                                        on id = cid)'''
-
-            sql += '''
-                 limit ?'''
             args += [limit]
 
-            records = self.driver.run(sql, *args)
+            records = shard.run(sql, *args)
             marker_id = {}
 
             def it():
@@ -194,12 +293,14 @@ class MessageController(base.MessageBase):
         if project is None:
             project = ''
 
-        with self.driver('immediate'):
-            qid = utils.get_qid(self.driver, queue, project)
+        shard = self.driver.shard(project, queue)
+
+        with shard('immediate'):
+            qid = utils.get_qid(shard, queue, project)
 
             # cleanup all expired messages in this queue
 
-            self.driver.run('''
+            shard.run('''
                 delete from Messages
                  where ttl <= julianday() * 86400.0 - created
                    and qid = ?''', qid)
@@ -207,7 +308,7 @@ class MessageController(base.MessageBase):
             # executemany() sets lastrowid to None, so no matter we manually
             # generate the IDs or not, we still need to query for it.
 
-            unused = self.driver.get('''
+            unused = shard.get('''
                 select max(id) + 1 from Messages''')[0] or 1001
             my = dict(newid=unused)
 
@@ -217,7 +318,7 @@ class MessageController(base.MessageBase):
                            self.driver.pack(m['body']), client_uuid)
                     my['newid'] += 1
 
-            self.driver.run_multiple('''
+            shard.run_multiple('''
                 insert into Messages
                 values (?, ?, ?, ?, ?, julianday() * 86400.0)''', it())
 
@@ -227,12 +328,14 @@ class MessageController(base.MessageBase):
         if project is None:
             project = ''
 
+        shard = self.driver.shard(project, queue)
+
         id = utils.msgid_decode(message_id)
         if id is None:
             return
 
-        with self.driver('immediate'):
-            message_exists, = self.driver.get('''
+        with shard('immediate'):
+            message_exists, = shard.get('''
                 select count(M.id)
                   from Queues as Q join Messages as M
                     on qid = Q.id
@@ -244,12 +347,12 @@ class MessageController(base.MessageBase):
                 return
 
             if claim is None:
-                self.__delete_unclaimed(id)
+                self.__delete_unclaimed(shard, id)
             else:
-                self.__delete_claimed(id, claim)
+                self.__delete_claimed(shard, id, claim)
 
-    def __delete_unclaimed(self, id):
-        self.driver.run('''
+    def __delete_unclaimed(self, shard, id):
+        shard.run('''
             delete from Messages
              where id = ?
                and not exists (select *
@@ -258,16 +361,16 @@ class MessageController(base.MessageBase):
                                 where ttl > julianday() * 86400.0 - created)
         ''', id)
 
-        if not self.driver.affected:
+        if not shard.affected:
             raise exceptions.MessageIsClaimed(id)
 
-    def __delete_claimed(self, id, claim):
+    def __delete_claimed(self, shard, id, claim):
         # Precondition: id exists in a specific queue
         cid = utils.cid_decode(claim)
         if cid is None:
             return
 
-        self.driver.run('''
+        shard.run('''
             delete from Messages
              where id = ?
                and id in (select msgid
@@ -277,21 +380,33 @@ class MessageController(base.MessageBase):
                              and id = ?)
         ''', id, cid)
 
-        if not self.driver.affected:
+        if not shard.affected:
             raise exceptions.MessageIsClaimedBy(id, claim)
 
     def bulk_delete(self, queue, message_ids, project):
         if project is None:
             project = ''
 
-        message_ids = ','.join(
-            ["'%s'" % id for id in
-             map(utils.msgid_decode, message_ids) if id]
-        )
+        shard = self.driver.shard(project, queue)
 
-        self.driver.run('''
-            delete from Messages
-             where id in (%s)
-               and qid = (select id from Queues
-                           where project = ? and name = ?)
-        ''' % message_ids, project, queue)
+        with shard('immediate'):
+            self.__load_bulk_ids(shard, message_ids)
+
+            shard.run('''
+                delete from Messages
+                 where id in (select id from BulkIds)
+                   and qid = (select id from Queues
+                               where project = ? and name = ?)
+            ''', project, queue)
+
+    def __load_bulk_ids(self, shard, message_ids):
+        # Precondition: called within a transaction
+        shard.run('''
+            delete from BulkIds''')
+
+        ids = (id for id in map(utils.msgid_decode, message_ids)
+               if id is not None)
+
+        shard.run_multiple('''
+            insert or ignore into BulkIds
+            values (null, ?)''', ((id,) for id in ids))
@@ -14,6 +14,9 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import heapq
+import itertools
+
 from marconi.common import config
 from marconi.queues.storage import base
 from marconi.queues.storage import exceptions
@@ -23,51 +26,137 @@ CFG = config.namespace('limits:storage').from_options(
     default_queue_paging=10,
 )
 
+# Computes the Counters row of the queue ?1 from its current rows
+_COUNTERS_SQL = '''
+    select ?1,
+           (select count(*) from Messages where qid = ?1),
+           (select count(*)
+              from Claims join Locked
+                on id = cid
+             where qid = ?1),
+           (select min(id) from Messages where qid = ?1),
+           (select max(id) from Messages where qid = ?1),
+           (select min(expires)
+              from (select created + ttl as expires
+                      from Messages where qid = ?1
+                     union all
+                    select created + ttl
+                      from Claims where qid = ?1))'''
+
 
 class QueueController(base.QueueBase):
     def __init__(self, driver):
         self.driver = driver
-        self.driver.run('''
-            create table
-            if not exists
-            Queues (
-                id INTEGER,
-                project TEXT,
-                name TEXT,
-                metadata DOCUMENT,
-                PRIMARY KEY(id),
-                UNIQUE(project, name)
-            )
-        ''')
-
-    def list(self, project, marker=None,
-             limit=None, detailed=False):
-
-        if project is None:
-            project = ''
-
-        if limit is None:
-            limit = CFG.default_queue_paging
 
+        for shard in self.driver.shards:
+            shard.run('''
+                create table
+                if not exists
+                Queues (
+                    id INTEGER,
+                    project TEXT,
+                    name TEXT,
+                    metadata DOCUMENT,
+                    PRIMARY KEY(id),
+                    UNIQUE(project, name)
+                )
+            ''')
+
+            # NOTE: Stats counters, kept up to date by the triggers
+            # set up by each controller.  `claimed` counts the
+            # locked messages, and `expires` is a lower bound for the
+            # earliest expiration of any message or claim in the
+            # queue; until then, the counters need no TTL filtering.
+            shard.run('''
+                create table
+                if not exists
+                Counters (
+                    qid INTEGER,
+                    total INTEGER,
+                    claimed INTEGER,
+                    head INTEGER,
+                    tail INTEGER,
+                    expires REAL,
+                    PRIMARY KEY(qid),
+                    FOREIGN KEY(qid) references Queues(id) on delete cascade
+                )
+            ''')
+            shard.run('''
+                create trigger
+                if not exists
+                CountersOnQueueInsert after insert on Queues
+                begin
+                    insert into Counters
+                    values (new.id, 0, 0, null, null, null);
+                end
+            ''')
+
+        # NOTE: Build every variant of the queries whose SQL depends
+        # on the arguments once, so that the hot paths send the same
+        # strings on each call and always hit the statement cache.
+        self.__list_sql = dict(
+            (variant, self.__make_list_sql(*variant))
+            for variant in itertools.product((True, False), repeat=2))
+
+        self.__stat_sql = dict((order, self.__make_stat_sql(order))
+                               for order in ('ASC', 'DESC'))
+
+    @staticmethod
+    def __make_list_sql(detailed, marker):
         sql = (('''
             select name from Queues''' if not detailed
                 else '''
             select name, metadata from Queues''') +
                '''
              where project = ?''')
-        args = [project]
 
         if marker:
             sql += '''
                and name > ?'''
-            args += [marker]
 
         sql += '''
              order by name
              limit ?'''
+
+        return sql
+
+    @staticmethod
+    def __make_stat_sql(order):
+        # NOTE: Only the columns needed by the stat document are
+        # selected, so that the message body is never decoded.
+        return '''
+            select id, created, julianday() * 86400.0 - created
+              from Messages
+             where ttl > julianday() * 86400.0 - created
+               and qid = ?
+          order by id %s
+             limit 1''' % order
+
+    def list(self, project, marker=None,
+             limit=None, detailed=False):
+
+        if project is None:
+            project = ''
+
+        if limit is None:
+            limit = CFG.default_queue_paging
+
+        sql = self.__list_sql[bool(detailed), bool(marker)]
+        args = [project]
+
+        if marker:
+            args += [marker]
+
         args += [limit]
 
-        records = self.driver.run(sql, *args)
+        # NOTE: Each shard returns its page already sorted by name,
+        # and a queue lives in exactly one shard, so merging the pages
+        # and cutting at %limit gives the same page a single database
+        # file would have returned.
+        records = itertools.islice(
+            heapq.merge(*[shard.run(sql, *args)
+                          for shard in self.driver.shards]),
+            limit)
         marker_name = {}
 
         def it():
@@ -84,8 +173,10 @@ class QueueController(base.QueueBase):
         if project is None:
             project = ''
 
+        shard = self.driver.shard(project, name)
+
         try:
-            return self.driver.get('''
+            return shard.get('''
                 select metadata from Queues
                  where project = ? and name = ?''', project, name)[0]
 
@@ -96,19 +187,23 @@ class QueueController(base.QueueBase):
         if project is None:
             project = ''
 
+        shard = self.driver.shard(project, name)
+
         # msgpack of {} is "\x80"
-        self.driver.run('''
+        shard.run('''
             insert or ignore into Queues
             values (null, ?, ?, "\x80")
         ''', project, name)
 
-        return self.driver.affected
+        return shard.affected
 
     def exists(self, name, project):
         if project is None:
             project = ''
 
-        return self.driver.run('''
+        shard = self.driver.shard(project, name)
+
+        return shard.run('''
             select id from Queues
              where project = ? and name = ?
         ''', project, name).fetchone() is not None
@@ -117,20 +212,24 @@ class QueueController(base.QueueBase):
         if project is None:
             project = ''
 
-        self.driver.run('''
+        shard = self.driver.shard(project, name)
+
+        shard.run('''
             update Queues
                set metadata = ?
              where project = ? and name = ?
         ''', self.driver.pack(metadata), project, name)
 
-        if not self.driver.affected:
+        if not shard.affected:
             raise exceptions.QueueDoesNotExist(name, project)
 
     def delete(self, name, project):
         if project is None:
             project = ''
 
-        self.driver.run('''
+        shard = self.driver.shard(project, name)
+
+        shard.run('''
             delete from Queues
              where project = ? and name = ?''', project, name)
 
@@ -138,39 +237,132 @@ class QueueController(base.QueueBase):
         if project is None:
             project = ''
 
-        with self.driver('deferred'):
-            qid = utils.get_qid(self.driver, name, project)
-            claimed, free = self.driver.get('''
-                select * from
-                   (select count(msgid)
-                      from Claims join Locked
-                        on id = cid
-                     where ttl > julianday() * 86400.0 - created
-                       and qid = ?),
-                   (select count(id)
-                      from Messages left join Locked
-                        on id = msgid
-                     where msgid is null
-                       and ttl > julianday() * 86400.0 - created
-                       and qid = ?)
-            ''', qid, qid)
-
-            total = free + claimed
+        shard = self.driver.shard(project, name)
+
+        with shard('deferred'):
+            try:
+                (qid, total, claimed, fresh,
+                 head_id, head_created, head_age,
+                 tail_id, tail_created, tail_age) = shard.get('''
+                    select Q.id, C.total, C.claimed,
+                           C.qid is not null and
+                           ifnull(C.expires > julianday() * 86400.0, 1),
+                           H.id, H.created, julianday() * 86400.0 - H.created,
+                           T.id, T.created, julianday() * 86400.0 - T.created
+                      from Queues as Q left join Counters as C
+                        on C.qid = Q.id
+                      left join Messages as H
+                        on H.id = C.head
+                      left join Messages as T
+                        on T.id = C.tail
+                     where project = ? and name = ?''', project, name)
+
+            except utils.NoResult:
+                raise exceptions.QueueDoesNotExist(name, project)
+
+            if not fresh:
+                # NOTE: Something in the queue has expired since the
+                # counters were built. Purge the expired rows, so that
+                # the rebuilt counters only cover live ones, and their
+                # expiration moves to the future again.
+                self.__purge_expired(shard, qid)
+                self.__rebuild_counters(shard, qid)
+
+                return {'messages': self.__count_stats(shard, qid)}
 
             message_stats = {
                 'claimed': claimed,
-                'free': free,
+                'free': total - claimed,
                 'total': total,
             }
 
-            try:
-                message_controller = self.driver.message_controller
-                oldest = message_controller.first(name, project, sort=1)
-                newest = message_controller.first(name, project, sort=-1)
-            except exceptions.QueueIsEmpty:
-                pass
-            else:
-                message_stats['oldest'] = utils.stat_message(oldest)
-                message_stats['newest'] = utils.stat_message(newest)
+            if head_id is not None:
+                message_stats['oldest'] = utils.stat_message(
+                    head_id, head_created, head_age)
+                message_stats['newest'] = utils.stat_message(
+                    tail_id, tail_created, tail_age)
 
             return {'messages': message_stats}
+
+    def check_counters(self, name, project):
+        """Checks the stats counters of a queue against its rows.
+
+        Counters found out of sync are rebuilt from the rows.
+
+        :param name: The queue name
+        :param project: Project id
+        :returns: True if the counters were consistent, else False
+        :raises: QueueDoesNotExist
+        """
+        if project is None:
+            project = ''
+
+        shard = self.driver.shard(project, name)
+
+        with shard('immediate'):
+            qid = utils.get_qid(shard, name, project)
+
+            stored = shard.run('''
+                select total, claimed, head, tail
+                  from Counters
+                 where qid = ?''', qid).fetchone()
+
+            actual = shard.get(_COUNTERS_SQL, qid)[1:5]
+
+            consistent = stored == actual
+            if not consistent:
+                self.__rebuild_counters(shard, qid)
+
+            return consistent
+
+    def __purge_expired(self, shard, qid):
+        shard.run('''
+            delete from Claims
+             where ttl <= julianday() * 86400.0 - created
+               and qid = ?''', qid)
+
+        shard.run('''
+            delete from Messages
+             where ttl <= julianday() * 86400.0 - created
+               and qid = ?''', qid)
+
+    def __rebuild_counters(self, shard, qid):
+        shard.run('''
+            insert or replace into Counters''' + _COUNTERS_SQL, qid)
+
+    def __count_stats(self, shard, qid):
+        claimed, free = shard.get('''
+            select * from
+               (select count(msgid)
+                  from Claims join Locked
+                    on id = cid
+                 where ttl > julianday() * 86400.0 - created
+                   and qid = ?),
+               (select count(id)
+                  from Messages left join Locked
+                    on id = msgid
+                 where msgid is null
+                   and ttl > julianday() * 86400.0 - created
+                   and qid = ?)
+        ''', qid, qid)
+
+        message_stats = {
+            'claimed': claimed,
+            'free': free,
+            'total': free + claimed,
+        }
+
+        try:
+            oldest = self.__stat_message(shard, qid, 'ASC')
+            newest = self.__stat_message(shard, qid, 'DESC')
+        except utils.NoResult:
+            pass
+        else:
+            message_stats['oldest'] = oldest
+            message_stats['newest'] = newest
+
+        return message_stats
+
+    def __stat_message(self, shard, qid, order):
+        id, created, age = shard.get(self.__stat_sql[order], qid)
+        return utils.stat_message(id, created, age)
@@ -14,6 +14,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from marconi.openstack.common import timeutils
 from marconi.queues.storage import exceptions
 
 UNIX_EPOCH_AS_JULIAN_SEC = 2440587.5 * 86400.0
@@ -82,10 +83,12 @@ def julian_to_unix(julian_sec):
     return int(round(julian_sec - UNIX_EPOCH_AS_JULIAN_SEC))
 
 
-def stat_message(message):
-    """Creates a stat document based on a message."""
+def stat_message(id, created, age):
+    """Creates a stat document from the columns of a message row."""
+    created_unix = julian_to_unix(created)
+
     return {
-        'id': message['id'],
-        'age': message['age'],
-        'created': message['created'],
+        'id': msgid_encode(id),
+        'age': int(age),
+        'created': timeutils.iso8601_from_timestamp(created_unix),
     }
@@ -0,0 +1,114 @@
+# Copyright (c) 2013 Rackspace, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import contextlib
+import threading
+
+
+class Notifier(object):
+    """Wakes up the requests waiting for messages to be posted.
+
+    Only the posts served by this process are notified, so waiters
+    must still check the storage now and then for the others.
+
+    :param max_waiters: (Default None) how many requests may wait at
+        once, or None for no limit. A waiting request holds one of the
+        threads serving requests, so there should be fewer waiters
+        than threads: else the posts waited for can not be served
+        until the waits are over.
+    """
+
+    def __init__(self, max_waiters=None):
+        self.max_waiters = max_waiters
+        self._lock = threading.Lock()
+        self._waiters = 0
+
+        # (project, queue) => [event, number of subscribers]
+        self._waiting = {}
+
+    def start_waiting(self):
+        """Takes one of the waiter slots, if any is left.
+
+        :returns: True if taken, in which case stop_waiting() must be
+            called once done; False if the request should not wait
+        """
+        with self._lock:
+            if (self.max_waiters is not None and
+                    self._waiters >= self.max_waiters):
+                return False
+
+            self._waiters += 1
+            return True
+
+    def stop_waiting(self):
+        """Gives back a waiter slot taken by start_waiting()."""
+        with self._lock:
+            self._waiters -= 1
+
+    @contextlib.contextmanager
+    def waiting(self, seconds):
+        """Holds a waiter slot for a request that asks to wait.
+
+        :param seconds: How long the request asks to wait, or None
+        :returns: (yields) seconds, or None if no slot is left
+        """
+        if not seconds or not self.start_waiting():
+            yield None
+            return
+
+        try:
+            yield seconds
+        finally:
+            self.stop_waiting()
+
+    @contextlib.contextmanager
+    def subscribe(self, queue, project):
+        """Yields an event set when messages are next posted to a queue.
+
+        Subscribe before checking the queue for messages, so that
+        messages posted in the meantime are not missed.
+
+        :param queue: Name of the queue
+        :param project: Project id
+        """
+        key = (project, queue)
+
+        with self._lock:
+            entry = self._waiting.get(key)
+            if entry is None:
+                entry = self._waiting[key] = [threading.Event(), 0]
+
+            entry[1] += 1
+
+        try:
+            yield entry[0]
+
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if not entry[1] and self._waiting.get(key) is entry:
+                    del self._waiting[key]
+
+    def notify(self, queue, project):
+        """Wakes up the subscribers of a queue.
+
+        :param queue: Name of the queue
+        :param project: Project id
+        """
+        with self._lock:
+            entry = self._waiting.pop((project, queue), None)
+
+        if entry is not None:
+            entry[0].set()
@@ -13,7 +13,31 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import simplejson as json
+import abc
+import codecs
+import collections
+import json as stdlib_json
+import re
+
+import msgpack
+import simplejson
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+from marconi.common import config
+
+CFG = config.namespace('drivers:transport').from_options(
+    json_codec='simplejson',
+)
+
+# NOTE: Small enough that a bad message near the start of a batch
+# is rejected without reading the rest of the request body.
+_READ_CHUNK_SIZE = 8 * 1024
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
 
 
 class MalformedJSON(ValueError):
@@ -26,6 +50,16 @@ class OverflowedJSONInteger(OverflowError):
     pass
 
 
+class UnexpectedJSONDocument(ValueError):
+    """JSON document is not of the expected type."""
+    pass
+
+
+class MalformedMsgPack(ValueError):
+    """MessagePack data is not valid, or not representable in JSON."""
+    pass
+
+
 def _json_int(s):
     """Parse a string as a base 10 64-bit signed integer."""
     i = int(s)
@@ -35,6 +69,164 @@ def _json_int(s):
     return i
 
 
+class JSONCodec(object):
+    """Base class for the JSON libraries used by the transport drivers.
+
+    Whichever the library, integers are limited to 64 bits and
+    strings are output without escaping non-ASCII chars.
+    """
+
+    __metaclass__ = abc.ABCMeta
+
+    @abc.abstractmethod
+    def loads(self, text):
+        """Deserializes a JSON document.
+
+        :param text: a str or unicode string
+        :raises: ValueError, OverflowedJSONInteger
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def raw_decode(self, text, pos):
+        """Deserializes the JSON value found at text[pos:].
+
+        :param text: a unicode string
+        :param pos: index of the first char of the value
+        :raises: ValueError, OverflowedJSONInteger
+        :returns: the value, and the index where it ended
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def dumps(self, obj, compact=False):
+        """Serializes an object to a UTF-8 encoded JSON document.
+
+        :param obj: a JSON-serializable object
+        :param compact: (Default False) whether to leave out all
+            whitespace; otherwise, it is up to the library
+        """
+        raise NotImplementedError
+
+
+class SimpleJSONCodec(JSONCodec):
+    """Codec using simplejson, the default."""
+
+    def __init__(self):
+        self._decoder = simplejson.JSONDecoder(parse_int=_json_int)
+        self._encoder = simplejson.JSONEncoder(ensure_ascii=False)
+        self._compact_encoder = simplejson.JSONEncoder(
+            ensure_ascii=False, separators=(',', ':'))
+
+    def loads(self, text):
+        return self._decoder.decode(text)
+
+    def raw_decode(self, text, pos):
+        return self._decoder.raw_decode(text, pos)
+
+    def dumps(self, obj, compact=False):
+        encoder = self._compact_encoder if compact else self._encoder
+        document = encoder.encode(obj)
+
+        if isinstance(document, unicode):
+            document = document.encode('utf-8')
+
+        return document
+
+
+class StdlibJSONCodec(JSONCodec):
+    """Codec using the json module of the standard library."""
+
+    def __init__(self):
+        self._decoder = stdlib_json.JSONDecoder(parse_int=_json_int)
+        self._encoder = stdlib_json.JSONEncoder(ensure_ascii=False)
+        self._compact_encoder = stdlib_json.JSONEncoder(
+            ensure_ascii=False, separators=(',', ':'))
+
+    def loads(self, text):
+        return self._decoder.decode(text)
+
+    def raw_decode(self, text, pos):
+        return self._decoder.raw_decode(text, pos)
+
+    def dumps(self, obj, compact=False):
+        encoder = self._compact_encoder if compact else self._encoder
+        document = encoder.encode(obj)
+
+        if isinstance(document, unicode):
+            document = document.encode('utf-8')
+
+        return document
+
+
+class UltraJSONCodec(JSONCodec):
+    """Codec using ujson, when installed.
+
+    ujson accepts integers up to 2 ** 64 - 1, and has no hook for
+    checking them, so documents with 19 digits or more in a row are
+    handed to simplejson instead. simplejson also decodes the values
+    of incrementally parsed arrays, since ujson can not decode a value
+    followed by more data. Floats are output with at most 15 digits.
+    """
+
+    _LONG_DIGITS = re.compile(r'[0-9]{19}')
+
+    def __init__(self):
+        if ujson is None:
+            raise ImportError('ujson is not installed')
+
+        self._fallback = SimpleJSONCodec()
+
+    def loads(self, text):
+        if self._LONG_DIGITS.search(text):
+            return self._fallback.loads(text)
+
+        return ujson.loads(text)
+
+    def raw_decode(self, text, pos):
+        return self._fallback.raw_decode(text, pos)
+
+    def dumps(self, obj, compact=False):
+        # NOTE: ujson never outputs whitespace, and returns a UTF-8
+        # encoded str when asked not to escape non-ASCII chars.
+        return ujson.dumps(obj, ensure_ascii=False,
+                           escape_forward_slashes=False,
+                           double_precision=15)
+
+
+CODECS = {
+    'simplejson': SimpleJSONCodec,
+    'json': StdlibJSONCodec,
+    'ujson': UltraJSONCodec,
+}
+
+_codecs = {}
+
+
+def get_codec(name=None):
+    """Returns the JSON codec of the given name.
+
+    :param name: (Default None) a key of CODECS, or None for the
+        codec set by the json_codec option
+    :raises: ValueError if there is no such codec, ImportError if
+        its library is not installed
+    """
+    if name is None:
+        name = CFG.json_codec
+
+    try:
+        return _codecs[name]
+    except KeyError:
+        pass
+
+    try:
+        codec_class = CODECS[name]
+    except KeyError:
+        raise ValueError(u'Unknown JSON codec: %s' % name)
+
+    return _codecs.setdefault(name, codec_class())
+
+
 def read_json(stream, len):
     """Like json.load, but converts ValueError to MalformedJSON upon failure.
 
@@ -42,15 +234,376 @@ def read_json(stream, len):
     :param len: the number of bytes to read from stream
     """
     try:
-        return json.loads(stream.read(len), parse_int=_json_int)
+        return get_codec().loads(stream.read(len))
 
     except ValueError as ex:
         raise MalformedJSON(ex)
 
 
+def read_json_array(stream, len, chunk_size=_READ_CHUNK_SIZE):
+    """Like read_json, but decodes a JSON array one element at a time.
+
+    The opening bracket is checked upon calling; each element is then
+    decoded as the result is iterated, reading no further into the
+    stream than needed. Errors in the rest of the document are raised
+    by the iterator.
+
+    :param stream: a file-like object
+    :param len: the number of bytes to read from stream
+    :param chunk_size: the number of bytes to read at a time
+    :raises: MalformedJSON, OverflowedJSONInteger, UnexpectedJSONDocument
+    :returns: an iterator over the elements of the array
+    """
+    reader = _JSONArrayReader(stream, len, chunk_size)
+    reader.start()
+
+    return reader.elements()
+
+
+class _JSONArrayReader(object):
+
+    __slots__ = ('_stream', '_remaining', '_chunk_size', '_decode_chunk',
+                 '_codec', '_buffer', '_pos')
+
+    def __init__(self, stream, len, chunk_size):
+        self._stream = stream
+        self._remaining = len
+        self._chunk_size = chunk_size
+        self._decode_chunk = codecs.getincrementaldecoder('utf-8')().decode
+        self._codec = get_codec()
+
+        # NOTE: Only the text from _pos onwards is yet to be parsed
+        self._buffer = u''
+        self._pos = 0
+
+    def start(self):
+        char = self._peek()
+        if char != u'[':
+            if not char:
+                raise MalformedJSON('No JSON object could be decoded')
+
+            raise UnexpectedJSONDocument('Expecting a JSON array')
+
+        self._pos += 1
+
+    def elements(self):
+        if self._peek() == u']':
+            self._pos += 1
+        else:
+            while True:
+                yield self._value()
+
+                char = self._peek()
+                self._pos += 1
+
+                if char == u']':
+                    break
+
+                if char != u',':
+                    raise MalformedJSON("Expecting ',' delimiter")
+
+        if self._peek():
+            raise MalformedJSON('Extra data')
+
+    def _value(self):
+        self._peek()
+
+        while True:
+            try:
+                obj, end = self._codec.raw_decode(self._buffer, self._pos)
+
+            except ValueError as ex:
+                # NOTE: The value may just be cut off at the end of the
+                # buffer; read twice as much of it before giving up.
+                size = max(self._chunk_size, 2 * (len(self._buffer) -
+                                                  self._pos))
+                if not self._fill(size):
+                    raise MalformedJSON(ex)
+
+                continue
+
+            # NOTE: A number could go on in the next chunk, but a
+            # complete value is always followed by a delimiter.
+            if end < len(self._buffer) or not self._fill(self._chunk_size):
+                self._pos = end
+                return obj
+
+    def _peek(self):
+        """Skips whitespace and returns the next char, or u'' at the end."""
+        while True:
+            self._pos = _WHITESPACE.match(self._buffer, self._pos).end()
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+
+            if not self._fill(self._chunk_size):
+                return u''
+
+    def _fill(self, size):
+        """Reads up to size bytes into the buffer.
+
+        :returns: False if there was nothing left to read
+        """
+        size = min(size, self._remaining)
+        chunk = self._stream.read(size) if size > 0 else None
+
+        if not chunk:
+            self._remaining = 0
+            return False
+
+        self._remaining -= len(chunk)
+
+        if isinstance(chunk, bytes):
+            try:
+                chunk = self._decode_chunk(chunk, self._remaining <= 0)
+            except ValueError as ex:
+                raise MalformedJSON(ex)
+
+        self._buffer = self._buffer[self._pos:] + chunk
+        self._pos = 0
+
+        return True
+
+
 def to_json(obj):
     """Like json.dumps, but outputs a UTF-8 encoded string.
 
     :param obj: a JSON-serializable object
     """
-    return json.dumps(obj, ensure_ascii=False)
+    return get_codec().dumps(obj)
+
+
+def to_json_stream(obj, item_sort_key=None):
+    """Like to_json, but generates the document in UTF-8 encoded chunks.
+
+    Iterators in obj, such as storage cursors, are serialized as JSON
+    arrays and consumed lazily, each element being sent as a chunk of
+    its own. Iterators may appear at the top level, or as values of
+    dicts; anything else is serialized as a whole.
+
+    :param obj: a JSON-serializable object, which may hold iterators
+    :param item_sort_key: if given, a function used to sort the items
+        of a top-level dict, so that an iterator can be consumed before
+        the values that depend on it are serialized
+    """
+    pending = []
+
+    for piece in _json_pieces(obj, item_sort_key, get_codec().dumps):
+        if piece is _FLUSH:
+            yield b''.join(pending)
+            del pending[:]
+        else:
+            pending.append(piece)
+
+    yield b''.join(pending)
+
+
+# Marks the end of a chunk in the output of _json_pieces()
+_FLUSH = object()
+
+
+def _json_pieces(obj, item_sort_key, dumps):
+    if isinstance(obj, dict):
+        items = obj.items()
+        if item_sort_key is not None:
+            items.sort(key=item_sort_key)
+
+        yield b'{'
+        for index, (key, value) in enumerate(items):
+            yield (b', ' if index else b'') + dumps(key) + b': '
+
+            for piece in _json_pieces(value, None, dumps):
+                yield piece
+
+        yield b'}'
+
+    elif isinstance(obj, collections.Iterator):
+        yield b'['
+        for index, value in enumerate(obj):
+            yield (b', ' if index else b'') + dumps(value)
+            yield _FLUSH
+
+        yield b']'
+
+    else:
+        yield dumps(obj)
+
+
+def read_msgpack(stream, len):
+    """Like read_json, but for a MessagePack document.
+
+    MessagePack is accepted as another encoding of the same documents,
+    so any value that JSON can not represent is refused.
+
+    :param stream: a file-like object
+    :param len: the number of bytes to read from stream
+    :raises: MalformedMsgPack, OverflowedJSONInteger
+    """
+    return from_msgpack(stream.read(len))
+
+
+def from_msgpack(data):
+    """Parses a MessagePack document, refusing what JSON can not hold.
+
+    :param data: the packed document, as a byte string
+    :raises: MalformedMsgPack, OverflowedJSONInteger
+    """
+    try:
+        obj = msgpack.unpackb(data, encoding='utf-8')
+
+    except (ValueError, msgpack.UnpackException) as ex:
+        raise MalformedMsgPack(ex)
+
+    return _from_msgpack(obj)
+
+
+def read_msgpack_array(stream, len, chunk_size=_READ_CHUNK_SIZE):
+    """Like read_json_array, but for a MessagePack document.
+
+    :param stream: a file-like object
+    :param len: the number of bytes to read from stream
+    :param chunk_size: the number of bytes to read at a time
+    :raises: MalformedMsgPack, OverflowedJSONInteger,
+        UnexpectedJSONDocument
+    :returns: an iterator over the elements of the array
+    """
+    reader = _MsgPackArrayReader(stream, len, chunk_size)
+    count = reader.start()
+
+    return reader.elements(count)
+
+
+class _MsgPackArrayReader(object):
+
+    __slots__ = ('_stream', '_remaining', '_chunk_size', '_unpacker')
+
+    def __init__(self, stream, len, chunk_size):
+        self._stream = stream
+        self._remaining = len
+        self._chunk_size = chunk_size
+        self._unpacker = msgpack.Unpacker(encoding='utf-8')
+
+    def start(self):
+        if not self._fill():
+            raise MalformedMsgPack('No data')
+
+        try:
+            return self._next(self._unpacker.read_array_header)
+        except MalformedMsgPack:
+            raise UnexpectedJSONDocument('Expecting an array')
+
+    def elements(self, count):
+        for _ in xrange(count):
+            yield _from_msgpack(self._next(self._unpacker.unpack))
+
+        while self._fill():
+            pass
+
+        try:
+            self._unpacker.unpack()
+        except msgpack.OutOfData:
+            return
+        except (ValueError, msgpack.UnpackException):
+            pass
+
+        raise MalformedMsgPack('Extra data')
+
+    def _next(self, unpack):
+        # NOTE: The unpacker keeps its position when it runs out of
+        # data, so it can be called again once more data is fed.
+        while True:
+            try:
+                return unpack()
+
+            except msgpack.OutOfData:
+                if not self._fill():
+                    raise MalformedMsgPack('Unexpected end of data')
+
+            except (ValueError, msgpack.UnpackException) as ex:
+                raise MalformedMsgPack(ex)
+
+    def _fill(self):
+        """Feeds the next chunk of the stream to the unpacker.
+
+        :returns: False if there was nothing left to read
+        """
+        size = min(self._chunk_size, self._remaining)
+        chunk = self._stream.read(size) if size > 0 else None
+
+        if not chunk:
+            self._remaining = 0
+            return False
+
+        self._remaining -= len(chunk)
+        self._unpacker.feed(chunk)
+
+        return True
+
+
+def _from_msgpack(obj):
+    """Checks that a value unpacked from MessagePack is valid JSON.
+
+    Strings sent as binary data are decoded from UTF-8 if possible.
+
+    :raises: MalformedMsgPack, OverflowedJSONInteger
+    """
+    kind = type(obj)
+
+    if kind is unicode or kind is float or kind is bool or obj is None:
+        return obj
+
+    if kind is int or kind is long:
+        if not (-2 ** 63 <= obj <= 2 ** 63 - 1):
+            raise OverflowedJSONInteger()
+
+        return obj
+
+    if kind is str:
+        try:
+            return obj.decode('utf-8')
+        except UnicodeDecodeError:
+            raise MalformedMsgPack('Binary data is not supported')
+
+    if kind is list:
+        return [_from_msgpack(value) for value in obj]
+
+    if kind is dict:
+        document = {}
+        for key, value in obj.iteritems():
+            key = _from_msgpack(key)
+            if type(key) is not unicode:
+                raise MalformedMsgPack('Map keys must be strings')
+
+            document[key] = _from_msgpack(value)
+
+        return document
+
+    raise MalformedMsgPack('Unsupported type: %s' % kind.__name__)
+
+
+def to_msgpack(obj, item_sort_key=None):
+    """Like to_json, but outputs a MessagePack document.
+
+    Since arrays are prefixed with their length, any iterators in obj
+    are consumed before anything is output (see to_json_stream).
+
+    :param obj: a JSON-serializable object, which may hold iterators
+    :param item_sort_key: if given, a function used to sort the items
+        of a top-level dict, so that its iterators are consumed in
+        the order needed by the values that depend on them
+    """
+    return msgpack.packb(_materialize(obj, item_sort_key), encoding='utf-8')
+
+
+def _materialize(obj, item_sort_key):
+    if isinstance(obj, dict):
+        items = obj.items()
+        if item_sort_key is not None:
+            items.sort(key=item_sort_key)
+
+        return dict((key, _materialize(value, None))
+                    for key, value in items)
+
+    if isinstance(obj, collections.Iterator):
+        return list(obj)
+
+    return obj
@@ -14,11 +14,11 @@
 # limitations under the License.
 
 import re
-
-import simplejson as json
+import sys
 
 from marconi.common import config
 from marconi.common import exceptions
+from marconi.queues.transport import utils
 
 OPTIONS = {
     'queue_paging_uplimit': 20,
@@ -28,6 +28,7 @@ OPTIONS = {
     'message_ttl_max': 1209600,
     'claim_ttl_max': 43200,
     'claim_grace_max': 43200,
+    'long_poll_wait_max': 30,
 }
 
 CFG = config.namespace('limits:transport').from_options(**OPTIONS)
@@ -76,7 +77,7 @@ def queue_content(metadata, check_size):
     """
 
     if check_size:
-        length = _compact_json_length(metadata)
+        length = _compact_json_length(metadata, CFG.metadata_size_uplimit)
         if length > CFG.metadata_size_uplimit:
             raise exceptions.ValidationFailed(
                 'queue metadata larger than %d bytes' %
@@ -86,17 +87,27 @@ def queue_content(metadata, check_size):
 def message_posting(messages, check_size=True):
     """Restrictions on a list of messages.
 
-    :param messages: A list of messages
+    The messages are checked one at a time, so that a generator
+    of messages stops being consumed as soon as any check fails.
+
+    :param messages: An iterable of messages
     :param check_size: Whether the size checking for each message
         is required
     :raises: ValidationFailed if any message has a out-of-range
         TTL, or an oversize message body.
+    :returns: The messages, as a list
     """
 
-    message_listing(limit=len(messages))
+    checked = []
 
     for msg in messages:
+        message_listing(limit=len(checked) + 1)
         message_content(msg, check_size)
+        checked.append(msg)
+
+    message_listing(limit=len(checked))
+
+    return checked
 
 
 def message_content(message, check_size):
@@ -108,7 +119,8 @@ def message_content(message, check_size):
             CFG.message_ttl_max)
 
     if check_size:
-        body_length = _compact_json_length(message['body'])
+        body_length = _compact_json_length(message['body'],
+                                           CFG.message_size_uplimit)
         if body_length > CFG.message_size_uplimit:
             raise exceptions.ValidationFailed(
                 'message body larger than %d bytes' %
@@ -129,6 +141,18 @@ def message_listing(limit=None, **kwargs):
             CFG.message_paging_uplimit)
 
 
+def long_poll(wait):
+    """Restrictions on the time a request may wait for messages.
+
+    :param wait: Seconds to wait, or None for not waiting
+    :raises: ValidationFailed if the wait is out of range
+    """
+
+    if wait is not None and not (0 <= wait <= CFG.long_poll_wait_max):
+        raise exceptions.ValidationFailed(
+            'wait not in [0, %d]' % CFG.long_poll_wait_max)
+
+
 def claim_creation(metadata, **kwargs):
     """Restrictions on the claim parameters upon creation.
 
@@ -161,10 +185,128 @@ def claim_updating(metadata):
             CFG.claim_ttl_max)
 
 
-def _compact_json_length(obj):
-    # UTF-8 encoded, without whitespace
-    # TODO(zyuan): Replace this redundent re-serialization
-    # with a sizing-only parser.
-    return len(json.dumps(obj,
-                          ensure_ascii=False,
-                          separators=(',', ':')))
+def _compact_json_length(obj, limit=None):
+    """Computes the length of obj once serialized to compact JSON.
+
+    The length is that of the UTF-8 encoded document, without
+    whitespace, as produced by json.dumps(obj, ensure_ascii=False,
+    separators=(',', ':')), but it is summed up from the values
+    without building the document.
+
+    :param obj: a JSON-serializable object
+    :param limit: (Default None) if given, stop as soon as the
+        length is known to exceed limit
+    :returns: the length, or if it exceeds limit, a partial length
+        which is already greater than limit
+    :raises: TypeError if obj is not JSON-serializable
+    """
+
+    if limit is None:
+        limit = sys.maxsize
+
+    budget = limit
+    pending = [obj]
+    strings = []
+
+    # NOTE: Walk the containers with a stack, summing up the length of
+    # the scalars as they are found, but measuring the strings in
+    # batches, which is much faster than one at a time.
+    while pending:
+        obj = pending.pop()
+        kind = type(obj)
+
+        if kind is dict:
+            budget -= 1 + 2 * len(obj) if obj else 2
+            strings.extend(obj)
+            values = obj.itervalues()
+
+        elif kind is list or kind is tuple:
+            budget -= 1 + len(obj) if obj else 2
+            values = obj
+
+        else:
+            values = (obj,)
+
+        for value in values:
+            kind = type(value)
+
+            if kind is unicode or kind is str:
+                strings.append(value)
+
+            elif kind is int or kind is long:
+                budget -= len(str(value))
+
+            elif kind is bool or value is None:
+                budget -= _CONSTANT_LENGTH[value]
+
+            elif kind is float:
+                budget -= len(repr(value))
+
+            elif kind is dict or kind is list or kind is tuple:
+                pending.append(value)
+
+            else:
+                budget -= len(_to_compact_json(value))
+
+        if len(strings) >= _STRING_BATCH_SIZE or not pending:
+            budget -= _strings_length(strings, budget)
+            del strings[:]
+
+        if budget < 0:
+            break
+
+    return limit - budget
+
+
+_STRING_BATCH_SIZE = 256
+
+_STRING_ESCAPE = re.compile(r'[\x00-\x1f\\"]')
+
+# NOTE: The extra length of each escaped char; '"', '\\' and the
+# usual whitespace chars take two chars, the others take six.
+_STRING_ESCAPE_EXTRA = dict((unichr(c), 5) for c in range(0x20))
+_STRING_ESCAPE_EXTRA.update(dict.fromkeys(u'"\\\b\f\n\r\t', 1))
+
+_CONSTANT_LENGTH = {None: 4, True: 4, False: 5}
+
+
+def _strings_length(strings, budget):
+    """Computes the total length of a list of JSON strings.
+
+    Byte strings are taken to be UTF-8 encoded already; anything
+    else is taken to be a dict key, converted as json.dumps does.
+    """
+
+    try:
+        text = u''.join(strings)
+    except (TypeError, UnicodeDecodeError):
+        text = u''.join(_as_text(s) for s in strings)
+
+    # NOTE: Each char takes at least one byte, so that is enough
+    # to tell that a long string is over budget.
+    length = 2 * len(strings) + len(text)
+    if length > budget:
+        return length
+
+    length += len(text.encode('utf-8')) - len(text)
+
+    if _STRING_ESCAPE.search(text):
+        length += sum(_STRING_ESCAPE_EXTRA[c]
+                      for c in _STRING_ESCAPE.findall(text))
+
+    return length
+
+
+def _as_text(s):
+    if isinstance(s, unicode):
+        return s
+
+    if isinstance(s, str):
+        return s.decode('utf-8')
+
+    return _to_compact_json(s).decode('utf-8')
+
+
+def _to_compact_json(obj):
+    # NOTE: Used for the types that are not sized above
+    return utils.get_codec().dumps(obj, compact=True)
@@ -0,0 +1,52 @@
+# Copyright (c) 2013 Rackspace, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from marconi.queues.transport.wsgi import utils as wsgi_utils
+
+
+class MetricsResource(object):
+    """Reports the metrics recorded by this process.
+
+    Each worker process keeps its own metrics, so the counters only
+    cover the requests served by the worker answering this one.
+    """
+
+    __slots__ = ('registry',)
+
+    def __init__(self, registry):
+        self.registry = registry
+
+    def on_get(self, req, resp, project_id):
+        wsgi_utils.set_body(resp, self.registry.snapshot())
+        # status defaults to 200
+
+
+class ProfilesResource(object):
+    """Reports the functions taking the most time, by route.
+
+    Like metrics, the profiles only cover the requests sampled by the
+    worker process answering this one.
+    """
+
+    __slots__ = ('profiler',)
+
+    def __init__(self, profiler):
+        self.profiler = profiler
+
+    def on_get(self, req, resp, project_id):
+        limit = req.get_param_as_int('limit') or 20
+
+        wsgi_utils.set_body(resp, {'routes': self.profiler.summary(limit)})
+        # status defaults to 200
@@ -13,13 +13,14 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import time
+
 import falcon
 
 from marconi.common import config
 from marconi.common import exceptions as input_exceptions
 import marconi.openstack.common.log as logging
 from marconi.queues.storage import exceptions as storage_exceptions
-from marconi.queues.transport import utils
 from marconi.queues.transport import validation as validate
 from marconi.queues.transport.wsgi import exceptions as wsgi_exceptions
 from marconi.queues.transport.wsgi import utils as wsgi_utils
@@ -27,7 +28,9 @@ from marconi.queues.transport.wsgi import utils as wsgi_utils
 
 LOG = logging.getLogger(__name__)
 CFG = config.namespace('drivers:transport:wsgi').from_options(
-    metadata_max_length=64 * 1024
+    metadata_max_length=64 * 1024,
+    stream_responses=False,
+    long_poll_interval=1.0,
 )
 
 CLAIM_POST_SPEC = (('ttl', int), ('grace', int))
@@ -36,10 +39,50 @@ CLAIM_PATCH_SPEC = (('ttl', int),)
 
 class CollectionResource(object):
 
-    __slots__ = ('claim_controller')
+    __slots__ = ('claim_controller', 'message_controller', 'notifier')
 
-    def __init__(self, claim_controller):
+    def __init__(self, claim_controller, message_controller, notifier):
         self.claim_controller = claim_controller
+        self.message_controller = message_controller
+        self.notifier = notifier
+
+    def _claimable(self, project_id, queue_name):
+        """Checks whether the queue has any message left to claim."""
+        try:
+            results = self.message_controller.list(
+                queue_name, project=project_id, limit=1, echo=True)
+
+            return wsgi_utils.peek(next(results)) is not None
+
+        except storage_exceptions.DoesNotExist:
+            return False
+
+        except Exception as ex:
+            LOG.exception(ex)
+            description = _(u'Claim could not be created.')
+            raise wsgi_exceptions.HTTPServiceUnavailable(description)
+
+    def _create(self, project_id, queue_name, metadata, claim_options):
+        """Claims messages, and returns the claim ID and messages."""
+        try:
+            cid, msgs = self.claim_controller.create(
+                queue_name,
+                metadata=metadata,
+                project=project_id,
+                **claim_options)
+
+            # NOTE: Unless the response is streamed, buffer the
+            # messages here so that storage errors are reported as
+            # such, rather than raised while serializing.
+            resp_msgs = (wsgi_utils.peek(iter(msgs))
+                         if CFG.stream_responses else list(msgs))
+
+        except Exception as ex:
+            LOG.exception(ex)
+            description = _(u'Claim could not be created.')
+            raise wsgi_exceptions.HTTPServiceUnavailable(description)
+
+        return cid, resp_msgs
 
     def on_post(self, req, resp, project_id, queue_name):
         LOG.debug(_(u'Claims collection POST - queue: %(queue)s, '
@@ -50,6 +93,8 @@ class CollectionResource(object):
         limit = req.get_param_as_int('limit')
         claim_options = {} if limit is None else {'limit': limit}
 
+        wait = req.get_param_as_int('wait')
+
         # Place JSON size restriction before parsing
         if req.content_length > CFG.metadata_max_length:
             description = _(u'Claim metadata size is too large.')
@@ -57,41 +102,51 @@ class CollectionResource(object):
 
         # Read claim metadata (e.g., TTL) and raise appropriate
         # HTTP errors as needed.
-        metadata, = wsgi_utils.filter_stream(req.stream, req.content_length,
-                                             CLAIM_POST_SPEC)
+        metadata, = wsgi_utils.filter_stream(
+            req.stream, req.content_length, CLAIM_POST_SPEC,
+            media_type=wsgi_utils.request_media_type(req))
 
-        # Claim some messages
         try:
             validate.claim_creation(metadata, **claim_options)
-            cid, msgs = self.claim_controller.create(
-                queue_name,
-                metadata=metadata,
-                project=project_id,
-                **claim_options)
-
-            # Buffer claimed messages
-            # TODO(kgriffs): optimize, along with serialization (below)
-            resp_msgs = list(msgs)
+            validate.long_poll(wait)
 
         except input_exceptions.ValidationFailed as ex:
             raise wsgi_exceptions.HTTPBadRequestBody(str(ex))
 
-        except Exception as ex:
-            LOG.exception(ex)
-            description = _(u'Claim could not be created.')
-            raise wsgi_exceptions.HTTPServiceUnavailable(description)
+        cid, resp_msgs = self._create(project_id, queue_name,
+                                      metadata, claim_options)
+
+        # NOTE: While waiting for messages to claim, check for them
+        # with a listing of one message, which unlike a claim does
+        # not write, and only claim again once some are found. As for
+        # listings, answer at once when too many requests wait.
+        with self.notifier.waiting(None if resp_msgs else wait) as wait:
+            deadline = time.time() + (wait or 0)
+
+            while not resp_msgs:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+
+                with self.notifier.subscribe(queue_name,
+                                             project_id) as posted:
+                    if not self._claimable(project_id, queue_name):
+                        posted.wait(min(remaining, CFG.long_poll_interval))
+                        continue
+
+                cid, resp_msgs = self._create(project_id, queue_name,
+                                              metadata, claim_options)
 
         # Serialize claimed messages, if any. This logic assumes
         # the storage driver returned well-formed messages.
-        if len(resp_msgs) != 0:
-            for msg in resp_msgs:
-                msg['href'] = _msg_uri_from_claim(
-                    req.path.rpartition('/')[0], msg['id'], cid)
-
-                del msg['id']
+        if resp_msgs:
+            base_path = req.path.rpartition('/')[0]
 
             resp.location = req.path + '/' + cid
-            resp.body = utils.to_json(resp_msgs)
+            wsgi_utils.set_body(
+                resp, _prepare_messages(resp_msgs, base_path, cid),
+                media_type=wsgi_utils.response_media_type(req),
+                stream=CFG.stream_responses)
             resp.status = falcon.HTTP_201
         else:
             resp.status = falcon.HTTP_204
@@ -116,9 +171,10 @@ class ItemResource(object):
                 claim_id=claim_id,
                 project=project_id)
 
-            # Buffer claimed messages
-            # TODO(kgriffs): Optimize along with serialization (see below)
-            meta['messages'] = list(msgs)
+            # NOTE: Unless the response is streamed, buffer the
+            # messages here (see also CollectionResource.on_post)
+            if not CFG.stream_responses:
+                msgs = list(msgs)
 
         except storage_exceptions.DoesNotExist:
             raise falcon.HTTPNotFound()
@@ -127,18 +183,16 @@ class ItemResource(object):
             description = _(u'Claim could not be queried.')
             raise wsgi_exceptions.HTTPServiceUnavailable(description)
 
-        # Serialize claimed messages
-        # TODO(kgriffs): Optimize
-        for msg in meta['messages']:
-            msg['href'] = _msg_uri_from_claim(
-                req.path.rsplit('/', 2)[0], msg['id'], meta['id'])
-            del msg['id']
+        meta['messages'] = _prepare_messages(
+            msgs, req.path.rsplit('/', 2)[0], meta['id'])
 
         meta['href'] = req.path
         del meta['id']
 
         resp.content_location = req.relative_uri
-        resp.body = utils.to_json(meta)
+        wsgi_utils.set_body(resp, meta,
+                            media_type=wsgi_utils.response_media_type(req),
+                            stream=CFG.stream_responses)
         # status defaults to 200
 
     def on_patch(self, req, resp, project_id, queue_name, claim_id):
@@ -155,8 +209,9 @@ class ItemResource(object):
 
         # Read claim metadata (e.g., TTL) and raise appropriate
         # HTTP errors as needed.
-        metadata, = wsgi_utils.filter_stream(req.stream, req.content_length,
-                                             CLAIM_PATCH_SPEC)
+        metadata, = wsgi_utils.filter_stream(
+            req.stream, req.content_length, CLAIM_PATCH_SPEC,
+            media_type=wsgi_utils.request_media_type(req))
 
         try:
             validate.claim_updating(metadata)
@@ -197,6 +252,15 @@ class ItemResource(object):
             raise wsgi_exceptions.HTTPServiceUnavailable(description)
 
 
+def _prepare_messages(msgs, base_path, claim_id):
+    """Replaces the ID of each claimed message with its href."""
+    for msg in msgs:
+        msg['href'] = _msg_uri_from_claim(base_path, msg['id'], claim_id)
+        del msg['id']
+
+        yield msg
+
+
 # TODO(kgriffs): Clean up/optimize and move to wsgi.utils
 def _msg_uri_from_claim(base_path, msg_id, claim_id):
     return '/'.join(
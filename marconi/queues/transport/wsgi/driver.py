@@ -14,23 +14,46 @@
 # limitations under the License.
 
 import falcon
+import re
 from wsgiref import simple_server
 
 from marconi.common import config
+from marconi.common import context
+from marconi.common import metrics
 import marconi.openstack.common.log as logging
+from marconi.queues.storage import exceptions as storage_exceptions
 from marconi.queues import transport
 from marconi.queues.transport import auth
+from marconi.queues.transport import notifier
+from marconi.queues.transport import utils
+from marconi.queues.transport.wsgi import admin
 from marconi.queues.transport.wsgi import claims
 from marconi.queues.transport.wsgi import health
 from marconi.queues.transport.wsgi import messages
 from marconi.queues.transport.wsgi import metadata
+from marconi.queues.transport.wsgi import profiler
 from marconi.queues.transport.wsgi import queues
+from marconi.queues.transport.wsgi import server
 from marconi.queues.transport.wsgi import stats
+from marconi.queues.transport.wsgi import subscription
+from marconi.queues.transport.wsgi import utils as wsgi_utils
 from marconi.queues.transport.wsgi import v1
 
 OPTIONS = {
     'bind': '0.0.0.0',
-    'port': 8888
+    'port': 8888,
+
+    # NOTE: With no workers, the app is served by the single-threaded
+    # development server from wsgiref.
+    'workers': 0,
+    'threads': 1,
+    'green_threads': False,
+    'keepalive_timeout': 5,
+    'graceful_timeout': 30,
+    'backlog': 128,
+
+    # NOTE: The admin routes report on the requests of every project
+    'admin_api': False,
 }
 
 PROJECT_CFG = config.project('marconi')
@@ -40,79 +63,178 @@ WSGI_CFG = config.namespace('drivers:transport:wsgi').from_options(**OPTIONS)
 LOG = logging.getLogger(__name__)
 
 
+# NOTE: Media types served by some routes besides JSON
+_ALTERNATE_MEDIA_TYPES = (
+    (wsgi_utils.MSGPACK,
+     re.compile(r'^/v1/queues/[^/]+/(messages|claims)(/[^/]+)?$')),
+    (subscription.MEDIA_TYPE,
+     re.compile(r'^/v1/queues/[^/]+/subscription$')),
+)
+
+
 def _check_media_type(req, resp, params):
-    if not req.client_accepts('application/json'):
-        raise falcon.HTTPNotAcceptable(
-            u'''
-Endpoint only serves `application/json`; specify client-side
-media type support with the "Accept" header.''',
-            href=u'http://www.w3.org/Protocols/rfc2616/rfc2616-sec14.html',
-            href_text=u'14.1 Accept, Hypertext Transfer Protocol -- HTTP/1.1')
+    if req.client_accepts('application/json'):
+        return
+
+    served = ['application/json']
+    for media_type, routes in _ALTERNATE_MEDIA_TYPES:
+        if routes.match(req.path):
+            if req.client_accepts(media_type):
+                return
+
+            served.append(media_type)
+
+    raise falcon.HTTPNotAcceptable(
+        u'''
+Endpoint only serves %s; specify client-side
+media type support with the "Accept" header.''' %
+        u' or '.join(u'`%s`' % media_type for media_type in served),
+        href=u'http://www.w3.org/Protocols/rfc2616/rfc2616-sec14.html',
+        href_text=u'14.1 Accept, Hypertext Transfer Protocol -- HTTP/1.1')
 
 
 def _extract_project_id(req, resp, params):
     params['project_id'] = req.get_header('X-PROJECT-ID')
 
 
+def _init_context(req, resp, params):
+    ctx = context.RequestContext(tenant=params['project_id'])
+    ctx.update_store()
+
+    # NOTE: The store only keeps a weak reference to the context
+    req.env['marconi.context'] = ctx
+    resp.set_header('X-Openstack-Request-Id', ctx.request_id)
+
+
+def _is_server_error(ex):
+    # NOTE: Client errors are not counted as failed requests
+    return not isinstance(ex, falcon.HTTPError) or ex.status[0] == '5'
+
+
+def _is_storage_error(ex):
+    # NOTE: Missing and claimed resources are expected outcomes
+    return not isinstance(ex, (storage_exceptions.DoesNotExist,
+                               storage_exceptions.NotPermitted))
+
+
 class Driver(transport.DriverBase):
 
     def __init__(self, storage):
         super(Driver, self).__init__(storage)
 
+        # NOTE: Fail on startup if the JSON codec can not be loaded
+        utils.get_codec()
+
         self._init_routes()
         self._init_middleware()
 
     def _init_routes(self):
         """Initialize URI routes to resources."""
-        self.app = falcon.API(before=[_check_media_type, _extract_project_id])
+        self.notifier = notifier.Notifier()
+        self.metrics = metrics.from_config()
+        self.profiler = profiler.from_config()
 
-        queue_controller = self.storage.queue_controller
-        message_controller = self.storage.message_controller
-        claim_controller = self.storage.claim_controller
+        self.app = falcon.API(before=[_check_media_type, _extract_project_id,
+                                      _init_context])
+
+        if self.metrics is not None:
+            self.storage.instrument(self.metrics)
+
+        queue_controller = self._instrument(self.storage.queue_controller)
+        message_controller = self._instrument(self.storage.message_controller)
+        claim_controller = self._instrument(self.storage.claim_controller)
 
         # Home
-        self.app.add_route('/v1', v1.V1Resource())
+        self._add_route('/v1', v1.V1Resource())
 
         # Queues Endpoints
         queue_collection = queues.CollectionResource(queue_controller)
-        self.app.add_route('/v1/queues', queue_collection)
+        self._add_route('/v1/queues', queue_collection)
 
         queue_item = queues.ItemResource(queue_controller, message_controller)
-        self.app.add_route('/v1/queues/{queue_name}', queue_item)
+        self._add_route('/v1/queues/{queue_name}', queue_item)
 
         stats_endpoint = stats.Resource(queue_controller)
-        self.app.add_route('/v1/queues/{queue_name}'
-                           '/stats', stats_endpoint)
+        self._add_route('/v1/queues/{queue_name}'
+                        '/stats', stats_endpoint)
 
         # Metadata Endpoints
         metadata_endpoint = metadata.Resource(queue_controller)
-        self.app.add_route('/v1/queues/{queue_name}'
-                           '/metadata', metadata_endpoint)
+        self._add_route('/v1/queues/{queue_name}'
+                        '/metadata', metadata_endpoint)
+
+        # Subscription Endpoint
+        subscription_endpoint = subscription.Resource(queue_controller,
+                                                      message_controller,
+                                                      self.notifier)
+        self._add_route('/v1/queues/{queue_name}'
+                        '/subscription', subscription_endpoint)
 
         # Messages Endpoints
-        msg_collection = messages.CollectionResource(message_controller)
-        self.app.add_route('/v1/queues/{queue_name}'
-                           '/messages', msg_collection)
+        msg_collection = messages.CollectionResource(message_controller,
+                                                     self.notifier)
+        self._add_route('/v1/queues/{queue_name}'
+                        '/messages', msg_collection)
 
         msg_item = messages.ItemResource(message_controller)
-        self.app.add_route('/v1/queues/{queue_name}'
-                           '/messages/{message_id}', msg_item)
+        self._add_route('/v1/queues/{queue_name}'
+                        '/messages/{message_id}', msg_item)
 
         # Claims Endpoints
-        claim_collection = claims.CollectionResource(claim_controller)
-        self.app.add_route('/v1/queues/{queue_name}'
-                           '/claims', claim_collection)
+        claim_collection = claims.CollectionResource(claim_controller,
+                                                     message_controller,
+                                                     self.notifier)
+        self._add_route('/v1/queues/{queue_name}'
+                        '/claims', claim_collection)
 
         claim_item = claims.ItemResource(claim_controller)
-        self.app.add_route('/v1/queues/{queue_name}'
-                           '/claims/{claim_id}', claim_item)
+        self._add_route('/v1/queues/{queue_name}'
+                        '/claims/{claim_id}', claim_item)
 
         # Health
-        self.app.add_route('/v1/health', health.HealthResource())
+        self._add_route('/v1/health', health.HealthResource())
+
+        # Metrics
+        if self.metrics is not None and WSGI_CFG.admin_api:
+            self.app.add_route('/v1/metrics',
+                               admin.MetricsResource(self.metrics))
+
+        # Profiles
+        if self.profiler is not None and WSGI_CFG.admin_api:
+            self.app.add_route('/v1/profiles',
+                               admin.ProfilesResource(self.profiler))
+
+    def _add_route(self, uri_template, resource):
+        """Adds a route, along with its metrics and profiles if enabled.
+
+        The timers are named after the route and responder; for
+        example, "/v1/queues/{queue_name}/messages.on_post".
+        """
+        if self.metrics is not None:
+            resource = metrics.Instrumented(resource, self.metrics,
+                                            prefix=uri_template,
+                                            is_error=_is_server_error)
+
+        self.app.add_route(uri_template, resource)
+
+        if self.profiler is not None:
+            self.profiler.add_route(uri_template)
+
+    def _instrument(self, controller):
+        """Times the calls to a storage controller, if enabled."""
+        if self.metrics is None:
+            return controller
+
+        return metrics.Instrumented(controller, self.metrics,
+                                    is_error=_is_storage_error)
 
     def _init_middleware(self):
         """Initialize WSGI middlewarez."""
 
+        # NOTE: Profile the app, but not the auth middleware
+        if self.profiler is not None:
+            self.app = self.profiler.install(self.app)
+
         # NOTE(flaper87): Install Auth
         if GLOBAL_CFG.auth_strategy:
             strategy = auth.strategy(GLOBAL_CFG.auth_strategy)
@@ -125,6 +247,26 @@ class Driver(transport.DriverBase):
         msg %= {'bind': WSGI_CFG.bind, 'port': WSGI_CFG.port}
         LOG.info(msg)
 
+        # NOTE: A waiting request holds a thread, or green thread, of
+        # its worker; leave at least one to serve the other requests.
+        # Single-threaded workers do not let requests wait at all.
+        if WSGI_CFG.workers and (WSGI_CFG.threads > 1 or
+                                 WSGI_CFG.green_threads):
+            self.notifier.max_waiters = WSGI_CFG.threads - 1
+        else:
+            self.notifier.max_waiters = 0
+
+        if WSGI_CFG.workers:
+            httpd = server.Server(self.app, WSGI_CFG.bind, WSGI_CFG.port,
+                                  workers=WSGI_CFG.workers,
+                                  threads=WSGI_CFG.threads,
+                                  green_threads=WSGI_CFG.green_threads,
+                                  keepalive_timeout=WSGI_CFG.keepalive_timeout,
+                                  graceful_timeout=WSGI_CFG.graceful_timeout,
+                                  backlog=WSGI_CFG.backlog)
+            httpd.serve()
+            return
+
         httpd = simple_server.make_server(WSGI_CFG.bind, WSGI_CFG.port,
                                           self.app)
         httpd.serve_forever()
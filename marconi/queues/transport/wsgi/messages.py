@@ -12,13 +12,14 @@
 # implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import time
+
 import falcon
 
 from marconi.common import config
 from marconi.common import exceptions as input_exceptions
 import marconi.openstack.common.log as logging
 from marconi.queues.storage import exceptions as storage_exceptions
-from marconi.queues.transport import utils
 from marconi.queues.transport import validation as validate
 from marconi.queues.transport.wsgi import exceptions as wsgi_exceptions
 from marconi.queues.transport.wsgi import utils as wsgi_utils
@@ -26,7 +27,9 @@ from marconi.queues.transport.wsgi import utils as wsgi_utils
 
 LOG = logging.getLogger(__name__)
 CFG = config.namespace('drivers:transport:wsgi').from_options(
-    content_max_length=256 * 1024
+    content_max_length=256 * 1024,
+    stream_responses=False,
+    long_poll_interval=1.0,
 )
 
 MESSAGE_POST_SPEC = (('ttl', int), ('body', '*'))
@@ -34,10 +37,11 @@ MESSAGE_POST_SPEC = (('ttl', int), ('body', '*'))
 
 class CollectionResource(object):
 
-    __slots__ = ('message_controller')
+    __slots__ = ('message_controller', 'notifier')
 
-    def __init__(self, message_controller):
+    def __init__(self, message_controller, notifier):
         self.message_controller = message_controller
+        self.notifier = notifier
 
     #-----------------------------------------------------------------------
     # Helpers
@@ -72,6 +76,33 @@ class CollectionResource(object):
 
         return messages
 
+    def _list(self, project_id, queue_name, uuid, kwargs):
+        """Lists the messages, and returns them with the storage cursor."""
+        try:
+            results = self.message_controller.list(
+                queue_name,
+                project=project_id,
+                client_uuid=uuid,
+                **kwargs)
+
+            cursor = next(results)
+
+            # NOTE: Unless the response is streamed, buffer the
+            # messages here so that storage errors are reported as
+            # such, rather than raised while serializing.
+            messages = (wsgi_utils.peek(cursor) if CFG.stream_responses
+                        else list(cursor))
+
+        except storage_exceptions.DoesNotExist:
+            raise falcon.HTTPNotFound()
+
+        except Exception as ex:
+            LOG.exception(ex)
+            description = _(u'Messages could not be listed.')
+            raise wsgi_exceptions.HTTPServiceUnavailable(description)
+
+        return results, messages
+
     def _get(self, req, project_id, queue_name):
         uuid = req.get_header('Client-ID', required=True)
 
@@ -84,46 +115,58 @@ class CollectionResource(object):
         req.get_param_as_bool('echo', store=kwargs)
         req.get_param_as_bool('include_claimed', store=kwargs)
 
+        wait = req.get_param_as_int('wait')
+
         try:
             validate.message_listing(**kwargs)
-            results = self.message_controller.list(
-                queue_name,
-                project=project_id,
-                client_uuid=uuid,
-                **kwargs)
-
-            # Buffer messages
-            cursor = next(results)
-            messages = list(cursor)
+            validate.long_poll(wait)
 
         except input_exceptions.ValidationFailed as ex:
             raise wsgi_exceptions.HTTPBadRequestBody(str(ex))
 
-        except storage_exceptions.DoesNotExist:
-            raise falcon.HTTPNotFound()
+        # NOTE: While waiting, the listing is repeated as soon as
+        # messages are posted to the queue through this process, or
+        # else every long_poll_interval seconds, to see the messages
+        # posted through the other ones. Requests answer at once when
+        # too many wait already, for the posts to still be served.
+        with self.notifier.waiting(wait) as wait:
+            deadline = time.time() + (wait or 0)
 
-        except Exception as ex:
-            LOG.exception(ex)
-            description = _(u'Messages could not be listed.')
-            raise wsgi_exceptions.HTTPServiceUnavailable(description)
+            while True:
+                with self.notifier.subscribe(queue_name,
+                                             project_id) as posted:
+                    results, messages = self._list(project_id, queue_name,
+                                                   uuid, kwargs)
+
+                    remaining = deadline - time.time()
+                    if messages or remaining <= 0:
+                        break
+
+                    posted.wait(min(remaining, CFG.long_poll_interval))
 
         if not messages:
             return None
 
         # Found some messages, so prepare the response
-        kwargs['marker'] = next(results)
-        for each_message in messages:
-            each_message['href'] = req.path + '/' + each_message['id']
-            del each_message['id']
+        def prepare(messages):
+            for each_message in messages:
+                each_message['href'] = req.path + '/' + each_message['id']
+                del each_message['id']
+
+                yield each_message
+
+        # NOTE: The marker is only known once all of the messages
+        # have been read, hence the links are serialized last.
+        def links():
+            kwargs['marker'] = next(results)
+            yield {
+                'rel': 'next',
+                'href': req.path + falcon.to_query_str(kwargs)
+            }
 
         return {
-            'messages': messages,
-            'links': [
-                {
-                    'rel': 'next',
-                    'href': req.path + falcon.to_query_str(kwargs)
-                }
-            ]
+            'messages': prepare(messages),
+            'links': links(),
         }
 
     #-----------------------------------------------------------------------
@@ -147,27 +190,34 @@ class CollectionResource(object):
             req.stream,
             req.content_length,
             MESSAGE_POST_SPEC,
-            doctype=wsgi_utils.JSONArray)
-
-        # Enqueue the messages
-        partial = False
+            doctype=wsgi_utils.JSONArray,
+            media_type=wsgi_utils.request_media_type(req))
 
+        # NOTE: The messages are parsed, filtered and validated one
+        # at a time, so a bad one fails the request before the rest
+        # of the body is read. HTTP errors raised while parsing must
+        # not be caught by the generic handler below.
         try:
             # No need to check each message's size if it
             # can not exceed the request size limit
-            validate.message_posting(
+            messages = validate.message_posting(
                 messages, check_size=(
                     validate.CFG.message_size_uplimit <
                     CFG.content_max_length))
+
+        except input_exceptions.ValidationFailed as ex:
+            raise wsgi_exceptions.HTTPBadRequestBody(str(ex))
+
+        # Enqueue the messages
+        partial = False
+
+        try:
             message_ids = self.message_controller.post(
                 queue_name,
                 messages=messages,
                 project=project_id,
                 client_uuid=uuid)
 
-        except input_exceptions.ValidationFailed as ex:
-            raise wsgi_exceptions.HTTPBadRequestBody(str(ex))
-
         except storage_exceptions.DoesNotExist:
             raise falcon.HTTPNotFound()
 
@@ -187,13 +237,16 @@ class CollectionResource(object):
             description = _(u'Messages could not be enqueued.')
             raise wsgi_exceptions.HTTPServiceUnavailable(description)
 
+        self.notifier.notify(queue_name, project_id)
+
         # Prepare the response
         ids_value = ','.join(message_ids)
         resp.location = req.path + '?ids=' + ids_value
 
         hrefs = [req.path + '/' + id for id in message_ids]
         body = {'resources': hrefs, 'partial': partial}
-        resp.body = utils.to_json(body)
+        wsgi_utils.set_body(resp, body,
+                            media_type=wsgi_utils.response_media_type(req))
         resp.status = falcon.HTTP_201
 
     def on_get(self, req, resp, project_id, queue_name):
@@ -214,7 +267,10 @@ class CollectionResource(object):
             resp.status = falcon.HTTP_204
             return
 
-        resp.body = utils.to_json(response)
+        wsgi_utils.set_body(resp, response,
+                            media_type=wsgi_utils.response_media_type(req),
+                            stream=CFG.stream_responses,
+                            item_sort_key=_links_last)
         # status defaults to 200
 
     def on_delete(self, req, resp, project_id, queue_name):
@@ -272,7 +328,8 @@ class ItemResource(object):
         del message['id']
 
         resp.content_location = req.relative_uri
-        resp.body = utils.to_json(message)
+        wsgi_utils.set_body(resp, message,
+                            media_type=wsgi_utils.response_media_type(req))
         # status defaults to 200
 
     def on_delete(self, req, resp, project_id, queue_name, message_id):
@@ -302,3 +359,7 @@ class ItemResource(object):
 
         # Alles guete
         resp.status = falcon.HTTP_204
+
+
+def _links_last(item):
+    return item[0] == 'links'
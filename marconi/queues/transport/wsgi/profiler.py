@@ -0,0 +1,203 @@
+# Copyright (c) 2013 Rackspace, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Middleware profiling a sample of the requests with cProfile."""
+
+import cProfile
+import os
+import pstats
+import random
+import re
+import threading
+import time
+
+from falcon import api_helpers
+
+from marconi.common import config
+import marconi.openstack.common.log as logging
+
+CFG = config.namespace('profiling').from_options(
+    sample_rate=0.0,
+    header='',
+    output_dir='',
+    dump_interval=60,
+)
+
+LOG = logging.getLogger(__name__)
+
+_FILENAME_UNSAFE = re.compile(r'[^\w.-]+')
+
+
+class Profiler(object):
+    """Profiles some of the requests, and sums up the stats by route.
+
+    Requests are picked at random, at the given rate, or when they
+    carry the given header. The stats of each route and method are
+    added up, so that they cover the body of the response as well,
+    until it is closed.
+
+    :param sample_rate: Fraction of the requests to profile
+    :param header: (Default None) name of a header asking for the
+        request to be profiled
+    :param output_dir: (Default None) directory where the stats of each
+        route are dumped, in the pstats format
+    :param dump_interval: (Default 60) minimum number of seconds
+        between dumps
+    """
+
+    def __init__(self, sample_rate, header=None, output_dir=None,
+                 dump_interval=60):
+        self.app = None
+
+        self._sample_rate = sample_rate
+        self._header = header and 'HTTP_' + header.upper().replace('-', '_')
+        self._output_dir = output_dir
+        self._dump_interval = dump_interval
+
+        self._routes = []
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._requests = {}
+        self._dumped = time.time()
+
+    def add_route(self, uri_template):
+        """Sums up the stats of the requests to a route together.
+
+        :param uri_template: A URI template added to the falcon app
+        """
+        fields, path_template = api_helpers.compile_uri_template(uri_template)
+        self._routes.insert(0, (path_template, uri_template))
+
+    def install(self, app):
+        """Installs the profiler in front of a WSGI app."""
+        self.app = app
+        return self
+
+    def __call__(self, env, start_response):
+        if not (random.random() < self._sample_rate or
+                (self._header and self._header in env)):
+            return self.app(env, start_response)
+
+        key = env['REQUEST_METHOD'] + ' ' + self._route(env['PATH_INFO'])
+        profile = cProfile.Profile()
+
+        profile.enable()
+        try:
+            body = self.app(env, start_response)
+        finally:
+            profile.disable()
+
+        return self._profile_body(body, key, profile)
+
+    def _route(self, path):
+        for path_template, uri_template in self._routes:
+            if path_template.match(path):
+                return uri_template
+
+        return '<unrouted>'
+
+    def _profile_body(self, body, key, profile):
+        iterator = iter(body)
+
+        try:
+            while True:
+                profile.enable()
+                try:
+                    chunk = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    profile.disable()
+
+                yield chunk
+
+        finally:
+            if hasattr(body, 'close'):
+                body.close()
+
+            self._add(key, profile)
+
+    def _add(self, key, profile):
+        with self._lock:
+            if key in self._stats:
+                self._stats[key].add(profile)
+            else:
+                self._stats[key] = pstats.Stats(profile)
+
+            self._requests[key] = self._requests.get(key, 0) + 1
+
+            if not (self._output_dir and
+                    time.time() - self._dumped >= self._dump_interval):
+                return
+
+            self._dumped = time.time()
+
+            try:
+                self._dump()
+            except EnvironmentError as ex:
+                LOG.exception(ex)
+
+    def _dump(self):
+        """Writes the stats of each route to the output directory.
+
+        The files are named after the method and route, and are
+        replaced on each dump; load them with pstats.
+        """
+        for key, stats in self._stats.iteritems():
+            filename = _FILENAME_UNSAFE.sub('_', key).strip('_') + '.prof'
+            path = os.path.join(self._output_dir, filename)
+
+            stats.dump_stats(path + '.tmp')
+            os.rename(path + '.tmp', path)
+
+    def summary(self, limit=20):
+        """Returns the functions taking the most time, by route.
+
+        :param limit: (Default 20) number of functions per route
+        :returns: a JSON-serializable dict
+        """
+        summary = {}
+
+        with self._lock:
+            for key, stats in self._stats.iteritems():
+                functions = sorted(stats.stats.iteritems(),
+                                   key=lambda item: item[1][3],
+                                   reverse=True)[:limit]
+
+                summary[key] = {
+                    'requests': self._requests[key],
+                    'functions': [{
+                        'function': '%s:%d(%s)' % function,
+                        'calls': calls,
+                        'total_time': round(total_time, 6),
+                        'cumulative_time': round(cumulative_time, 6),
+                    } for function, (primitive_calls, calls, total_time,
+                                     cumulative_time, callers) in functions]
+                }
+
+        return summary
+
+
+def from_config():
+    """Returns a profiler configured per the profiling options.
+
+    :returns: a Profiler, or None if profiling is disabled
+    """
+    if not (CFG.sample_rate > 0 or CFG.header):
+        return None
+
+    return Profiler(CFG.sample_rate, header=CFG.header or None,
+                    output_dir=CFG.output_dir or None,
+                    dump_interval=CFG.dump_interval)
@@ -0,0 +1,739 @@
+# Copyright (c) 2013 Rackspace, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Pre-forking WSGI server.
+
+The master process binds the listening socket, then forks the
+workers, which all accept connections from that socket. Each worker
+serves its connections one at a time, or from a pool of threads or
+green threads; a pool keeps the connections alive between requests.
+
+The master restarts the workers that die. On SIGHUP, it starts a new
+set of workers and retires the old ones, which stop accepting and
+finish the requests in flight; on SIGTERM or SIGINT, it retires all
+the workers and exits.
+"""
+
+import errno
+import os
+import Queue
+import select
+import signal
+import socket
+import threading
+import time
+from wsgiref import simple_server
+
+import marconi.openstack.common.log as logging
+
+LOG = logging.getLogger(__name__)
+
+# Largest request body read and discarded to keep a connection alive
+# when the application did not consume it.
+_MAX_DISCARDED_BODY = 64 * 1024
+
+# Seconds between checks of the stop flag while idle
+_POLL_INTERVAL = 1.0
+
+
+class Server(object):
+    """Binds a listening socket, and serves an app from forked workers.
+
+    :param app: the WSGI application
+    :param bind: the address to listen on
+    :param port: the port to listen on, 0 to pick any free port
+    :param workers: the number of worker processes
+    :param threads: the number of requests served at once by
+        each worker; with 1, they are served from the worker's main
+        thread, as some storage drivers require
+    :param green_threads: serve the connections from green threads
+        instead of native threads (requires eventlet)
+    :param keepalive_timeout: seconds to wait for the next request on
+        an idle connection; 0 closes the connections after each
+        request, as do the workers without a pool
+    :param graceful_timeout: seconds to let a retiring worker finish
+        its requests in flight before killing it
+    :param backlog: the length of the queue of pending connections
+    """
+
+    def __init__(self, app, bind, port, workers=1, threads=1,
+                 green_threads=False, keepalive_timeout=5,
+                 graceful_timeout=30, backlog=128):
+
+        if workers < 1:
+            raise ValueError(u'workers must be a positive integer')
+
+        if threads < 1:
+            raise ValueError(u'threads must be a positive integer')
+
+        if green_threads:
+            # NOTE: Fail on startup rather than in every worker
+            import eventlet  # noqa
+
+        self.app = app
+        self.workers = workers
+        self.threads = threads
+        self.green_threads = green_threads
+        self.keepalive_timeout = keepalive_timeout
+        self.graceful_timeout = graceful_timeout
+
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind((bind, port))
+        self.socket.listen(backlog)
+
+        # NOTE: The workers race for each connection, so only the
+        # one that wins may block on it.
+        self.socket.setblocking(0)
+
+        self.server_name, self.server_port = self.socket.getsockname()[:2]
+
+        self._running = False
+        self._restart_requested = False
+        self._children = {}
+        self._retiring = {}
+
+    def serve(self):
+        """Runs the master process until SIGTERM or SIGINT."""
+
+        self._running = True
+
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        signal.signal(signal.SIGHUP, self._restart)
+
+        # NOTE: Only there to wake the master up when a worker exits
+        signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+
+        try:
+            while self._running:
+                self._reap()
+
+                if self._restart_requested:
+                    self._restart_requested = False
+                    self._retire(self._children.keys())
+
+                self._kill_overdue()
+
+                while len(self._children) < self.workers:
+                    self._spawn()
+
+                time.sleep(_POLL_INTERVAL)
+
+        finally:
+            self._retire(self._children.keys())
+
+            while self._retiring:
+                self._kill_overdue()
+                self._reap()
+                time.sleep(0.1)
+
+            self.socket.close()
+
+    def _stop(self, signum, frame):
+        LOG.info(_(u'Stopping the workers'))
+        self._running = False
+
+    def _restart(self, signum, frame):
+        LOG.info(_(u'Restarting the workers'))
+        self._restart_requested = True
+
+    def _spawn(self):
+        pid = os.fork()
+        if pid:
+            self._children[pid] = time.time()
+            return
+
+        # NOTE: In the worker process from here on; never return
+        # into the master's stack.
+        status = 0
+        try:
+            worker = Worker(self.socket, self.app, self.server_name,
+                            self.server_port, self.threads,
+                            self.green_threads, self.keepalive_timeout,
+                            self.graceful_timeout)
+
+            signal.signal(signal.SIGTERM,
+                          lambda signum, frame: worker.stop())
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            signal.signal(signal.SIGHUP, signal.SIG_IGN)
+            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+
+            # NOTE: A SIGTERM received before the handlers above were
+            # set went to the master's handler.
+            if not self._running:
+                worker.stop()
+
+            worker.run()
+
+        except Exception as ex:
+            LOG.exception(ex)
+            status = 1
+
+        finally:
+            os._exit(status)
+
+    def _retire(self, pids):
+        deadline = time.time() + self.graceful_timeout
+
+        for pid in pids:
+            del self._children[pid]
+            self._retiring[pid] = deadline
+            self._kill(pid, signal.SIGTERM)
+
+    def _kill_overdue(self):
+        now = time.time()
+
+        for pid, deadline in self._retiring.items():
+            if deadline < now:
+                self._kill(pid, signal.SIGKILL)
+
+    def _kill(self, pid, signum):
+        try:
+            os.kill(pid, signum)
+        except OSError as ex:
+            if ex.errno != errno.ESRCH:
+                raise
+
+    def _reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except OSError as ex:
+                if ex.errno == errno.EINTR:
+                    continue
+
+                if ex.errno == errno.ECHILD:
+                    return
+
+                raise
+
+            if not pid:
+                return
+
+            if self._retiring.pop(pid, None) is not None:
+                continue
+
+            if self._children.pop(pid, None) is not None:
+                msg = _(u'Worker %(pid)d died with status %(status)d')
+                LOG.warning(msg % {'pid': pid, 'status': status})
+
+
+class Worker(object):
+    """Serves the connections accepted from a listening socket.
+
+    The arguments are the same as for Server, plus the name and port
+    the socket is bound to.
+
+    Connections are only kept alive when served from a pool: an idle
+    connection then waits for its next request without holding a
+    thread, so that it does not keep the other clients waiting.
+    """
+
+    def __init__(self, sock, app, server_name, server_port, threads=1,
+                 green_threads=False, keepalive_timeout=5,
+                 graceful_timeout=30):
+
+        if green_threads:
+            # NOTE: Patch before creating any lock or condition, so
+            # that they are green ones that do not block the hub.
+            import eventlet
+            eventlet.monkey_patch()
+
+        self.socket = sock
+        self.app = app
+        self.threads = threads
+        self.green_threads = green_threads
+        self.keepalive_timeout = keepalive_timeout
+        self.graceful_timeout = graceful_timeout
+
+        # NOTE: A single-threaded worker would serve nobody else
+        # while waiting on a kept-alive connection.
+        self.keepalive = bool(keepalive_timeout and
+                              (green_threads or threads > 1))
+
+        self.alive = True
+
+        self.base_environ = {
+            'SERVER_NAME': server_name,
+            'SERVER_PORT': str(server_port),
+            'GATEWAY_INTERFACE': 'CGI/1.1',
+            'SCRIPT_NAME': '',
+            'REMOTE_HOST': '',
+            'CONTENT_LENGTH': '',
+        }
+
+        self._master = os.getppid()
+        self._busy = 0
+        self._lock = threading.Lock()
+
+        # NOTE: The idle connections, by file number, with the time
+        # after which they are closed
+        self._parked = {}
+        self._wakeup = None
+
+    def get_app(self):
+        return self.app
+
+    def run(self):
+        """Serves connections until stop() is called."""
+
+        if self.green_threads:
+            self._run_green()
+        elif self.threads > 1:
+            self._run_threaded()
+        else:
+            while self.alive:
+                accepted = self._accept()
+                if accepted:
+                    self._serve(_RequestHandler(*accepted, server=self))
+
+    def stop(self):
+        """Stops accepting connections, and closes the idle ones."""
+        self.alive = False
+
+    def _run_threaded(self):
+        accepted_queue = Queue.Queue()
+
+        pool = [threading.Thread(target=self._serve_queue,
+                                 args=(accepted_queue,))
+                for n in range(self.threads)]
+
+        for thread in pool:
+            thread.daemon = True
+            thread.start()
+
+        wakeup, self._wakeup = os.pipe()
+        deadline = None
+
+        try:
+            while True:
+                with self._lock:
+                    # NOTE: Leave the new connections to the other
+                    # workers while every thread of this one is busy.
+                    accepting = self.alive and self._busy < self.threads
+                    parked = dict(self._parked)
+                    busy = self._busy
+
+                if not self.alive:
+                    if deadline is None:
+                        deadline = time.time() + self.graceful_timeout
+
+                    if not (parked or busy) or deadline < time.time():
+                        break
+
+                for handler in self._poll(wakeup, parked, accepting):
+                    with self._lock:
+                        self._busy += 1
+
+                    accepted_queue.put(handler)
+
+        finally:
+            for thread in pool:
+                accepted_queue.put(None)
+
+            deadline = time.time() + self.graceful_timeout
+            for thread in pool:
+                thread.join(max(deadline - time.time(), 0))
+
+            with self._lock:
+                parked, self._parked = self._parked, {}
+
+            for handler, expiry in parked.values():
+                handler.close()
+
+            os.close(wakeup)
+            os.close(self._wakeup)
+
+    def _poll(self, wakeup, parked, accepting):
+        """Waits for requests on the idle connections, or for a new one.
+
+        :returns: the handlers of the connections ready to be served
+        """
+        poller = select.poll()
+        poller.register(wakeup, select.POLLIN)
+
+        for fileno in parked:
+            poller.register(fileno, select.POLLIN)
+
+        if accepting:
+            poller.register(self.socket, select.POLLIN)
+
+        try:
+            events = poller.poll(_POLL_INTERVAL * 1000)
+        except select.error as ex:
+            if ex.args[0] != errno.EINTR:
+                raise
+
+            events = []
+
+        ready = []
+        for fileno, event in events:
+            if fileno == wakeup:
+                os.read(wakeup, 4096)
+
+            elif fileno in parked:
+                with self._lock:
+                    self._parked.pop(fileno, None)
+
+                ready.append(parked[fileno][0])
+
+            else:
+                accepted = self._take()
+                if accepted:
+                    ready.append(_RequestHandler(*accepted, server=self))
+
+        if not events:
+            # NOTE: Do not outlive the master
+            if os.getppid() != self._master:
+                self.stop()
+
+        now = time.time()
+        for fileno, (handler, expiry) in parked.items():
+            if expiry < now:
+                with self._lock:
+                    self._parked.pop(fileno, None)
+
+                handler.close()
+
+        return ready
+
+    def _serve_queue(self, accepted_queue):
+        for handler in iter(accepted_queue.get, None):
+            try:
+                while self._serve(handler):
+                    # NOTE: The next request may have been read along
+                    # with the last one; it would not wake the poller.
+                    if not handler.buffered:
+                        self._park(handler)
+                        break
+            finally:
+                with self._lock:
+                    self._busy -= 1
+
+                os.write(self._wakeup, '.')
+
+    def _park(self, handler):
+        with self._lock:
+            expiry = time.time() + self.keepalive_timeout
+            self._parked[handler.connection.fileno()] = (handler, expiry)
+
+    def _run_green(self):
+        import eventlet
+        from eventlet import greenio
+        from eventlet import semaphore
+
+        self.socket = greenio.GreenSocket(self.socket)
+
+        # NOTE: Limits the requests served at once, rather than the
+        # connections, so that the idle ones do not hold a slot.
+        slots = semaphore.Semaphore(self.threads)
+        connections = set()
+
+        while self.alive:
+            if slots.locked():
+                eventlet.sleep(0.01)
+                continue
+
+            accepted = self._accept()
+            if accepted:
+                handler = _RequestHandler(*accepted, server=self)
+                thread = eventlet.spawn(self._serve_green, handler, slots)
+                thread.link(lambda thread: connections.discard(thread))
+                connections.add(thread)
+
+        with eventlet.Timeout(self.graceful_timeout, False):
+            for thread in list(connections):
+                thread.wait()
+
+    def _serve_green(self, handler, slots):
+        while True:
+            with slots:
+                if not self._serve(handler):
+                    return
+
+            # NOTE: Select is green once patched
+            if not handler.buffered:
+                readable, _w, _x = select.select([handler.connection],
+                                                 [], [],
+                                                 self.keepalive_timeout)
+                if not readable:
+                    handler.close()
+                    return
+
+    def _accept(self):
+        try:
+            readable, _w, _x = select.select([self.socket], [], [],
+                                             _POLL_INTERVAL)
+        except select.error as ex:
+            if ex.args[0] != errno.EINTR:
+                raise
+
+            return None
+
+        if not readable:
+            # NOTE: Do not outlive the master
+            if os.getppid() != self._master:
+                self.stop()
+
+            return None
+
+        return self._take()
+
+    def _take(self):
+        """Accepts a connection, unless another worker took it."""
+        try:
+            conn, address = self.socket.accept()
+
+        except socket.error as ex:
+            if ex.args[0] in (errno.EINTR, errno.EAGAIN,
+                              errno.EWOULDBLOCK, errno.ECONNABORTED):
+                return None
+
+            raise
+
+        conn.setblocking(1)
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return conn, address
+
+    def _serve(self, handler):
+        """Serves a request from a connection.
+
+        :returns: True if the connection is kept alive, else False,
+            once closed
+        """
+        try:
+            if handler.serve():
+                return True
+
+        except socket.error as ex:
+            # NOTE: Clients may hang up at any time
+            LOG.debug(ex)
+
+        except Exception as ex:
+            LOG.exception(ex)
+
+        handler.close()
+        return False
+
+
+class _Input(object):
+    """Limits the reads from a connection to the request body."""
+
+    def __init__(self, stream, length):
+        self._stream = stream
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+
+        data = self._stream.read(size) if size else ''
+        self.remaining -= len(data)
+        return data
+
+    def readline(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+
+        data = self._stream.readline(size) if size else ''
+        self.remaining -= len(data)
+        return data
+
+    def readlines(self, hint=None):
+        return list(self)
+
+    def __iter__(self):
+        return iter(self.readline, '')
+
+    def discard(self, limit):
+        """Reads and drops the rest of the body, if at most %limit bytes.
+
+        :returns: True if the whole body has been read, else False
+        """
+        if self.remaining > limit:
+            return False
+
+        while self.remaining:
+            if not self.read(self.remaining):
+                return False
+
+        return True
+
+
+class _ServerHandler(simple_server.ServerHandler):
+    """Frames the responses so that the connection can be kept alive.
+
+    Responses of unknown length are sent with the chunked transfer
+    coding to HTTP/1.1 clients, and close the connection otherwise.
+    """
+
+    http_version = '1.1'
+    chunked = False
+
+    def cleanup_headers(self):
+        simple_server.ServerHandler.cleanup_headers(self)
+
+        request_handler = self.request_handler
+
+        if 'Content-Length' not in self.headers:
+            if (self.environ['SERVER_PROTOCOL'] == 'HTTP/1.1' and
+                    self.environ['REQUEST_METHOD'] != 'HEAD' and
+                    self.status[:3] not in ('204', '304')):
+                self.headers['Transfer-Encoding'] = 'chunked'
+                self.chunked = True
+            else:
+                request_handler.close_connection = 1
+
+        # NOTE: Unread bytes of the request body would be taken for
+        # the start of the next request.
+        if not self.stdin.discard(_MAX_DISCARDED_BODY):
+            request_handler.close_connection = 1
+
+        if request_handler.close_connection:
+            self.headers['Connection'] = 'close'
+        elif self.environ['SERVER_PROTOCOL'] == 'HTTP/1.0':
+            self.headers['Connection'] = 'keep-alive'
+
+    def write(self, data):
+        if not self.status:
+            raise AssertionError('write() before start_response()')
+
+        if not self.headers_sent:
+            self.bytes_sent = len(data)
+            self.send_headers()
+        else:
+            self.bytes_sent += len(data)
+
+        if self.chunked:
+            # NOTE: An empty chunk would end the body
+            if not data:
+                return
+
+            data = '%x\r\n%s\r\n' % (len(data), data)
+
+        self._write(data)
+        self._flush()
+
+    def finish_content(self):
+        simple_server.ServerHandler.finish_content(self)
+
+        if self.chunked:
+            self._write('0\r\n\r\n')
+            self._flush()
+
+    def handle_error(self):
+        # NOTE: Once the headers are out, the error can only be
+        # signaled by cutting the response short.
+        if self.headers_sent:
+            self.request_handler.close_connection = 1
+
+        simple_server.ServerHandler.handle_error(self)
+
+
+class _RequestHandler(simple_server.WSGIRequestHandler):
+    """Serves the requests of a connection, one at each call to serve()."""
+
+    protocol_version = 'HTTP/1.1'
+
+    # NOTE: Buffer the status line and headers with the first chunk
+    # of the body; the handler flushes after each write.
+    wbufsize = -1
+
+    def __init__(self, request, client_address, server):
+        # NOTE: Unlike the base class, serves nothing until asked to
+        self.request = request
+        self.client_address = client_address
+        self.server = server
+        self.setup()
+
+    def serve(self):
+        """Serves the next request.
+
+        :returns: True if the connection is to be kept alive
+        """
+        self.close_connection = 1
+        self.handle_one_request()
+        return not self.close_connection
+
+    @property
+    def buffered(self):
+        """Whether the start of the next request was read already."""
+        return self.rfile._rbuf.tell() > 0
+
+    def close(self):
+        try:
+            self.finish()
+            self.connection.shutdown(socket.SHUT_WR)
+        except socket.error:
+            pass
+
+        self.connection.close()
+
+    def setup(self):
+        self.timeout = self.server.keepalive_timeout or None
+        simple_server.WSGIRequestHandler.setup(self)
+
+    def address_string(self):
+        # NOTE: Skip the reverse DNS lookup
+        return self.client_address[0]
+
+    def log_message(self, format, *args):
+        LOG.debug(u'%s - %s' % (self.client_address[0], format % args))
+
+    def handle_one_request(self):
+        try:
+            self.raw_requestline = self.rfile.readline(65537)
+        except socket.timeout:
+            self.close_connection = 1
+            return
+
+        if not self.raw_requestline:
+            self.close_connection = 1
+            return
+
+        if len(self.raw_requestline) > 65536:
+            self.send_error(414)
+            self.close_connection = 1
+            return
+
+        if not self.parse_request():
+            self.close_connection = 1
+            return
+
+        if not (self.server.alive and self.server.keepalive):
+            self.close_connection = 1
+
+        environ = self.get_environ()
+
+        try:
+            length = int(environ.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            length = 0
+            self.close_connection = 1
+
+        # NOTE: Chunked request bodies are not decoded, so the next
+        # request can not be found.
+        if 'HTTP_TRANSFER_ENCODING' in environ:
+            self.close_connection = 1
+
+        handler = _ServerHandler(_Input(self.rfile, length), self.wfile,
+                                 self.get_stderr(), environ,
+                                 multithread=self.server.threads > 1,
+                                 multiprocess=True)
+        handler.request_handler = self
+        handler.run(self.server.get_app())
+
+        self.wfile.flush()
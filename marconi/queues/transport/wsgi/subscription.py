@@ -0,0 +1,237 @@
+# Copyright (c) 2013 Rackspace, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+import time
+
+import falcon
+
+from marconi.common import config
+import marconi.openstack.common.log as logging
+from marconi.queues.storage import exceptions as storage_exceptions
+from marconi.queues.transport import utils
+from marconi.queues.transport import validation as validate
+from marconi.queues.transport.wsgi import exceptions as wsgi_exceptions
+
+
+LOG = logging.getLogger(__name__)
+CFG = config.namespace('drivers:transport:wsgi').from_options(
+    long_poll_interval=1.0,
+    subscription_heartbeat=15,
+    subscription_lifetime=300,
+    subscription_limit=10,
+)
+
+MEDIA_TYPE = 'text/event-stream'
+
+
+class Resource(object):
+    """Pushes the messages posted to a queue as Server-Sent Events.
+
+    Each message is sent as an event whose data is the message, as
+    in a listing. The last event of each page of messages carries
+    the listing marker as its ID, so that clients resume after it
+    with the Last-Event-ID header, or the marker parameter.
+
+    The Client-ID header and echo parameter work as for listings,
+    except that all messages are sent to the clients that can not
+    set the header.
+
+    Each stream ends after subscription_lifetime seconds, and clients
+    reconnect to resume it, so that streams do not hold the server
+    for good. Meanwhile, it holds one of the waiter slots of the
+    notifier, and at most subscription_limit streams are served at
+    once by each worker.
+    """
+
+    __slots__ = ('queue_ctrl', 'message_ctrl', 'notifier', '_lock',
+                 '_streams')
+
+    def __init__(self, queue_controller, message_controller, notifier):
+        self.queue_ctrl = queue_controller
+        self.message_ctrl = message_controller
+        self.notifier = notifier
+
+        self._lock = threading.Lock()
+        self._streams = 0
+
+    def on_get(self, req, resp, project_id, queue_name):
+        LOG.debug(_(u'Queue subscription GET - queue: %(queue)s, '
+                    u'project: %(project)s') %
+                  {'queue': queue_name, 'project': project_id})
+
+        # NOTE: A stream would keep a server that serves one request
+        # at a time from serving any other.
+        if self.notifier.max_waiters == 0:
+            description = _(u'Subscriptions are not served by this '
+                            u'server.')
+            raise wsgi_exceptions.HTTPServiceUnavailable(description)
+
+        if not self._start():
+            description = _(u'Too many subscriptions are served at '
+                            u'the moment.')
+            raise wsgi_exceptions.HTTPServiceUnavailable(description)
+
+        try:
+            resp.stream = self._stream(req, project_id, queue_name)
+
+        except Exception:
+            self._end()
+            raise
+
+        resp.content_type = MEDIA_TYPE
+        resp.set_header('Cache-Control', 'no-cache')
+        # status defaults to 200
+
+    def _start(self):
+        """Takes a stream slot and a waiter slot, if both are left."""
+        with self._lock:
+            if self._streams >= CFG.subscription_limit:
+                return False
+
+            if not self.notifier.start_waiting():
+                return False
+
+            self._streams += 1
+            return True
+
+    def _end(self):
+        with self._lock:
+            self._streams -= 1
+            self.notifier.stop_waiting()
+
+    def _stream(self, req, project_id, queue_name):
+        """Returns the events of a new stream, or raises an HTTPError."""
+        kwargs = {
+            'marker': (req.get_header('Last-Event-ID') or
+                       req.get_param('marker')),
+            'limit': validate.CFG.message_paging_uplimit,
+            'client_uuid': req.get_header('Client-ID'),
+            'echo': req.get_param_as_bool('echo') or False,
+        }
+
+        if kwargs['client_uuid'] is None:
+            kwargs['echo'] = True
+
+        try:
+            if not self.queue_ctrl.exists(queue_name, project=project_id):
+                raise falcon.HTTPNotFound()
+
+            # NOTE: Read the first page before starting the response,
+            # so that errors are still reported with a status code.
+            page, marker = self._list(project_id, queue_name, kwargs)
+
+        except falcon.HTTPError:
+            raise
+
+        except storage_exceptions.DoesNotExist:
+            raise falcon.HTTPNotFound()
+
+        except Exception as ex:
+            LOG.exception(ex)
+            description = _(u'Messages could not be listed.')
+            raise wsgi_exceptions.HTTPServiceUnavailable(description)
+
+        events = self._events(req.path.rpartition('/')[0] + '/messages/',
+                              project_id, queue_name, kwargs,
+                              page, marker)
+        return _Stream(events, self._end)
+
+    def _list(self, project_id, queue_name, kwargs):
+        results = self.message_ctrl.list(queue_name, project=project_id,
+                                         **kwargs)
+
+        page = list(next(results))
+        marker = next(results) if page else kwargs['marker']
+
+        return page, marker
+
+    def _events(self, base_path, project_id, queue_name, kwargs,
+                page, marker):
+
+        # NOTE: Tells the clients how many milliseconds to wait
+        # before reconnecting.
+        yield 'retry: %d\n\n' % int(CFG.long_poll_interval * 1000)
+
+        sent = time.time()
+        expires = sent + CFG.subscription_lifetime
+
+        while True:
+            for index, message in enumerate(page, 1):
+                message['href'] = base_path + message['id']
+                del message['id']
+
+                event = 'data: %s\n\n' % utils.to_json(message)
+                if index == len(page):
+                    event = 'id: %s\n%s' % (marker, event)
+
+                yield event
+
+            if page:
+                sent = time.time()
+                kwargs['marker'] = marker
+
+            # NOTE: Clients resume after the last event sent
+            if time.time() >= expires:
+                return
+
+            # NOTE: Subscribe before catching up with the storage, so
+            # that no post is missed in between.
+            with self.notifier.subscribe(queue_name, project_id) as posted:
+                try:
+                    page, marker = self._list(project_id, queue_name,
+                                              kwargs)
+
+                except Exception as ex:
+                    # NOTE: The status has been sent already, so end
+                    # the stream; clients reconnect on their own.
+                    LOG.exception(ex)
+                    return
+
+                if page:
+                    continue
+
+                posted.wait(CFG.long_poll_interval)
+
+            # NOTE: Comments keep idle connections from timing out,
+            # and find out when they were closed.
+            if time.time() - sent >= CFG.subscription_heartbeat:
+                sent = time.time()
+                yield ':\n\n'
+
+
+class _Stream(object):
+    """Iterates over the events of a stream, and ends it once closed.
+
+    WSGI servers close the response once sent, or once the client is
+    gone; unlike a generator, this runs even if never iterated over.
+    """
+
+    def __init__(self, events, end):
+        self._events = events
+        self._end = end
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        return next(self._events)
+
+    def close(self):
+        if self._end is not None:
+            end, self._end = self._end, None
+
+            self._events.close()
+            end()
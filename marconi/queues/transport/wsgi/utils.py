@@ -14,6 +14,9 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import contextlib
+import itertools
+
 import marconi.openstack.common.log as logging
 
 from marconi.queues.transport import utils
@@ -26,11 +29,17 @@ JSONObject = dict
 JSONArray = list
 """Represents a JSON array in Python."""
 
+JSON = 'application/json'
+"""Media type of JSON documents."""
+
+MSGPACK = 'application/x-msgpack'
+"""Media type of MessagePack documents."""
+
 LOG = logging.getLogger(__name__)
 
 
 # TODO(kgriffs): Consider moving this to Falcon and/or Oslo
-def filter_stream(stream, len, spec=None, doctype=JSONObject):
+def filter_stream(stream, len, spec=None, doctype=JSONObject, media_type=JSON):
     """Reads, deserializes, and validates a document from a stream.
 
     :param stream: file-like object from which to read an object or
@@ -46,26 +55,69 @@ def filter_stream(stream, len, spec=None, doctype=JSONObject):
         incoming documents will not be validated.
     :param doctype: type of document to expect; must be either
         JSONObject or JSONArray.
+    :param media_type: (Default JSON) encoding of the document; must
+        be either JSON or MSGPACK (see request_media_type).
     :raises: HTTPBadRequest, HTTPServiceUnavailable
     :returns: A sanitized, filtered version of the document list read
         from the stream. If the document contains a list of objects,
-        each object will be filtered and returned in a new list. If,
-        on the other hand, the document is expected to contain a
-        single object, that object will be filtered and returned as
-        a single-element iterable.
+        a generator is returned that reads, filters and yields each
+        object in turn, raising the same HTTP errors for the rest of
+        the document as it goes. If, on the other hand, the document
+        is expected to contain a single object, that object will be
+        filtered and returned as a single-element iterable.
     """
 
     if len is None:
         description = _(u'Request body can not be empty')
         raise exceptions.HTTPBadRequestBody(description)
 
+    if media_type == MSGPACK:
+        read, read_array = utils.read_msgpack, utils.read_msgpack_array
+    else:
+        read, read_array = utils.read_json, utils.read_json_array
+
+    if doctype is JSONObject:
+        with _reading():
+            document = read(stream, len)
+
+        if not isinstance(document, JSONObject):
+            raise exceptions.HTTPDocumentTypeNotSupported()
+
+        return (document,) if spec is None else (filter(document, spec),)
+
+    if doctype is JSONArray:
+        with _reading():
+            document = read_array(stream, len)
+
+        return _filter_array(document, spec)
+
+    raise TypeError('doctype must be either a JSONObject or JSONArray')
+
+
+def _filter_array(objects, spec):
+    """Filters each object of a JSON array as it is decoded."""
+    end = object()
+
+    while True:
+        with _reading():
+            obj = next(objects, end)
+
+        if obj is end:
+            return
+
+        yield obj if spec is None else filter(obj, spec)
+
+
+@contextlib.contextmanager
+def _reading():
+    """Converts errors raised while reading a document to HTTP errors."""
     try:
-        # TODO(kgriffs): read_json should stream the resulting list
-        # of messages, returning a generator rather than buffering
-        # everything in memory (bp/streaming-serialization).
-        document = utils.read_json(stream, len)
+        yield
 
-    except utils.MalformedJSON as ex:
+    except utils.UnexpectedJSONDocument:
+        raise exceptions.HTTPDocumentTypeNotSupported()
+
+    except (utils.MalformedJSON, utils.MalformedMsgPack) as ex:
         LOG.exception(ex)
         description = _(u'Request body could not be parsed.')
         raise exceptions.HTTPBadRequestBody(description)
@@ -81,22 +133,76 @@ def filter_stream(stream, len, spec=None, doctype=JSONObject):
         description = _(u'Request body could not be read.')
         raise exceptions.HTTPServiceUnavailable(description)
 
-    if doctype is JSONObject:
-        if not isinstance(document, JSONObject):
-            raise exceptions.HTTPDocumentTypeNotSupported()
 
-        return (document,) if spec is None else (filter(document, spec),)
+def request_media_type(req):
+    """Returns the media type of a request body: JSON or MSGPACK.
 
-    if doctype is JSONArray:
-        if not isinstance(document, JSONArray):
-            raise exceptions.HTTPDocumentTypeNotSupported()
+    Bodies not declared as MessagePack are taken to be JSON.
+    """
 
-        if spec is None:
-            return document
+    content_type = req.content_type
+    if content_type and content_type.startswith(MSGPACK):
+        return MSGPACK
 
-        return [filter(obj, spec) for obj in document]
+    return JSON
 
-    raise TypeError('doctype must be either a JSONObject or JSONArray')
+
+def response_media_type(req):
+    """Returns the media type to respond with: JSON or MSGPACK.
+
+    MessagePack is chosen for clients accepting it but not JSON;
+    JSON otherwise, including for clients accepting any media type.
+    """
+
+    if req.client_accepts(MSGPACK) and not req.client_accepts(JSON):
+        return MSGPACK
+
+    return JSON
+
+
+def set_body(resp, document, media_type=JSON, stream=False,
+             item_sort_key=None):
+    """Serializes a document as the body of a response.
+
+    :param resp: the response object
+    :param document: a JSON-serializable object, which may hold
+        iterators of objects (see transport.utils.to_json_stream)
+    :param media_type: (Default JSON) either JSON or MSGPACK
+    :param stream: (Default False) whether to send the body as an
+        iterable, serializing each object of the iterators while the
+        response is being sent, rather than all at once; ignored for
+        MessagePack, which needs the length of arrays up front
+    :param item_sort_key: (Default None) key used to sort the items
+        of a top-level dict, to consume its iterators in order
+    """
+
+    if media_type == MSGPACK:
+        resp.content_type = MSGPACK
+        resp.body = utils.to_msgpack(document, item_sort_key)
+        return
+
+    body = utils.to_json_stream(document, item_sort_key)
+
+    if stream:
+        resp.stream = body
+    else:
+        resp.body = b''.join(body)
+
+
+def peek(iterator):
+    """Checks whether an iterator is exhausted, without losing an item.
+
+    :param iterator: an iterator, such as a storage cursor
+    :returns: None if the iterator is exhausted, or else an iterator
+        over the same items
+    """
+
+    try:
+        head = next(iterator)
+    except StopIteration:
+        return None
+
+    return itertools.chain((head,), iterator)
 
 
 # TODO(kgriffs): Consider moving this to Falcon and/or Oslo
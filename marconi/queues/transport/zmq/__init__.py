@@ -1 +1,4 @@
 """ ZMQ Transport (Experimental) """
+
+# NOTE: The driver is not hoisted into the package namespace, so that
+# the handler can be used without pyzmq, which is optional.
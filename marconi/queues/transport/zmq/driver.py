@@ -0,0 +1,93 @@
+# Copyright (c) 2013 Rackspace, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import zmq
+
+from marconi.common import config
+import marconi.openstack.common.log as logging
+from marconi.queues import transport
+from marconi.queues.transport.zmq import handler
+
+OPTIONS = {
+    'bind': '0.0.0.0',
+    'port': 9999,
+
+    # NOTE: As for the WSGI transport, the largest request accepted
+    'content_max_length': 256 * 1024,
+}
+
+ZMQ_CFG = config.namespace('drivers:transport:zmq').from_options(**OPTIONS)
+
+LOG = logging.getLogger(__name__)
+
+
+def make_socket(context):
+    """Returns a ROUTER socket to serve requests from, once bound.
+
+    Clients sending a frame larger than content_max_length are
+    disconnected before the frame is read in whole.
+
+    :param context: The ZeroMQ context of the socket
+    """
+    sock = context.socket(zmq.ROUTER)
+
+    # NOTE: Only applies to the connections made after it is set
+    sock.setsockopt(zmq.MAXMSGSIZE, ZMQ_CFG.content_max_length)
+    return sock
+
+
+class Driver(transport.DriverBase):
+    """Serves message operations over a ZeroMQ ROUTER socket.
+
+    Clients connect REQ or DEALER sockets, and send each request as
+    a single frame (see marconi.queues.transport.zmq.handler). Their
+    connections persist across requests, and DEALER clients may have
+    many requests in flight; the replies are sent in order.
+    """
+
+    def __init__(self, storage):
+        super(Driver, self).__init__(storage)
+
+        self.handler = handler.Handler(storage)
+
+    def serve(self, sock):
+        """Serves the requests received on a ROUTER socket, forever.
+
+        :param sock: A bound ROUTER socket, from make_socket()
+        """
+        while True:
+            # NOTE: The leading frames route the reply back to the
+            # client; REQ sockets add an empty delimiter frame.
+            frames = sock.recv_multipart(copy=False)
+
+            routing = frames[:-1]
+            reply = self.handler(frames[-1].bytes)
+
+            sock.send_multipart(routing + [reply], copy=False)
+
+    def listen(self):
+        """Self-host using 'bind' and 'port' from the ZMQ config group."""
+
+        msg = _(u'Serving on tcp://%(bind)s:%(port)s')
+        msg %= {'bind': ZMQ_CFG.bind, 'port': ZMQ_CFG.port}
+        LOG.info(msg)
+
+        sock = make_socket(zmq.Context.instance())
+
+        try:
+            sock.bind('tcp://%s:%d' % (ZMQ_CFG.bind, ZMQ_CFG.port))
+            self.serve(sock)
+        finally:
+            sock.close(linger=0)
@@ -0,0 +1,344 @@
+# Copyright (c) 2013 Rackspace, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Message operations over a compact MessagePack envelope.
+
+Each request is a MessagePack array::
+
+    [operation, project, queue, arguments]
+
+where the arguments are a map, and each reply is an array::
+
+    [status, body]
+
+The status codes are those of the HTTP API, so that clients handle
+the errors the same way; the body of an error is its description.
+
+post
+    Arguments: client_id, messages (each with ttl and body).
+    Replies 201 with {ids, partial}.
+
+list
+    Arguments: client_id, and optionally marker, limit, echo and
+    include_claimed. Replies 200 with {messages, marker}, or 204
+    when there are no messages.
+
+claim
+    Arguments: ttl, grace, and optionally limit. Replies 201 with
+    {claim_id, messages}, or 204 when there is nothing to claim.
+
+delete
+    Arguments: ids, and optionally claim_id, in which case the
+    messages are only deleted while claimed by it, or else the
+    request fails with 403. Replies 204.
+
+Messages are sent as in the HTTP API, with their id instead of an
+href.
+"""
+
+from marconi.common import context
+from marconi.common import exceptions as input_exceptions
+import marconi.openstack.common.log as logging
+from marconi.queues.storage import exceptions as storage_exceptions
+from marconi.queues.transport import utils
+from marconi.queues.transport import validation as validate
+
+
+LOG = logging.getLogger(__name__)
+
+MESSAGE_POST_SPEC = (('ttl', int), ('body', '*'))
+CLAIM_POST_SPEC = (('ttl', int), ('grace', int))
+
+
+class Error(Exception):
+    """Fails a request with the given status and description."""
+
+    def __init__(self, status, description):
+        super(Error, self).__init__(description)
+        self.status = status
+        self.description = description
+
+
+class BadRequest(Error):
+
+    def __init__(self, description):
+        super(BadRequest, self).__init__(400, description)
+
+
+class ServiceUnavailable(Error):
+
+    def __init__(self, description):
+        super(ServiceUnavailable, self).__init__(503, description)
+
+
+class Handler(object):
+    """Serves the requests read from any kind of socket.
+
+    :param storage: The storage driver
+    """
+
+    __slots__ = ('message_controller', 'claim_controller', '_operations')
+
+    def __init__(self, storage):
+        self.message_controller = storage.message_controller
+        self.claim_controller = storage.claim_controller
+
+        self._operations = {
+            'post': self.on_post,
+            'list': self.on_list,
+            'claim': self.on_claim,
+            'delete': self.on_delete,
+        }
+
+    def __call__(self, request):
+        """Serves a request.
+
+        :param request: The packed request
+        :returns: The packed reply
+        """
+        try:
+            operation, project_id, queue_name, args = _parse(request)
+
+            ctx = context.RequestContext(tenant=project_id)
+            ctx.update_store()
+
+            try:
+                handle = self._operations[operation]
+            except KeyError:
+                raise BadRequest(_(u'Unknown operation.'))
+
+            status, body = handle(project_id, queue_name, args)
+
+        except Error as ex:
+            status, body = ex.status, ex.description
+
+        return utils.to_msgpack([status, body])
+
+    #-----------------------------------------------------------------------
+    # Operations
+    #-----------------------------------------------------------------------
+
+    def on_post(self, project_id, queue_name, args):
+        LOG.debug(_(u'Messages post - queue: %(queue)s, '
+                    u'project: %(project)s') %
+                  {'queue': queue_name, 'project': project_id})
+
+        uuid = _get(args, 'client_id', basestring)
+
+        try:
+            messages = validate.message_posting(
+                _filter(message, MESSAGE_POST_SPEC)
+                for message in _get(args, 'messages', list))
+
+        except input_exceptions.ValidationFailed as ex:
+            raise BadRequest(str(ex))
+
+        partial = False
+
+        try:
+            message_ids = self.message_controller.post(
+                queue_name,
+                messages=messages,
+                project=project_id,
+                client_uuid=uuid)
+
+        except storage_exceptions.DoesNotExist:
+            raise Error(404, _(u'Queue does not exist.'))
+
+        except storage_exceptions.MessageConflict as ex:
+            LOG.exception(ex)
+            partial = True
+            message_ids = ex.succeeded_ids
+
+            if not message_ids:
+                raise ServiceUnavailable(
+                    _(u'No messages could be enqueued.'))
+
+        except Exception as ex:
+            LOG.exception(ex)
+            raise ServiceUnavailable(_(u'Messages could not be enqueued.'))
+
+        return 201, {'ids': message_ids, 'partial': partial}
+
+    def on_list(self, project_id, queue_name, args):
+        LOG.debug(_(u'Messages list - queue: %(queue)s, '
+                    u'project: %(project)s') %
+                  {'queue': queue_name, 'project': project_id})
+
+        uuid = _get(args, 'client_id', basestring)
+
+        kwargs = {}
+        for name, kind in (('marker', basestring), ('limit', int),
+                           ('echo', bool), ('include_claimed', bool)):
+            if name in args:
+                kwargs[name] = _get(args, name, kind)
+
+        try:
+            validate.message_listing(**kwargs)
+
+        except input_exceptions.ValidationFailed as ex:
+            raise BadRequest(str(ex))
+
+        try:
+            results = self.message_controller.list(
+                queue_name,
+                project=project_id,
+                client_uuid=uuid,
+                **kwargs)
+
+            messages = list(next(results))
+
+        except storage_exceptions.DoesNotExist:
+            raise Error(404, _(u'Queue does not exist.'))
+
+        except Exception as ex:
+            LOG.exception(ex)
+            raise ServiceUnavailable(_(u'Messages could not be listed.'))
+
+        if not messages:
+            return 204, None
+
+        return 200, {'messages': messages, 'marker': next(results)}
+
+    def on_claim(self, project_id, queue_name, args):
+        LOG.debug(_(u'Claim create - queue: %(queue)s, '
+                    u'project: %(project)s') %
+                  {'queue': queue_name, 'project': project_id})
+
+        metadata = _filter(args, CLAIM_POST_SPEC)
+        claim_options = {}
+        if 'limit' in args:
+            claim_options['limit'] = _get(args, 'limit', int)
+
+        try:
+            validate.claim_creation(metadata, **claim_options)
+
+        except input_exceptions.ValidationFailed as ex:
+            raise BadRequest(str(ex))
+
+        try:
+            cid, msgs = self.claim_controller.create(
+                queue_name,
+                metadata=metadata,
+                project=project_id,
+                **claim_options)
+
+            messages = list(msgs)
+
+        except Exception as ex:
+            LOG.exception(ex)
+            raise ServiceUnavailable(_(u'Claim could not be created.'))
+
+        if not messages:
+            return 204, None
+
+        return 201, {'claim_id': cid, 'messages': messages}
+
+    def on_delete(self, project_id, queue_name, args):
+        LOG.debug(_(u'Messages delete - queue: %(queue)s, '
+                    u'project: %(project)s') %
+                  {'queue': queue_name, 'project': project_id})
+
+        ids = _get(args, 'ids', list)
+        claim_id = args.get('claim_id')
+
+        try:
+            validate.message_listing(limit=len(ids))
+
+        except input_exceptions.ValidationFailed as ex:
+            raise BadRequest(str(ex))
+
+        try:
+            if claim_id is None:
+                self.message_controller.bulk_delete(
+                    queue_name,
+                    message_ids=ids,
+                    project=project_id)
+            else:
+                for message_id in ids:
+                    self.message_controller.delete(
+                        queue_name,
+                        message_id=message_id,
+                        project=project_id,
+                        claim=claim_id)
+
+        except storage_exceptions.NotPermitted as ex:
+            LOG.exception(ex)
+            raise Error(403, _(u'This message is claimed; it cannot be '
+                               u'deleted without a valid claim_id.'))
+
+        except Exception as ex:
+            LOG.exception(ex)
+            raise ServiceUnavailable(_(u'Messages could not be deleted.'))
+
+        return 204, None
+
+
+def _parse(request):
+    """Unpacks a request into its operation, project, queue and args.
+
+    :raises: BadRequest if the envelope is malformed
+    """
+    try:
+        envelope = utils.from_msgpack(request)
+
+    except (utils.MalformedMsgPack, utils.OverflowedJSONInteger):
+        raise BadRequest(_(u'Malformed MessagePack.'))
+
+    if not (isinstance(envelope, list) and len(envelope) == 4 and
+            isinstance(envelope[0], basestring) and
+            isinstance(envelope[1], (basestring, type(None))) and
+            isinstance(envelope[2], basestring) and
+            isinstance(envelope[3], dict)):
+        raise BadRequest(_(u'Expected [operation, project, queue, args].'))
+
+    return envelope
+
+
+def _get(args, name, kind):
+    """Returns a required argument of the given type.
+
+    :raises: BadRequest if it is missing or of another type
+    """
+    try:
+        value = args[name]
+    except KeyError:
+        raise BadRequest(_(u'Missing "%s" argument.') % name)
+
+    # NOTE: bool is a subclass of int, but is never a valid int here
+    if kind is int:
+        valid = (isinstance(value, (int, long)) and
+                 not isinstance(value, bool))
+    else:
+        valid = isinstance(value, kind)
+
+    if not valid:
+        raise BadRequest(_(u'Argument "%s" is of the wrong type.') % name)
+
+    return value
+
+
+def _filter(document, spec):
+    """Picks the fields of a document listed in spec.
+
+    :param spec: (name, type) pairs; '*' allows any type
+    :raises: BadRequest if the document is not a map, or a field is
+        missing or of the wrong type
+    """
+    if not isinstance(document, dict):
+        raise BadRequest(_(u'Expected a map.'))
+
+    return dict((name, _get(document, name, object if kind == '*' else kind))
+                for name, kind in spec)
@@ -30,6 +30,8 @@ class TestBase(testtools.TestCase):
     test method.
     """
 
+    conf = CFG.conf
+
     def setUp(self):
         super(TestBase, self).setUp()
 
@@ -82,6 +84,7 @@ class TestBase(testtools.TestCase):
         """
         for k, v in kw.iteritems():
             self.conf.set_override(k, v, group)
+            self.addCleanup(self.conf.clear_override, k, group)
 
     def _my_dir(self):
         return os.path.abspath(os.path.dirname(__file__))
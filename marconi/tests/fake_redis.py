@@ -0,0 +1,335 @@
+# Copyright (c) 2013 Rackspace, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""In-process stand-in for the Redis client used by the proxy.
+
+Implements the commands of redis.StrictRedis that the proxy sends,
+with the same return values: values are stored and returned as byte
+strings, as Redis does.
+"""
+
+import bisect
+import Queue
+import threading
+
+
+def _encode(value):
+    if isinstance(value, bytes):
+        return value
+
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+
+    return str(value)
+
+
+class StrictRedis(object):
+    """Keeps the keys in memory; safe to share between threads."""
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.RLock()
+        self._subscribers = {}
+
+    def flushdb(self):
+        with self._lock:
+            self._data.clear()
+        return True
+
+    def exists(self, key):
+        return _encode(key) in self._data
+
+    def type(self, key):
+        entry = self._data.get(_encode(key))
+        if entry is None:
+            return b'none'
+
+        if isinstance(entry, dict):
+            return b'hash'
+
+        return b'list' if isinstance(entry, list) else b'zset'
+
+    def delete(self, *keys):
+        with self._lock:
+            return sum(self._data.pop(_encode(key), None) is not None
+                       for key in keys)
+
+    #-----------------------------------------------------------------------
+    # Hashes
+    #-----------------------------------------------------------------------
+
+    def hget(self, key, field):
+        return self._data.get(_encode(key), {}).get(_encode(field))
+
+    def hmget(self, key, fields):
+        entry = self._data.get(_encode(key), {})
+        return [entry.get(_encode(field)) for field in fields]
+
+    def hset(self, key, field, value):
+        with self._lock:
+            entry = self._data.setdefault(_encode(key), {})
+            created = _encode(field) not in entry
+            entry[_encode(field)] = _encode(value)
+        return int(created)
+
+    def hmset(self, key, mapping):
+        with self._lock:
+            entry = self._data.setdefault(_encode(key), {})
+            for field, value in mapping.items():
+                entry[_encode(field)] = _encode(value)
+        return True
+
+    def hdel(self, key, *fields):
+        with self._lock:
+            entry = self._data.get(_encode(key), {})
+            removed = sum(entry.pop(_encode(field), None) is not None
+                          for field in fields)
+            if not entry:
+                self._data.pop(_encode(key), None)
+        return removed
+
+    #-----------------------------------------------------------------------
+    # Lists
+    #-----------------------------------------------------------------------
+
+    def rpush(self, key, *values):
+        with self._lock:
+            items = self._data.setdefault(_encode(key), [])
+            items.extend(_encode(value) for value in values)
+            return len(items)
+
+    def lrange(self, key, start, end):
+        with self._lock:
+            items = self._data.get(_encode(key), [])
+
+            # NOTE: Redis includes the end, and counts negative
+            # indexes from the tail.
+            if end < 0:
+                end += len(items)
+
+            return items[max(start + len(items), 0) if start < 0 else start:
+                         end + 1]
+
+    def lrem(self, key, count, value):
+        value = _encode(value)
+
+        with self._lock:
+            items = self._data.get(_encode(key), [])
+            indexes = [i for i, item in enumerate(items) if item == value]
+
+            if count > 0:
+                indexes = indexes[:count]
+            elif count < 0:
+                indexes = indexes[count:]
+
+            for i in reversed(indexes):
+                del items[i]
+
+            if not items:
+                self._data.pop(_encode(key), None)
+
+        return len(indexes)
+
+    #-----------------------------------------------------------------------
+    # Sorted sets
+    #-----------------------------------------------------------------------
+
+    def zadd(self, key, *args):
+        """Adds members, given as score1, member1, score2, member2..."""
+        with self._lock:
+            entry = self._data.setdefault(_encode(key), _SortedSet())
+            return sum(entry.add(float(score), _encode(member))
+                       for score, member in zip(args[::2], args[1::2]))
+
+    def zrem(self, key, *members):
+        with self._lock:
+            entry = self._data.get(_encode(key), _SortedSet())
+            removed = sum(entry.remove(_encode(member))
+                          for member in members)
+            if not entry.items:
+                self._data.pop(_encode(key), None)
+        return removed
+
+    def zrange(self, key, start, end):
+        with self._lock:
+            items = self._data.get(_encode(key), _SortedSet()).items
+            if end < 0:
+                end += len(items)
+
+            return [member for _score, member in
+                    items[max(start + len(items), 0) if start < 0 else start:
+                          end + 1]]
+
+    def zrangebylex(self, key, min, max, start=None, num=None):
+        """Ranges the members by name, assuming equal scores."""
+        with self._lock:
+            items = self._data.get(_encode(key), _SortedSet()).items
+            if not items:
+                return []
+
+            score = items[0][0]
+            low = (0 if min == '-' else
+                   _lex_index(items, score, min, upper=False))
+            high = (len(items) if max == '+' else
+                    _lex_index(items, score, max, upper=True))
+
+            # NOTE: min and max are shadowed by the arguments
+            if start is not None:
+                low += start
+                if low + num < high:
+                    high = low + num
+
+            return [member for _score, member in items[low:high]]
+
+    #-----------------------------------------------------------------------
+    # Pipelines
+    #-----------------------------------------------------------------------
+
+    def pipeline(self, transaction=True):
+        return Pipeline(self)
+
+    def transaction(self, func, *watches):
+        """Calls func with a pipeline watching the given keys.
+
+        No other thread may change the keys meanwhile, so the
+        transaction is never retried.
+        """
+        with self._lock:
+            pipe = Pipeline(self)
+            pipe.watch(*watches)
+            func(pipe)
+            return pipe.execute()
+
+    #-----------------------------------------------------------------------
+    # Pub/sub
+    #-----------------------------------------------------------------------
+
+    def publish(self, channel, message):
+        with self._lock:
+            subscribers = list(self._subscribers.get(_encode(channel), ()))
+
+        for subscriber in subscribers:
+            subscriber.put({'type': 'message', 'pattern': None,
+                            'channel': _encode(channel),
+                            'data': _encode(message)})
+
+        return len(subscribers)
+
+    def pubsub(self):
+        return PubSub(self)
+
+
+def _lex_index(items, score, limit, upper):
+    """Finds where a range by name ends, per a limit such as (name."""
+    key = (score, _encode(limit[1:]))
+
+    # NOTE: [ includes the name in the range, and ( excludes it
+    if (limit[0] == '[') == upper:
+        return bisect.bisect_right(items, key)
+
+    return bisect.bisect_left(items, key)
+
+
+class _SortedSet(object):
+    """Members kept sorted by score, then by name."""
+
+    def __init__(self):
+        self.items = []
+        self.scores = {}
+
+    def add(self, score, member):
+        added = self.remove(member) == 0
+        self.scores[member] = score
+        bisect.insort(self.items, (score, member))
+        return int(added)
+
+    def remove(self, member):
+        if member not in self.scores:
+            return 0
+
+        score = self.scores.pop(member)
+        del self.items[bisect.bisect_left(self.items, (score, member))]
+        return 1
+
+
+class Pipeline(object):
+    """Queues commands, and sends them at once when executed.
+
+    While watching keys, commands are sent at once until multi().
+    """
+
+    def __init__(self, client):
+        self._client = client
+        self._commands = []
+        self._watching = False
+
+    def watch(self, *keys):
+        self._watching = True
+
+    def multi(self):
+        self._watching = False
+
+    def __getattr__(self, name):
+        command = getattr(self._client, name)
+        if self._watching:
+            return command
+
+        def queue(*args, **kwargs):
+            self._commands.append((command, args, kwargs))
+            return self
+
+        return queue
+
+    def execute(self):
+        commands, self._commands = self._commands, []
+        with self._client._lock:
+            return [command(*args, **kwargs)
+                    for command, args, kwargs in commands]
+
+
+class PubSub(object):
+    """Receives the messages published to the channels subscribed to."""
+
+    def __init__(self, client):
+        self._client = client
+        self._messages = Queue.Queue()
+        self._channels = set()
+
+    def subscribe(self, *channels):
+        with self._client._lock:
+            for channel in channels:
+                channel = _encode(channel)
+                self._client._subscribers.setdefault(
+                    channel, []).append(self._messages)
+                self._channels.add(channel)
+
+                self._messages.put({'type': 'subscribe', 'pattern': None,
+                                    'channel': channel,
+                                    'data': len(self._channels)})
+
+    def listen(self):
+        while True:
+            # NOTE: Waits with a timeout, so that the thread can be
+            # interrupted.
+            try:
+                yield self._messages.get(timeout=60)
+            except Queue.Empty:
+                pass
+
+    def close(self):
+        with self._client._lock:
+            for channel in self._channels:
+                self._client._subscribers[channel].remove(self._messages)
+            self._channels.clear()
@@ -0,0 +1,106 @@
+# Copyright (c) 2013 Rackspace, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+
+from marconi.proxy.utils import cache
+from marconi import tests as testing
+from marconi.tests import fake_redis
+
+
+class CatalogueTest(testing.TestBase):
+
+    def setUp(self):
+        super(CatalogueTest, self).setUp()
+        self.client = fake_redis.StrictRedis()
+
+    def _catalogue(self, size=10, ttl=60):
+        catalogue = cache.Catalogue(self.client, size, ttl)
+        self.assertIsNone(catalogue.lookup('p', 'warmup'))
+
+        # NOTE: Wait for the listener to subscribe, which clears the
+        # cache and so bumps its generation.
+        for n in range(100):
+            if catalogue._generation:
+                break
+            time.sleep(0.01)
+
+        return catalogue
+
+    def _catalogue_queue(self, queue, host):
+        self.client.hmset('q.p.%s' % queue, {'h': host, 'n': queue})
+
+    def test_lookup_is_cached(self):
+        catalogue = self._catalogue()
+        self._catalogue_queue('fizbit', 'http://a')
+
+        self.assertEqual(catalogue.lookup('p', 'fizbit'), 'http://a')
+
+        self.client.delete('q.p.fizbit')
+        self.assertEqual(catalogue.lookup('p', 'fizbit'), 'http://a')
+        self.assertIsNone(catalogue.lookup('q', 'fizbit'))
+
+    def test_invalidate(self):
+        catalogue = self._catalogue()
+        other = self._catalogue()
+        self._catalogue_queue('fizbit', 'http://a')
+
+        self.assertEqual(catalogue.lookup('p', 'fizbit'), 'http://a')
+        self.assertEqual(other.lookup('p', 'fizbit'), 'http://a')
+
+        self._catalogue_queue('fizbit', 'http://b')
+        other.invalidate('p', 'fizbit')
+        self.assertEqual(other.lookup('p', 'fizbit'), 'http://b')
+
+        for n in range(100):
+            if catalogue.lookup('p', 'fizbit') == 'http://b':
+                break
+            time.sleep(0.01)
+        else:
+            self.fail('The announcement was not received')
+
+    def test_expiry(self):
+        catalogue = self._catalogue(ttl=0.01)
+        self._catalogue_queue('fizbit', 'http://a')
+        self.assertEqual(catalogue.lookup('p', 'fizbit'), 'http://a')
+
+        self._catalogue_queue('fizbit', 'http://b')
+        time.sleep(0.02)
+        self.assertEqual(catalogue.lookup('p', 'fizbit'), 'http://b')
+
+    def test_least_recently_used_is_evicted(self):
+        catalogue = self._catalogue(size=2)
+        for queue in ('a', 'b', 'c'):
+            self._catalogue_queue(queue, 'http://a')
+
+        catalogue.lookup('p', 'a')
+        catalogue.lookup('p', 'b')
+        catalogue.lookup('p', 'a')
+        catalogue.lookup('p', 'c')
+
+        for queue in ('a', 'b', 'c'):
+            self._catalogue_queue(queue, 'http://b')
+
+        self.assertEqual(catalogue.lookup('p', 'a'), 'http://a')
+        self.assertEqual(catalogue.lookup('p', 'c'), 'http://a')
+        self.assertEqual(catalogue.lookup('p', 'b'), 'http://b')
+
+    def test_disabled(self):
+        catalogue = cache.Catalogue(self.client, 0, 60)
+        self._catalogue_queue('fizbit', 'http://a')
+        self.assertEqual(catalogue.lookup('p', 'fizbit'), 'http://a')
+
+        self._catalogue_queue('fizbit', 'http://b')
+        self.assertEqual(catalogue.lookup('p', 'fizbit'), 'http://b')
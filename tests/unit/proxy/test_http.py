@@ -0,0 +1,50 @@
+# Copyright (c) 2013 Rackspace, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from marconi.bench import proxy as bench
+from marconi.proxy.utils import http
+from marconi import tests as testing
+
+
+class HTTPTest(testing.TestBase):
+
+    def setUp(self):
+        super(HTTPTest, self).setUp()
+        self.url, self.worker = bench.start_node()
+
+    def tearDown(self):
+        self.worker.stop()
+        super(HTTPTest, self).tearDown()
+
+    def test_pooled_connections(self):
+        self.assertIs(http.session(), http.session())
+
+        for n in range(3):
+            resp = http.request('get', self.url + '/v1/queues/fizbit/messages',
+                                headers={'Connection': 'close'})
+            self.assertEqual(resp.status_code, 200)
+
+        pool = http.session().get_adapter(self.url).poolmanager
+        self.assertEqual(pool.connection_from_url(self.url).num_connections, 1)
+
+    def test_headers(self):
+        resp = http.request('get', self.url + '/v1/queues/fizbit/messages')
+        headers = http.headers(resp)
+
+        self.assertEqual(headers['Content-Type'], 'application/json')
+        self.assertEqual(headers['content-type'], 'application/json')
+        for name in headers:
+            self.assertNotIn(name.lower(), ('connection', 'content-length',
+                                            'transfer-encoding'))
@@ -0,0 +1,117 @@
+# Copyright (c) 2013 Rackspace, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import gc
+import json
+import weakref
+
+from falcon import testing as ftest
+import msgpack
+
+from marconi.proxy import app
+from marconi.proxy.utils import helpers
+from marconi import tests as testing
+from marconi.tests import fake_redis
+
+
+class ListingTest(testing.TestBase):
+
+    def setUp(self):
+        super(ListingTest, self).setUp()
+
+        self.client = fake_redis.StrictRedis()
+        self.app = app.make_app(self.client)
+        self.srmock = ftest.StartResponseMock()
+
+        for name in ('delta', 'alpha', 'echo', 'charlie', 'bravo'):
+            self.client.hmset('q.p.' + name,
+                              {'h': 'http://a', 'n': name,
+                               'm': msgpack.dumps({'name': name})})
+            self.client.zadd('qs.p', 0, name)
+
+    def _get(self, path, query_string=''):
+        env = ftest.create_environ(path, query_string=query_string,
+                                   headers={'X-Project-ID': 'p'})
+        body = ''.join(self.app(env, self.srmock))
+        return json.loads(body) if body else None
+
+    def test_pages_follow_the_marker(self):
+        names = []
+        query_string = 'limit=2'
+
+        for n in range(3):
+            result = self._get('/v1/queues', query_string)
+            self.assertEqual(self.srmock.status, '200 OK')
+
+            names.extend(queue['name'] for queue in result['queues'])
+            query_string = result['links'][0]['href'].partition('?')[2]
+
+        self.assertEqual(names, ['alpha', 'bravo', 'charlie', 'delta',
+                                 'echo'])
+
+        self.assertIsNone(self._get('/v1/queues', query_string))
+        self.assertEqual(self.srmock.status, '204 No Content')
+
+    def test_detailed(self):
+        result = self._get('/v1/queues', 'marker=charlie&detailed=true')
+
+        self.assertEqual([queue['metadata'] for queue in result['queues']],
+                         [{'name': 'delta'}, {'name': 'echo'}])
+
+    def test_removed_queue_is_not_listed(self):
+        self.client.zrem('qs.p', 'bravo')
+
+        result = self._get('/v1/queues')
+        self.assertEqual([queue['name'] for queue in result['queues']],
+                         ['alpha', 'charlie', 'delta', 'echo'])
+
+        result = self._get('/v1/catalogue')
+        self.assertEqual(sorted(result), ['alpha', 'charlie', 'delta',
+                                          'echo'])
+        self.assertEqual(result['echo']['metadata'], {'name': 'echo'})
+
+    def test_legacy_list_is_converted(self):
+        self.client.delete('qs.p')
+        self.client.rpush('qs.p', 'delta', 'alpha', 'echo', 'charlie',
+                          'bravo')
+
+        result = self._get('/v1/queues', 'limit=2')
+        self.assertEqual([queue['name'] for queue in result['queues']],
+                         ['alpha', 'bravo'])
+        self.assertEqual(self.client.type('qs.p'), b'zset')
+
+        result = self._get('/v1/catalogue')
+        self.assertEqual(sorted(result), ['alpha', 'bravo', 'charlie',
+                                          'delta', 'echo'])
+
+
+class QueuesKeyTest(testing.TestBase):
+
+    def test_known_keys_are_bounded(self):
+        self.config('proxy', catalogue_cache_size=2)
+        client = fake_redis.StrictRedis()
+
+        for project in ('a', 'b', 'c', 'a'):
+            self.assertEqual(helpers.get_queues_key(client, project),
+                             'qs.' + project)
+
+        self.assertEqual(list(helpers._sorted_keys[client]),
+                         ['qs.c', 'qs.a'])
+
+        # NOTE: The clients are not kept alive
+        ref = weakref.ref(client)
+        del client
+        gc.collect()
+        self.assertIsNone(ref())
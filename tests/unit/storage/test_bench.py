@@ -0,0 +1,39 @@
+# Copyright (c) 2013 Rackspace, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from marconi.bench import storage as bench
+from marconi.queues.storage import sqlite
+from marconi import tests as testing
+
+
+class TestStorageBench(testing.TestBase):
+
+    def test_run(self):
+        results = bench.run(sqlite.Driver(), queues=2, messages=25, batch=10)
+
+        self.assertEqual(results['message_post']['calls'], 6)
+        self.assertEqual(results['message_post']['messages'], 50)
+        self.assertEqual(results['message_delete']['messages'], 50)
+
+        # NOTE: Each queue ends with an empty page
+        self.assertEqual(results['message_list']['calls'], 8)
+
+    def test_empty_run(self):
+        results = bench.run(sqlite.Driver(), queues=2, messages=0)
+
+        self.assertNotIn('message_post', results)
+        self.assertNotIn('message_delete', results)
+        self.assertEqual(results['queue_create']['calls'], 2)
+        self.assertEqual(results['message_list']['calls'], 2)
@@ -13,9 +13,12 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from testtools import matchers
+
 from marconi.queues import storage
 from marconi.queues.storage import sqlite
 from marconi.queues.storage.sqlite import controllers
+from marconi.queues.storage.sqlite import utils
 
 import base  # noqa
 
@@ -24,6 +27,112 @@ class SQliteQueueTests(base.QueueControllerTest):
     driver_class = sqlite.Driver
     controller_class = controllers.QueueController
 
+    def test_stats_do_not_decode_bodies(self):
+        self.controller.create('test', project=self.project)
+        self.message_controller.post('test', [{'body': {}, 'ttl': 60}],
+                                     project=self.project,
+                                     client_uuid='my_uuid')
+
+        # NOTE: 0xc1 is never used by msgpack, so any attempt to
+        # decode this body would raise.
+        shard = self.driver.shard(self.project, 'test')
+        shard.run('''
+            update Messages set content = x'c1' ''')
+
+        stats = self.controller.stats('test', project=self.project)
+        message_stats = stats['messages']
+
+        self.assertEqual(message_stats['total'], 1)
+        self.assertEqual(message_stats['oldest'], message_stats['newest'])
+
+    def test_stats_counters(self):
+        self.controller.create('test', project=self.project)
+        shard = self.driver.shard(self.project, 'test')
+
+        def stats():
+            message_stats = self.controller.stats(
+                'test', project=self.project)['messages']
+
+            for key in ('oldest', 'newest'):
+                if key in message_stats:
+                    del message_stats[key]['age']
+
+            return message_stats
+
+        def counted_stats():
+            # NOTE: Forces the stats to be counted from the rows
+            shard.run('''
+                update Counters set expires = 0''')
+            return stats()
+
+        ids = self.message_controller.post(
+            'test', [{'body': n, 'ttl': 300} for n in range(6)],
+            project=self.project, client_uuid='my_uuid')
+
+        meta = {'ttl': 60, 'grace': 60}
+        cid, msgs = self.claim_controller.create('test', meta,
+                                                 project=self.project,
+                                                 limit=2)
+        [msg1, msg2] = msgs
+
+        self.message_controller.delete('test', msg1['id'],
+                                       project=self.project, claim=cid)
+        self.message_controller.bulk_delete('test', ids[-1:],
+                                            project=self.project)
+        self.assertTrue(self.controller.check_counters(
+            'test', project=self.project))
+
+        message_stats = stats()
+        self.assertEqual(message_stats['total'], 4)
+        self.assertEqual(message_stats['claimed'], 1)
+        self.assertEqual(message_stats['free'], 3)
+        self.assertEqual(message_stats['newest']['id'], ids[-2])
+        self.assertEqual(message_stats, counted_stats())
+
+        self.claim_controller.delete('test', cid, project=self.project)
+        self.assertTrue(self.controller.check_counters(
+            'test', project=self.project))
+
+        message_stats = stats()
+        self.assertEqual(message_stats['claimed'], 0)
+        self.assertEqual(message_stats['free'], 4)
+        self.assertEqual(message_stats, counted_stats())
+
+        # NOTE: The stats are read from the counters, so out-of-sync
+        # counters show up until they are checked.
+        shard.run('''
+            update Counters set total = 99''')
+        self.assertEqual(stats()['total'], 99)
+
+        self.assertFalse(self.controller.check_counters(
+            'test', project=self.project))
+        self.assertEqual(stats()['total'], 4)
+
+    def test_stats_purge_expired_rows(self):
+        self.controller.create('test', project=self.project)
+        shard = self.driver.shard(self.project, 'test')
+
+        ids = self.message_controller.post(
+            'test', [{'body': n, 'ttl': 300} for n in range(3)],
+            project=self.project, client_uuid='my_uuid')
+
+        # NOTE: Expires the oldest message
+        shard.run('''
+            update Messages set created = created - 600
+             where id = ?''', utils.msgid_decode(ids[0]))
+
+        message_stats = self.controller.stats(
+            'test', project=self.project)['messages']
+        self.assertEqual(message_stats['total'], 2)
+
+        # NOTE: The counters now only cover live rows, so the next
+        # calls read them rather than counting.
+        fresh, total = shard.get('''
+            select expires > julianday() * 86400.0, total
+              from Counters''')
+        self.assertTrue(fresh)
+        self.assertEqual(total, 2)
+
 
 class SQliteMessageTests(base.MessageControllerTest):
     driver_class = sqlite.Driver
@@ -42,7 +151,72 @@ class SQliteMessageTests(base.MessageControllerTest):
                           self.controller.first,
                           'foo', None, sort='dosomething()')
 
+    def test_bulk_get_keeps_request_order(self):
+        messages_in = [{'ttl': 120, 'body': idx} for idx in range(5)]
+        ids = self.controller.post(self.queue_name, messages_in,
+                                   project=self.project,
+                                   client_uuid='my_uuid')
+
+        requested = list(reversed(ids)) + ['xyz', ids[0]]
+        messages_out = self.controller.bulk_get(self.queue_name, requested,
+                                                project=self.project)
+
+        self.assertEquals([msg['body'] for msg in messages_out],
+                          [4, 3, 2, 1, 0])
+
+        self.controller.bulk_delete(self.queue_name, ids[:2] + ['xyz'],
+                                    project=self.project)
+
+        messages_out = self.controller.bulk_get(self.queue_name, ids,
+                                                project=self.project)
+
+        self.assertEquals([msg['body'] for msg in messages_out], [2, 3, 4])
+
 
 class SQliteClaimTests(base.ClaimControllerTest):
     driver_class = sqlite.Driver
     controller_class = controllers.ClaimController
+
+
+class SQliteShardedTestMixin(object):
+    """Runs the driver-agnostic tests over several database files."""
+
+    def setUp(self):
+        # NOTE: The driver reads its options when instantiated by the
+        # base class, so override them beforehand.
+        self.config('drivers:storage:sqlite', shards=4)
+        super(SQliteShardedTestMixin, self).setUp()
+
+
+class SQliteShardedQueueTests(SQliteShardedTestMixin, SQliteQueueTests):
+
+    def test_list_merges_shards(self):
+        names = ['q%02d' % n for n in range(25)]
+        for name in names:
+            self.controller.create(name, project=self.project)
+
+        used = [shard for shard in self.driver.shards
+                if shard.run('select count(*) from Queues').fetchone()[0]]
+        self.assertThat(len(used), matchers.GreaterThan(1))
+
+        listed = []
+        marker = None
+        while True:
+            interaction = self.controller.list(project=self.project,
+                                               marker=marker, limit=10)
+            page = [q['name'] for q in next(interaction)]
+            if not page:
+                break
+
+            listed += page
+            marker = next(interaction)
+
+        self.assertEqual(listed, names)
+
+
+class SQliteShardedMessageTests(SQliteShardedTestMixin, SQliteMessageTests):
+    pass
+
+
+class SQliteShardedClaimTests(SQliteShardedTestMixin, SQliteClaimTests):
+    pass
@@ -0,0 +1,132 @@
+# Copyright (c) 2013 Rackspace, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from marconi.common import metrics
+from marconi.queues.storage.mongodb import instruments
+from marconi import tests as testing
+
+
+class Collection(object):
+
+    name = 'messages'
+
+    def find(self, query):
+        return [query]
+
+    def update(self, query, update):
+        return {'n': 1}
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+
+class QueueController(object):
+
+    def __init__(self, col):
+        self._col = col
+
+    def exists(self, name):
+        return bool(self._col.find({'n': name}))
+
+
+class MessageController(object):
+
+    def __init__(self, col, queue_controller):
+        self._col = col
+        self._queue_controller = queue_controller
+
+    def post(self, name):
+        self._queue_controller.exists(name)
+        self._col.update({'n': name}, {'$inc': {'c': 1}})
+
+    def list(self, name):
+        yield self._col.find({'n': name})
+        yield self._col.find({'n': name})
+
+    def _helper(self):
+        pass
+
+
+class TestInstruments(testing.TestBase):
+
+    def setUp(self):
+        super(TestInstruments, self).setUp()
+
+        self.registry = metrics.Registry()
+        self.instruments = instruments.Instruments(self.registry)
+
+        col = self.instruments.collection(Collection())
+        self.queue_controller = self.instruments.controller(
+            QueueController(col))
+        self.message_controller = self.instruments.controller(
+            MessageController(col, self.queue_controller))
+
+    def _round_trips(self, name):
+        snapshot = self.registry.snapshot()['histograms']
+        histogram = snapshot['mongodb.' + name + '.round_trips']
+        return dict((bound, n) for bound, n in histogram['histogram'] if n)
+
+    def test_proxies(self):
+        self.assertEqual(self.message_controller.__class__, MessageController)
+        self.assertEqual(self.message_controller._col.name, 'messages')
+
+        names = self.registry.snapshot()['histograms']
+        self.assertIn('mongodb.MessageController.post.round_trips', names)
+        self.assertNotIn('mongodb.MessageController._helper.round_trips',
+                         names)
+
+    def test_round_trips(self):
+        self.queue_controller.exists('fizbit')
+        self.assertEqual(self._round_trips('QueueController.exists'), {1: 1})
+
+        # NOTE: Nested calls count toward the outermost one only
+        self.message_controller.post('fizbit')
+        self.assertEqual(self._round_trips('MessageController.post'), {2: 1})
+        self.assertEqual(self._round_trips('QueueController.exists'), {1: 1})
+
+    def test_generator(self):
+        results = self.message_controller.list('fizbit')
+        self.assertEqual(self._round_trips('MessageController.list'), {})
+
+        self.assertEqual(len(list(results)), 2)
+        self.assertEqual(self._round_trips('MessageController.list'), {2: 1})
+
+    def test_timed(self):
+        controller = metrics.Instrumented(self.message_controller,
+                                          self.registry)
+        controller.post('fizbit')
+
+        timers = self.registry.snapshot()['timers']
+        self.assertEqual(timers['MessageController.post']['count'], 1)
+        self.assertEqual(self._round_trips('MessageController.post'), {2: 1})
+
+    def test_events(self):
+        self.instruments.post_attempts(3)
+        self.instruments.marker_collision()
+        self.instruments.claim_shortfall(10, 7)
+        self.instruments.claim_shortfall(10, 10)
+        self.instruments.gc_duration(0.5)
+
+        snapshot = self.registry.snapshot()
+        self.assertEqual(
+            snapshot['histograms']['mongodb.MessageController.post.attempts']
+            ['count'], 1)
+
+        counters = snapshot['counters']
+        self.assertEqual(
+            counters['mongodb.MessageController.post.marker_collisions'], 1)
+        self.assertEqual(counters['mongodb.ClaimController.create.shortfall'],
+                         3)
+        self.assertEqual(snapshot['timers']['mongodb.gc']['count'], 1)
@@ -0,0 +1,185 @@
+# Copyright (c) 2013 Rackspace, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import mock
+
+from marconi.queues.storage.mongodb import slowlog
+from marconi import tests as testing
+
+
+PLAN = {'cursor': 'BtreeCursor p_1_q_1_k_1', 'nscanned': 120,
+        'nscannedObjects': 100, 'n': 10}
+
+
+class Cursor(object):
+
+    def __init__(self, query):
+        self.query = query
+
+    def hint(self, index):
+        return self
+
+    def limit(self, limit):
+        return self
+
+    def explain(self):
+        return PLAN
+
+    def __iter__(self):
+        return iter([self.query])
+
+
+class Collection(object):
+
+    name = 'messages'
+
+    def find(self, query, **kwargs):
+        return Cursor(query)
+
+    def find_one(self, query, **kwargs):
+        return query
+
+    def insert(self, document):
+        return 1
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+
+class MessageController(object):
+
+    def __init__(self, col):
+        self._col = col
+
+    def get(self, name):
+        return list(self._col.find({'q': name, 'k': {'$gt': 5}}).hint('k'))
+
+    def post(self, name):
+        self._col.insert({'q': name})
+        return self.get(name)
+
+    def list(self, name):
+        for message in self._col.find({'q': name}):
+            yield message
+
+    def first(self, name):
+        return self._col.find_one({'q': name}, sort=[('k', 1)])
+
+    def claim(self, name):
+        self._col.update({'q': name}, {'$set': {'c': 1}})
+
+
+class TestSlowLog(testing.TestBase):
+
+    def _controller(self, threshold, sample_rate=1.0, explain_interval=60):
+        log = slowlog.SlowLog(threshold, sample_rate, explain_interval)
+        return log.controller(MessageController(log.collection(Collection())))
+
+    @mock.patch.object(slowlog.LOG, 'warning')
+    def test_slow(self, warning):
+        controller = self._controller(0.0)
+        self.assertEqual(controller.__class__, MessageController)
+
+        controller.get('fizbit')
+
+        lines = warning.call_args[0][0].splitlines()
+        self.assertTrue(lines[0].startswith(
+            'Slow call to MessageController.get: 0 ms, 1 operation'))
+
+        self.assertTrue(lines[1].strip().startswith('find messages {'))
+        self.assertIn("'k': {'$gt': 'int'}", lines[1])
+        self.assertIn("'q': 'str'", lines[1])
+        self.assertIn('index BtreeCursor p_1_q_1_k_1, 120 keys and 100 '
+                      'documents scanned, 10 returned', lines[1])
+
+    @mock.patch.object(slowlog.LOG, 'warning')
+    def test_nested(self, warning):
+        self._controller(0.0).post('fizbit')
+
+        # NOTE: The nested call is only logged as part of the outer one
+        self.assertEqual(warning.call_count, 1)
+
+        lines = warning.call_args[0][0].splitlines()
+        self.assertIn('MessageController.post', lines[0])
+        self.assertEqual(lines[1].strip(), "insert messages {'q': 'str'}")
+        self.assertTrue(lines[2].strip().startswith('find messages'))
+
+    @mock.patch.object(slowlog.LOG, 'warning')
+    def test_generator(self, warning):
+        results = self._controller(0.0).list('fizbit')
+        self.assertFalse(warning.called)
+
+        self.assertEqual(list(results), [{'q': 'fizbit'}])
+        self.assertIn('MessageController.list', warning.call_args[0][0])
+
+    @mock.patch.object(slowlog.LOG, 'warning')
+    def test_fast_or_not_sampled(self, warning):
+        self._controller(60).get('fizbit')
+        self._controller(0.0, sample_rate=0.0).get('fizbit')
+        self.assertFalse(warning.called)
+
+    @mock.patch.object(slowlog.LOG, 'warning')
+    def test_explain_interval(self, warning):
+        controller = self._controller(0.0)
+
+        controller.get('fizbit')
+        self.assertIn('index', warning.call_args[0][0])
+
+        # NOTE: The same query is not explained again for a while
+        controller.get('other')
+        self.assertNotIn('index', warning.call_args[0][0])
+
+        controller = self._controller(0.0, explain_interval=0)
+        controller.get('fizbit')
+        controller.get('other')
+        self.assertIn('index', warning.call_args[0][0])
+
+    @mock.patch.object(slowlog.LOG, 'warning')
+    def test_explained_operations(self, warning):
+        controller = self._controller(0.0)
+
+        controller.first('fizbit')
+        self.assertIn('index', warning.call_args[0][0])
+
+        # NOTE: A find would not reproduce the plan of a write
+        controller.claim('fizbit')
+        lines = warning.call_args[0][0].splitlines()
+        self.assertEqual(lines[1].strip(), "update messages {'q': 'str'}")
+
+    def test_shape(self):
+        self.assertEqual(slowlog.shape({'p': None, 'q': u'x',
+                                        '_id': {'$in': [1, 2]}}),
+                         {'p': 'NoneType', 'q': 'unicode',
+                          '_id': {'$in': ['int']}})
+
+    def test_summarize(self):
+        self.assertEqual(slowlog.summarize(PLAN),
+                         {'index': PLAN['cursor'], 'keys': 120,
+                          'docs': 100, 'returned': 10})
+
+        plan = {
+            'queryPlanner': {'winningPlan': {
+                'stage': 'LIMIT',
+                'inputStage': {'stage': 'FETCH', 'inputStage': {
+                    'stage': 'IXSCAN', 'indexName': 'active'}}}},
+            'executionStats': {'totalKeysExamined': 12,
+                               'totalDocsExamined': 11, 'nReturned': 10},
+        }
+        self.assertEqual(slowlog.summarize(plan),
+                         {'index': 'active', 'keys': 12,
+                          'docs': 11, 'returned': 10})
+
+        plan = {'queryPlanner': {'winningPlan': {'stage': 'COLLSCAN'}}}
+        self.assertEqual(slowlog.summarize(plan)['index'], 'COLLSCAN')
@@ -0,0 +1,150 @@
+# Copyright (c) 2013 Rackspace, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import socket
+
+from marconi.common import metrics
+from marconi import tests as testing
+
+
+class Controller(object):
+
+    limit = 10
+
+    def get(self, key):
+        if key is None:
+            raise KeyError(key)
+
+        return key
+
+    def list(self):
+        yield 1
+        yield 2
+
+    def _helper(self):
+        pass
+
+
+class TestMetrics(testing.TestBase):
+
+    def setUp(self):
+        super(TestMetrics, self).setUp()
+        self.registry = metrics.Registry()
+
+    def _histogram(self, name):
+        snapshot = self.registry.snapshot()['timers'][name]
+        return dict((bound, n) for bound, n in snapshot['histogram'] if n)
+
+    def _count(self, name):
+        return self.registry.snapshot()['timers'][name]['count']
+
+    def test_timer(self):
+        timer = self.registry.timer('op')
+        self.assertIs(self.registry.timer('op'), timer)
+
+        for seconds in (0.0005, 0.001, 0.003, 0.003, 60):
+            timer.record(seconds)
+        timer.record(0.004, error=True)
+
+        snapshot = self.registry.snapshot()['timers']['op']
+        self.assertEqual(snapshot['count'], 6)
+        self.assertEqual(snapshot['errors'], 1)
+        self.assertEqual(self._histogram('op'), {1: 2, 5: 3, None: 1})
+
+    def test_instrumented(self):
+        controller = metrics.Instrumented(
+            Controller(), self.registry,
+            is_error=lambda ex: not isinstance(ex, KeyError))
+
+        self.assertEqual(controller.get('a'), 'a')
+        self.assertRaises(KeyError, controller.get, None)
+        self.assertEqual(controller.limit, 10)
+        self.assertIsNone(controller._helper())
+
+        snapshot = self.registry.snapshot()['timers']
+        self.assertEqual(sorted(snapshot), ['Controller.get',
+                                            'Controller.list'])
+        self.assertEqual(snapshot['Controller.get']['count'], 2)
+        self.assertEqual(snapshot['Controller.get']['errors'], 0)
+
+    def test_generator(self):
+        controller = metrics.Instrumented(Controller(), self.registry,
+                                          prefix='ctrl')
+
+        results = controller.list()
+        self.assertEqual(next(results), 1)
+
+        # NOTE: Recorded once the generator is exhausted or closed
+        self.assertEqual(self._count('ctrl.list'), 0)
+        self.assertEqual(list(results), [2])
+        self.assertEqual(self._count('ctrl.list'), 1)
+
+        results = controller.list()
+        next(results)
+        results.close()
+        self.assertEqual(self._count('ctrl.list'), 2)
+
+    def test_histogram(self):
+        histogram = self.registry.histogram('trips', (1, 2, 5))
+        self.assertIs(self.registry.histogram('trips', ()), histogram)
+
+        for value in (1, 1, 2, 4, 9):
+            histogram.record(value)
+
+        snapshot = self.registry.snapshot()['histograms']['trips']
+        self.assertEqual(snapshot['count'], 5)
+        self.assertEqual(snapshot['mean'], 3.4)
+        self.assertEqual(snapshot['histogram'],
+                         [[1, 2], [2, 1], [5, 1], [None, 1]])
+
+    def test_counter(self):
+        counter = self.registry.counter('collisions')
+        counter.increment()
+        counter.increment(2)
+
+        self.assertEqual(self.registry.snapshot()['counters'],
+                         {'collisions': 3})
+
+    def test_statsd(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(('127.0.0.1', 0))
+        sock.settimeout(5)
+        self.addCleanup(sock.close)
+
+        emitter = metrics.StatsdEmitter('127.0.0.1', sock.getsockname()[1],
+                                        prefix='test')
+        registry = metrics.Registry(emitter)
+
+        timer = registry.timer('/v1/queues/{queue_name}.on_get')
+        timer.record(0.0125)
+        self.assertEqual(sock.recv(512),
+                         'test.v1_queues_queue_name_.on_get:12.500|ms')
+
+        timer.record(0.5, error=True)
+        self.assertEqual(sock.recv(512),
+                         'test.v1_queues_queue_name_.on_get:500.000|ms\n'
+                         'test.v1_queues_queue_name_.on_get.errors:1|c')
+
+        registry.histogram('trips', (1, 2)).record(3)
+        self.assertEqual(sock.recv(512), 'test.trips:3|h')
+
+        registry.counter('collisions').increment()
+        self.assertEqual(sock.recv(512), 'test.collisions:1|c')
+
+    def test_from_config(self):
+        self.assertIsNone(metrics.from_config())
+
+        self.config('metrics', enabled=True)
+        self.assertIsInstance(metrics.from_config(), metrics.Registry)
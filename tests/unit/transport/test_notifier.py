@@ -0,0 +1,85 @@
+# Copyright (c) 2013 Rackspace, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+
+from marconi.queues.transport import notifier
+from marconi import tests as testing
+
+
+class TestNotifier(testing.TestBase):
+
+    def setUp(self):
+        super(TestNotifier, self).setUp()
+        self.notifier = notifier.Notifier()
+
+    def test_notify(self):
+        with self.notifier.subscribe('fizbit', 'p') as posted:
+            with self.notifier.subscribe('fizbit', 'p') as posted_too:
+                self.notifier.notify('fizbit', 'other')
+                self.notifier.notify('other', 'p')
+                self.assertFalse(posted.is_set())
+
+                self.notifier.notify('fizbit', 'p')
+                self.assertTrue(posted.is_set())
+                self.assertTrue(posted_too.is_set())
+
+        # NOTE: A new subscription waits for the next post
+        with self.notifier.subscribe('fizbit', 'p') as posted:
+            self.assertFalse(posted.is_set())
+
+    def test_wakes_up_waiting_thread(self):
+        results = []
+
+        with self.notifier.subscribe('fizbit', None) as posted:
+            def wait():
+                results.append(posted.wait(10))
+
+            thread = threading.Thread(target=wait)
+            thread.start()
+
+            self.notifier.notify('fizbit', None)
+            thread.join()
+
+        self.assertEqual(results, [True])
+
+    def test_forgets_idle_queues(self):
+        with self.notifier.subscribe('fizbit', 'p'):
+            with self.notifier.subscribe('fizbit', 'p'):
+                pass
+
+            self.assertEqual(len(self.notifier._waiting), 1)
+
+        self.assertEqual(self.notifier._waiting, {})
+
+    def test_waiters_limit(self):
+        self.notifier.max_waiters = 1
+
+        with self.notifier.waiting(10) as wait:
+            self.assertEqual(wait, 10)
+
+            with self.notifier.waiting(10) as wait_too:
+                self.assertIsNone(wait_too)
+
+        self.assertTrue(self.notifier.start_waiting())
+        self.notifier.stop_waiting()
+
+    def test_no_wait_takes_no_slot(self):
+        self.notifier.max_waiters = 0
+
+        with self.notifier.waiting(None) as wait:
+            self.assertIsNone(wait)
+
+        self.assertEqual(self.notifier._waiters, 0)
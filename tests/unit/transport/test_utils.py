@@ -0,0 +1,83 @@
+# Copyright (c) 2013 Rackspace, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+
+import ddt
+
+from marconi.queues.transport import utils
+from marconi import tests as testing
+
+
+@ddt.ddt
+class TestJSONCodecs(testing.TestBase):
+
+    def _use(self, name):
+        try:
+            codec = utils.get_codec(name)
+        except ImportError:
+            self.skipTest('%s is not installed' % name)
+
+        self.config('drivers:transport', json_codec=name)
+        return codec
+
+    @ddt.data('simplejson', 'json', 'ujson')
+    def test_round_trip(self, name):
+        codec = self._use(name)
+
+        obj = {u'body': {u'event': u'r\u00e9plica', u'path': u'/a/b'},
+               u'ttl': 300, u'ids': [2 ** 63 - 1, -2 ** 63],
+               u'ok': True, u'none': None, u'ratio': 0.5}
+
+        document = codec.dumps(obj)
+        self.assertIsInstance(document, str)
+        self.assertIn(u'r\u00e9plica'.encode('utf-8'), document)
+        self.assertEqual(codec.loads(document), obj)
+
+        compact = codec.dumps(obj, compact=True)
+        self.assertNotIn(' ', compact)
+        self.assertEqual(codec.loads(compact.decode('utf-8')), obj)
+
+    @ddt.data('simplejson', 'json', 'ujson')
+    def test_integer_overflow(self, name):
+        codec = self._use(name)
+
+        for document in ('[9223372036854775808]',
+                         '{"x": -9223372036854775809}',
+                         '[18446744073709551615]'):
+            self.assertRaises(utils.OverflowedJSONInteger,
+                              codec.loads, document)
+
+            stream = io.BytesIO(document)
+            self.assertRaises(utils.OverflowedJSONInteger,
+                              utils.read_json, stream, len(document))
+
+    @ddt.data('simplejson', 'json', 'ujson')
+    def test_configured_codec(self, name):
+        codec = self._use(name)
+        self.assertIs(utils.get_codec(), codec)
+
+        document = u'[{"n": 1}, {"n": [2]}]'.encode('utf-8')
+        objects = utils.read_json_array(io.BytesIO(document), len(document))
+        self.assertEqual(list(objects), [{u'n': 1}, {u'n': [2]}])
+
+        body = b''.join(utils.to_json_stream({'a': iter([1, 2])}))
+        self.assertEqual(codec.loads(body), {u'a': [1, 2]})
+
+        self.assertRaises(utils.MalformedJSON, utils.read_json,
+                          io.BytesIO(b'[1, 2'), 5)
+
+    def test_unknown_codec(self):
+        self.assertRaises(ValueError, utils.get_codec, 'yaml')
@@ -0,0 +1,60 @@
+# Copyright (c) 2013 Rackspace, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import ddt
+import simplejson as json
+
+from marconi.queues.transport import validation
+from marconi import tests as testing
+
+
+@ddt.ddt
+class TestCompactJSONLength(testing.TestBase):
+
+    @ddt.data(None, True, False, 0, -42, 2 ** 63 - 1, 1.5, -2.0e-10,
+              u'', 'ascii', u'\u00e9\u4e2d\U0001f600', '\xc3\xa9',
+              u'"quoted" \\ \b\f\n\r\t \x00\x1f \x7f',
+              [], {}, [1, [2, [3]]], (u'a', None),
+              {u'k': u'v', 'nested': {u'\u00e9': [True, {}]}},
+              {u'body': {u'event': u'start_backup'}, u'ttl': 300})
+    def test_length_matches_dumps(self, obj):
+        document = json.dumps(obj, ensure_ascii=False,
+                              separators=(',', ':'))
+        if isinstance(document, unicode):
+            document = document.encode('utf-8')
+
+        self.assertEqual(validation._compact_json_length(obj),
+                         len(document))
+        self.assertEqual(validation._compact_json_length(obj, len(document)),
+                         len(document))
+
+    def test_stops_past_limit(self):
+        class Unsizeable(object):
+            pass
+
+        # NOTE: Measuring the unsizeable element would raise, since it
+        # is not JSON-serializable, so it must not be reached.
+        obj = [u'x'] * 300 + [[Unsizeable()]]
+
+        length = validation._compact_json_length(obj, 64)
+        self.assertTrue(length > 64)
+
+        self.assertRaises(TypeError, validation._compact_json_length, obj)
+
+    def test_non_string_keys(self):
+        obj = {1: None, u'a': [1.5]}
+        document = json.dumps(obj, separators=(',', ':'))
+
+        self.assertEqual(validation._compact_json_length(obj), len(document))
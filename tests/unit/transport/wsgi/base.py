@@ -34,6 +34,7 @@ class TestBase(testing.TestBase):
         conf_file = self.conf_path(self.config_filename)
         boot = marconi.Bootstrap(conf_file)
 
+        self.transport = boot.transport
         self.app = boot.transport.app
         self.srmock = ftest.StartResponseMock()
 
@@ -100,3 +101,19 @@ class TestBaseFaulty(TestBase):
     def tearDown(self):
         setattr(marconi.Bootstrap, 'storage', self._storage_backup)
         super(TestBaseFaulty, self).tearDown()
+
+
+class StreamingTestMixin(object):
+    """Runs the tests with the responses streamed, chunk by chunk."""
+
+    def setUp(self):
+        super(StreamingTestMixin, self).setUp()
+        self.config('drivers:transport:wsgi', stream_responses=True)
+
+    def simulate_request(self, *args, **kwargs):
+        # NOTE: Keep the chunks around, but hand the whole body
+        # to the tests as a single chunk, like a buffered response.
+        self.chunks = list(super(StreamingTestMixin, self).simulate_request(
+            *args, **kwargs))
+
+        return [b''.join(self.chunks)]
@@ -15,11 +15,15 @@
 
 import json
 import os
+import time
 
 import pymongo
 
 import ddt
 import falcon
+import mock
+import msgpack
+from testtools import matchers
 
 import base  # noqa
 from marconi.common import config
@@ -88,6 +92,83 @@ class ClaimsBaseTest(base.TestBase):
 
         self.assertEquals(self.srmock.status, falcon.HTTP_400)
 
+    def test_claim_wait(self):
+        self.config('drivers:transport:wsgi', long_poll_interval=0.1)
+        doc = '{"ttl": 100, "grace": 60}'
+
+        # Returns at once when there are messages
+        start = time.time()
+        self.simulate_post(self.claims_path, self.project_id, body=doc,
+                           query_string='limit=10&wait=10')
+        self.assertEquals(self.srmock.status, falcon.HTTP_201)
+        self.assertThat(time.time() - start, matchers.LessThan(5))
+
+        # Times out with nothing left to claim, having checked for
+        # messages without claiming again
+        controller = self.transport.storage.claim_controller
+        create = type(controller).create
+
+        with mock.patch.object(type(controller), 'create', autospec=True,
+                               side_effect=create) as claim:
+            start = time.time()
+            self.simulate_post(self.claims_path, self.project_id,
+                               body=doc, query_string='wait=1')
+
+        self.assertEquals(self.srmock.status, falcon.HTTP_204)
+        self.assertThat(time.time() - start, matchers.GreaterThan(0.9))
+        self.assertEquals(claim.call_count, 1)
+
+    def test_claim_wait_needs_concurrency(self):
+        self.transport.notifier.max_waiters = 0
+
+        self.simulate_post(self.claims_path, self.project_id,
+                           body='{"ttl": 100, "grace": 60}',
+                           query_string='limit=10')
+        self.assertEquals(self.srmock.status, falcon.HTTP_201)
+
+        start = time.time()
+        self.simulate_post(self.claims_path, self.project_id,
+                           body='{"ttl": 100, "grace": 60}',
+                           query_string='wait=10')
+        self.assertEquals(self.srmock.status, falcon.HTTP_204)
+        self.assertThat(time.time() - start, matchers.LessThan(5))
+
+    @ddt.data(-1, 31)
+    def test_claim_bad_wait(self, wait):
+        self.simulate_post(self.claims_path, self.project_id,
+                           body='{"ttl": 100, "grace": 60}',
+                           query_string='wait=%d' % wait)
+
+        self.assertEquals(self.srmock.status, falcon.HTTP_400)
+
+    def test_msgpack(self):
+        headers = {'Content-Type': 'application/x-msgpack',
+                   'Accept': 'application/x-msgpack'}
+        doc = msgpack.packb({'ttl': 100, 'grace': 60})
+
+        body = self.simulate_post(self.claims_path, self.project_id,
+                                  body=doc, query_string='limit=3',
+                                  headers=headers)
+        self.assertEquals(self.srmock.status, falcon.HTTP_201)
+
+        claimed = msgpack.unpackb(body[0], encoding='utf-8')
+        self.assertEquals([msg['body'] for msg in claimed], [239] * 3)
+
+        claim_href = self.srmock.headers_dict['Location']
+
+        doc = msgpack.packb({'ttl': 60})
+        self.simulate_patch(claim_href, self.project_id, body=doc,
+                            headers=headers)
+        self.assertEquals(self.srmock.status, falcon.HTTP_204)
+
+        body = self.simulate_get(claim_href, self.project_id,
+                                 headers=headers)
+        self.assertEquals(self.srmock.status, falcon.HTTP_200)
+
+        claim = msgpack.unpackb(body[0], encoding='utf-8')
+        self.assertEquals(claim['ttl'], 60)
+        self.assertEquals(len(claim['messages']), 3)
+
     def _get_a_claim(self):
         doc = '{"ttl": 100, "grace": 60}'
         self.simulate_post(self.claims_path, self.project_id, body=doc)
@@ -244,6 +325,10 @@ class ClaimsSQLiteTests(ClaimsBaseTest):
     config_filename = 'wsgi_sqlite.conf'
 
 
+class ClaimsSQLiteStreamingTests(base.StreamingTestMixin, ClaimsSQLiteTests):
+    pass
+
+
 class ClaimsFaultyDriverTests(base.TestBaseFaulty):
 
     config_filename = 'wsgi_faulty.conf'
@@ -36,3 +36,12 @@ class TestHomeDocument(base.TestBase):
             json.loads(body[0])
         except ValueError:
             self.fail('Home document is not valid JSON')
+
+    def test_request_id(self):
+        self.simulate_get('/v1')
+        request_id = self.srmock.headers_dict['X-Openstack-Request-Id']
+        self.assertTrue(request_id.startswith('req-'))
+
+        self.simulate_get('/v1')
+        self.assertNotEqual(
+            self.srmock.headers_dict['X-Openstack-Request-Id'], request_id)
@@ -17,6 +17,8 @@ import ddt
 import falcon
 from falcon import testing
 
+from marconi.queues.transport.wsgi import driver
+
 import base  # noqa
 
 
@@ -45,3 +47,41 @@ class TestWSGIMediaType(base.TestBase):
 
         self.app(env, self.srmock)
         self.assertEquals(self.srmock.status, falcon.HTTP_406)
+
+    @ddt.data(
+        ('GET', '/v1/queues/nonexistent/messages'),
+        ('GET', '/v1/queues/nonexistent/messages/deadbeaf'),
+        ('POST', '/v1/queues/nonexistent/claims'),
+        ('GET', '/v1/queues/nonexistent/claims/0ad'),
+    )
+    def test_msgpack_endpoints(self, (method, endpoint)):
+        headers = {'Client-ID': '30387f00',
+                   'Accept': 'application/x-msgpack'}
+
+        env = testing.create_environ(endpoint,
+                                     method=method,
+                                     headers=headers)
+
+        self.app(env, self.srmock)
+        self.assertNotEquals(self.srmock.status, falcon.HTTP_406)
+
+    @ddt.data('/v1/queues', '/v1/queues/nonexistent/stats')
+    def test_msgpack_not_acceptable(self, endpoint):
+        headers = {'Accept': 'application/x-msgpack'}
+
+        env = testing.create_environ(endpoint, headers=headers)
+
+        self.app(env, self.srmock)
+        self.assertEquals(self.srmock.status, falcon.HTTP_406)
+
+    def test_not_acceptable_lists_served_media_types(self):
+        env = testing.create_environ('/v1/queues/nonexistent/messages',
+                                     headers={'Accept': 'application/xml'})
+
+        try:
+            driver._check_media_type(falcon.Request(env), None, {})
+        except falcon.HTTPNotAcceptable as ex:
+            self.assertIn('`application/json` or `application/x-msgpack`',
+                          ex.description)
+        else:
+            self.fail('application/xml was accepted')
@@ -15,9 +15,11 @@
 
 import json
 import os
+import time
 
 import ddt
 import falcon
+import msgpack
 from testtools import matchers
 
 import base  # noqa
@@ -186,6 +188,57 @@ class MessagesBaseTest(base.TestBase):
 
         self.assertEquals(self.srmock.status, falcon.HTTP_400)
 
+    def test_msgpack(self):
+        headers = dict(self.headers)
+        headers['Content-Type'] = 'application/x-msgpack'
+        headers['Accept'] = 'application/x-msgpack'
+
+        sample_messages = [
+            {'body': {'key': u'\u00e9'}, 'ttl': 200},
+            {'body': [1, 2.5, None], 'ttl': 300},
+        ]
+        doc = msgpack.packb(sample_messages)
+
+        result = self.simulate_post(self.messages_path, self.project_id,
+                                    body=doc, headers=headers)
+        self.assertEquals(self.srmock.status, falcon.HTTP_201)
+        self.assertEquals(self.srmock.headers_dict['Content-Type'],
+                          'application/x-msgpack')
+
+        result_doc = msgpack.unpackb(result[0], encoding='utf-8')
+        self.assertEquals(len(result_doc['resources']), 2)
+
+        # Listing
+        result = self.simulate_get(self.messages_path, self.project_id,
+                                   query_string='echo=true',
+                                   headers=headers)
+        self.assertEquals(self.srmock.status, falcon.HTTP_200)
+
+        result_doc = msgpack.unpackb(result[0], encoding='utf-8')
+        self.assertEquals([msg['body'] for msg in result_doc['messages']],
+                          [m['body'] for m in sample_messages])
+
+        # Single message, as JSON by default
+        href = result_doc['messages'][0]['href']
+        result = self.simulate_get(href, self.project_id)
+        self.assertEquals(self.srmock.status, falcon.HTTP_200)
+        self.assertEquals(json.loads(result[0])['body'],
+                          sample_messages[0]['body'])
+
+    @ddt.data(msgpack.packb([{u'body': b'\xff', u'ttl': 60}],
+                            use_bin_type=True),
+              msgpack.packb([{'body': '\xff', 'ttl': 60}]),
+              msgpack.packb({'body': 1, 'ttl': 60}),
+              b'\x91\xc1')
+    def test_post_bad_msgpack(self, document):
+        headers = dict(self.headers)
+        headers['Content-Type'] = 'application/x-msgpack'
+
+        self.simulate_post(self.messages_path, self.project_id,
+                           body=document, headers=headers)
+
+        self.assertEquals(self.srmock.status, falcon.HTTP_400)
+
     def test_delete(self):
         self._post_messages(self.messages_path)
         msg_id = self._get_msg_id(self.srmock.headers_dict)
@@ -291,6 +344,57 @@ class MessagesBaseTest(base.TestBase):
 
         self.assertEqual(self.srmock.status, falcon.HTTP_204)
 
+    def test_list_wait(self):
+        self.config('drivers:transport:wsgi', long_poll_interval=0.1)
+
+        # Times out with nothing to list
+        start = time.time()
+        self.simulate_get(self.messages_path, self.project_id,
+                          query_string='wait=1', headers=self.headers)
+        self.assertEquals(self.srmock.status, falcon.HTTP_204)
+        self.assertThat(time.time() - start,
+                        matchers.GreaterThan(0.9))
+
+        # Returns at once when there are messages
+        self._post_messages(self.messages_path)
+
+        start = time.time()
+        self.simulate_get(self.messages_path, self.project_id,
+                          query_string='wait=10&echo=true',
+                          headers=self.headers)
+        self.assertEquals(self.srmock.status, falcon.HTTP_200)
+        self.assertThat(time.time() - start, matchers.LessThan(5))
+
+    def test_list_wait_needs_concurrency(self):
+        self.transport.notifier.max_waiters = 0
+
+        start = time.time()
+        self.simulate_get(self.messages_path, self.project_id,
+                          query_string='wait=10', headers=self.headers)
+        self.assertEquals(self.srmock.status, falcon.HTTP_204)
+        self.assertThat(time.time() - start, matchers.LessThan(5))
+
+    def test_list_wait_limited(self):
+        self.transport.notifier.max_waiters = 1
+
+        # NOTE: Takes the only slot, as another waiting request would
+        self.assertTrue(self.transport.notifier.start_waiting())
+        self.addCleanup(self.transport.notifier.stop_waiting)
+
+        start = time.time()
+        self.simulate_get(self.messages_path, self.project_id,
+                          query_string='wait=10', headers=self.headers)
+        self.assertEquals(self.srmock.status, falcon.HTTP_204)
+        self.assertThat(time.time() - start, matchers.LessThan(5))
+
+    @ddt.data(-1, 31, 'x')
+    def test_list_bad_wait(self, wait):
+        self.simulate_get(self.messages_path, self.project_id,
+                          query_string='wait=%s' % wait,
+                          headers=self.headers)
+
+        self.assertEquals(self.srmock.status, falcon.HTTP_400)
+
     def test_no_uuid(self):
         path = self.queue_path + '/messages'
 
@@ -369,6 +473,25 @@ class MessagesSQLiteTests(MessagesBaseTest):
     config_filename = 'wsgi_sqlite.conf'
 
 
+class MessagesSQLiteStreamingTests(base.StreamingTestMixin,
+                                   MessagesSQLiteTests):
+
+    def test_list_streams_each_message(self):
+        self._post_messages(self.messages_path, repeat=5)
+
+        body = self.simulate_get(self.messages_path, self.project_id,
+                                 query_string='echo=true',
+                                 headers=self.headers)
+        self.assertEquals(self.srmock.status, falcon.HTTP_200)
+
+        # One chunk per message and link, and one to close the document
+        self.assertEquals(len(self.chunks), 7)
+
+        result_doc = json.loads(body[0])
+        self.assertEquals(len(result_doc['messages']), 5)
+        self.assertEquals(len(result_doc['links']), 1)
+
+
 class MessagesMongoDBTests(MessagesBaseTest):
 
     config_filename = 'wsgi_mongodb.conf'
@@ -0,0 +1,88 @@
+# Copyright (c) 2013 Rackspace, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+
+import falcon
+
+# NOTE: Registers the options overridden below
+from marconi.common import metrics  # noqa
+from marconi.queues.transport.wsgi import driver  # noqa
+
+import base  # noqa
+
+
+class TestMetrics(base.TestBase):
+
+    config_filename = 'wsgi_sqlite.conf'
+
+    def setUp(self):
+        # NOTE: Metrics are set up along with the routes
+        self.config('metrics', enabled=True)
+        self.config('drivers:transport:wsgi', admin_api=True)
+        super(TestMetrics, self).setUp()
+
+    def _timers(self):
+        body = self.simulate_get('/v1/metrics', '7e55e1a7e')
+        self.assertEqual(self.srmock.status, falcon.HTTP_200)
+        return json.loads(body[0])['timers']
+
+    def test_requests(self):
+        self.simulate_put('/v1/queues/fizbit', '7e55e1a7e')
+        self.assertEqual(self.srmock.status, falcon.HTTP_201)
+
+        self.simulate_get('/v1/queues/fizbit/messages/a', '7e55e1a7e')
+        self.assertEqual(self.srmock.status, falcon.HTTP_404)
+
+        timers = self._timers()
+
+        route = timers['/v1/queues/{queue_name}.on_put']
+        self.assertEqual(route['count'], 1)
+        self.assertEqual(route['errors'], 0)
+        self.assertEqual(sum(n for bound, n in route['histogram']), 1)
+
+        # NOTE: Client errors and missing resources are not failures
+        route = timers['/v1/queues/{queue_name}/messages/{message_id}.on_get']
+        self.assertEqual((route['count'], route['errors']), (1, 0))
+
+        method = timers['MessageController.get']
+        self.assertEqual((method['count'], method['errors']), (1, 0))
+
+        self.assertEqual(timers['QueueController.create']['count'], 1)
+        self.simulate_delete('/v1/queues/fizbit', '7e55e1a7e')
+
+
+class TestMetricsDisabled(base.TestBase):
+
+    config_filename = 'wsgi_sqlite.conf'
+
+    def test_endpoint(self):
+        self.simulate_get('/v1/metrics', '7e55e1a7e')
+        self.assertEqual(self.srmock.status, falcon.HTTP_404)
+
+
+class TestMetricsNotAdmin(base.TestBase):
+
+    config_filename = 'wsgi_sqlite.conf'
+
+    def setUp(self):
+        self.config('metrics', enabled=True)
+        super(TestMetricsNotAdmin, self).setUp()
+
+    def test_endpoint(self):
+        # NOTE: Still recorded, e.g. for statsd, but not served
+        self.simulate_get('/v1/metrics', '7e55e1a7e')
+        self.assertEqual(self.srmock.status, falcon.HTTP_404)
+        self.assertIsNotNone(self.transport.metrics)
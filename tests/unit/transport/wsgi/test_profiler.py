@@ -0,0 +1,124 @@
+# Copyright (c) 2013 Rackspace, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import pstats
+
+import falcon
+from falcon import testing as ftest
+import fixtures
+
+from marconi.queues.transport.wsgi import driver  # noqa
+from marconi.queues.transport.wsgi import profiler
+from marconi import tests as testing
+
+import base  # noqa
+
+
+def _chunk(n):
+    return 'chunk%d' % n
+
+
+def _app(environ, start_response):
+    start_response('200 OK', [('Content-Type', 'text/plain')])
+    return (_chunk(n) for n in range(3))
+
+
+class TestProfiler(testing.TestBase):
+
+    def setUp(self):
+        super(TestProfiler, self).setUp()
+
+        self.output_dir = self.useFixture(fixtures.TempDir()).path
+        self.profiler = profiler.Profiler(0, header='X-Profile',
+                                          output_dir=self.output_dir,
+                                          dump_interval=0)
+        self.profiler.add_route('/v1/queues/{queue_name}')
+        self.app = self.profiler.install(_app)
+
+    def _request(self, path, **kwargs):
+        srmock = ftest.StartResponseMock()
+        env = ftest.create_environ(path=path, **kwargs)
+        return ''.join(self.app(env, srmock))
+
+    def test_sampling(self):
+        self.assertEqual(self._request('/v1/queues/fizbit'),
+                         'chunk0chunk1chunk2')
+        self.assertEqual(self.profiler.summary(), {})
+
+        self._request('/v1/queues/fizbit', headers={'X-Profile': '1'})
+        self._request('/v1/queues/buzz', headers={'X-Profile': '1'})
+        self._request('/v1/health', headers={'X-Profile': '1'})
+
+        summary = self.profiler.summary()
+        self.assertEqual(sorted(summary), ['GET /v1/queues/{queue_name}',
+                                           'GET <unrouted>'])
+
+        route = summary['GET /v1/queues/{queue_name}']
+        self.assertEqual(route['requests'], 2)
+
+        # NOTE: The body is profiled as it is read
+        chunk = [function for function in route['functions']
+                 if function['function'].endswith('(_chunk)')]
+        self.assertEqual(chunk[0]['calls'], 6)
+
+    def test_dump(self):
+        self._request('/v1/queues/fizbit', headers={'X-Profile': '1'})
+
+        path = os.path.join(self.output_dir,
+                            'GET_v1_queues_queue_name.prof')
+        stats = pstats.Stats(path)
+        self.assertTrue(any(name == '_chunk'
+                            for filename, line, name in stats.stats))
+
+
+class TestProfilesEndpoint(base.TestBase):
+
+    config_filename = 'wsgi_sqlite.conf'
+
+    def setUp(self):
+        self.config('profiling', sample_rate=1.0)
+        self.config('drivers:transport:wsgi', admin_api=True)
+        super(TestProfilesEndpoint, self).setUp()
+
+    def test_profiles(self):
+        # NOTE: Profiles are added up once the body has been read
+        list(self.simulate_put('/v1/queues/fizbit', '7e55e1a7e'))
+        self.assertEqual(self.srmock.status, falcon.HTTP_201)
+
+        body = self.simulate_get('/v1/profiles', '7e55e1a7e',
+                                 query_string='limit=5')
+        self.assertEqual(self.srmock.status, falcon.HTTP_200)
+
+        routes = json.loads(''.join(body))['routes']
+        route = routes['PUT /v1/queues/{queue_name}']
+        self.assertEqual(route['requests'], 1)
+        self.assertEqual(len(route['functions']), 5)
+
+        self.simulate_delete('/v1/queues/fizbit', '7e55e1a7e')
+
+
+class TestProfilesNotAdmin(base.TestBase):
+
+    config_filename = 'wsgi_sqlite.conf'
+
+    def setUp(self):
+        self.config('profiling', sample_rate=1.0)
+        super(TestProfilesNotAdmin, self).setUp()
+
+    def test_endpoint(self):
+        self.simulate_get('/v1/profiles', '7e55e1a7e')
+        self.assertEqual(self.srmock.status, falcon.HTTP_404)
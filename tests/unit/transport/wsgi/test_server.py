@@ -0,0 +1,246 @@
+# Copyright (c) 2013 Rackspace, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import httplib
+import os
+import signal
+import socket
+import threading
+import time
+
+import ddt
+
+from marconi.queues.transport.wsgi import server
+from marconi import tests as testing
+
+
+def _app(environ, start_response):
+    path = environ['PATH_INFO']
+
+    if path == '/pid':
+        start_response('200 OK', [('Content-Type', 'text/plain')])
+        return [str(os.getpid())]
+
+    if path == '/echo':
+        body = environ['wsgi.input'].read()
+        start_response('200 OK', [('Content-Type', 'text/plain')])
+        return [body]
+
+    if path == '/ignore':
+        start_response('201 Created', [])
+        return []
+
+    # NOTE: A generator has no length, so the body is chunked
+    def chunks():
+        for n in range(3):
+            yield 'chunk%d' % n
+
+    start_response('200 OK', [('Content-Type', 'text/plain')])
+    return chunks()
+
+
+@ddt.ddt
+class TestWorker(testing.TestBase):
+
+    def setUp(self):
+        super(TestWorker, self).setUp()
+
+        self.sock = socket.socket()
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(5)
+        self.sock.setblocking(0)
+        self.addCleanup(self.sock.close)
+
+        self.port = self.sock.getsockname()[1]
+
+    def _start(self, **kwargs):
+        worker = server.Worker(self.sock, _app, '127.0.0.1', self.port,
+                               **kwargs)
+
+        thread = threading.Thread(target=worker.run)
+        thread.daemon = True
+        thread.start()
+
+        def stop():
+            worker.stop()
+            thread.join()
+
+        self.addCleanup(stop)
+        return worker
+
+    def _request(self, conn, method, path, body=None):
+        conn.request(method, path, body)
+        response = conn.getresponse()
+        return response, response.read()
+
+    @ddt.data(2, 4)
+    def test_keepalive(self, threads):
+        self._start(threads=threads)
+
+        conn = httplib.HTTPConnection('127.0.0.1', self.port, timeout=5)
+
+        response, body = self._request(conn, 'GET', '/pid')
+        self.assertEqual(response.status, 200)
+        self.assertEqual(body, str(os.getpid()))
+
+        sock = conn.sock
+        self.assertIsNotNone(sock)
+
+        response, body = self._request(conn, 'GET', '/stream')
+        self.assertEqual(response.getheader('transfer-encoding'), 'chunked')
+        self.assertEqual(body, 'chunk0chunk1chunk2')
+
+        response, body = self._request(conn, 'POST', '/echo', 'x' * 1000)
+        self.assertEqual(body, 'x' * 1000)
+
+        # NOTE: The unread body is skipped, not taken for a request
+        response, body = self._request(conn, 'POST', '/ignore', 'x' * 100)
+        self.assertEqual(response.status, 201)
+
+        response, body = self._request(conn, 'GET', '/pid')
+        self.assertEqual(response.status, 200)
+
+        self.assertIs(conn.sock, sock)
+        conn.close()
+
+    def test_no_keepalive_without_pool(self):
+        self._start()
+
+        first = httplib.HTTPConnection('127.0.0.1', self.port, timeout=5)
+        response, body = self._request(first, 'GET', '/pid')
+        self.assertEqual(response.getheader('connection'), 'close')
+
+        # NOTE: Served while the first client still holds its
+        # connection open
+        second = httplib.HTTPConnection('127.0.0.1', self.port, timeout=2)
+        response, body = self._request(second, 'GET', '/pid')
+        self.assertEqual(response.status, 200)
+
+        first.close()
+        second.close()
+
+    def test_idle_connections_hold_no_thread(self):
+        self._start(threads=2)
+
+        idle = []
+        for n in range(3):
+            conn = httplib.HTTPConnection('127.0.0.1', self.port, timeout=2)
+            response, body = self._request(conn, 'GET', '/pid')
+            self.assertEqual(response.status, 200)
+            self.assertIsNone(response.getheader('connection'))
+            idle.append(conn)
+
+        # NOTE: Kept alive connections are served again as well
+        for conn in idle:
+            sock = conn.sock
+            response, body = self._request(conn, 'GET', '/pid')
+            self.assertEqual(response.status, 200)
+            self.assertIs(conn.sock, sock)
+            conn.close()
+
+    def test_connection_close(self):
+        self._start()
+
+        conn = httplib.HTTPConnection('127.0.0.1', self.port, timeout=5)
+        conn.request('GET', '/pid', headers={'Connection': 'close'})
+        response = conn.getresponse()
+        response.read()
+
+        self.assertEqual(response.getheader('connection'), 'close')
+        self.assertIsNone(conn.sock)
+
+    def test_no_keepalive(self):
+        self._start(keepalive_timeout=0)
+
+        conn = httplib.HTTPConnection('127.0.0.1', self.port, timeout=5)
+        response, body = self._request(conn, 'GET', '/stream')
+
+        self.assertEqual(body, 'chunk0chunk1chunk2')
+        self.assertEqual(response.getheader('connection'), 'close')
+
+    def test_stop_closes_idle_connections(self):
+        worker = self._start(threads=2)
+
+        conn = httplib.HTTPConnection('127.0.0.1', self.port, timeout=5)
+        self._request(conn, 'GET', '/pid')
+
+        worker.stop()
+
+        response, body = self._request(conn, 'GET', '/pid')
+        self.assertEqual(response.getheader('connection'), 'close')
+
+
+class TestServer(testing.TestBase):
+
+    def setUp(self):
+        super(TestServer, self).setUp()
+
+        if not hasattr(os, 'fork'):
+            self.skipTest('No os.fork()')
+
+    def _get_pid(self, port):
+        conn = httplib.HTTPConnection('127.0.0.1', port, timeout=5)
+        conn.request('GET', '/pid')
+        pid = int(conn.getresponse().read())
+        conn.close()
+        return pid
+
+    def _is_running(self, pid):
+        try:
+            os.kill(pid, 0)
+        except OSError:
+            return False
+
+        return True
+
+    def test_prefork(self):
+        httpd = server.Server(_app, '127.0.0.1', 0, workers=2,
+                              graceful_timeout=5)
+
+        master = os.fork()
+        if not master:
+            try:
+                httpd.serve()
+            finally:
+                os._exit(0)
+
+        httpd.socket.close()
+        port = httpd.server_port
+
+        def stop():
+            try:
+                os.kill(master, signal.SIGKILL)
+                os.waitpid(master, 0)
+            except OSError:
+                pass
+
+        self.addCleanup(stop)
+
+        worker = self._get_pid(port)
+        self.assertNotIn(worker, (os.getpid(), master))
+
+        # NOTE: Replaces the workers
+        os.kill(master, signal.SIGHUP)
+
+        deadline = time.time() + 10
+        while self._is_running(worker) and time.time() < deadline:
+            time.sleep(0.1)
+
+        self.assertFalse(self._is_running(worker))
+        self.assertNotEqual(self._get_pid(port), worker)
+
+        os.kill(master, signal.SIGTERM)
+        pid, status = os.waitpid(master, 0)
+        self.assertEqual(status, 0)
@@ -0,0 +1,155 @@
+# Copyright (c) 2013 Rackspace, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import time
+
+import falcon
+from testtools import matchers
+
+import base  # noqa
+
+
+class TestSubscription(base.TestBase):
+
+    config_filename = 'wsgi_sqlite.conf'
+
+    def setUp(self):
+        super(TestSubscription, self).setUp()
+
+        self.config('drivers:transport:wsgi', long_poll_interval=0.01)
+
+        self.project_id = '7e55e1a7e'
+        self.queue_path = '/v1/queues/fizbit'
+        self.subscription_path = self.queue_path + '/subscription'
+
+        self.simulate_put(self.queue_path, self.project_id)
+        self.assertEquals(self.srmock.status, falcon.HTTP_201)
+
+    def tearDown(self):
+        self.simulate_delete(self.queue_path, self.project_id)
+        super(TestSubscription, self).tearDown()
+
+    def _post_messages(self, *bodies):
+        doc = json.dumps([{'body': body, 'ttl': 300} for body in bodies])
+        self.simulate_post(self.queue_path + '/messages', self.project_id,
+                           body=doc, headers={'Client-ID': '30387f00'})
+        self.assertEquals(self.srmock.status, falcon.HTTP_201)
+
+    def _subscribe(self, headers=None):
+        headers = dict(headers or {})
+        headers['Accept'] = 'text/event-stream'
+
+        events = self.simulate_get(self.subscription_path, self.project_id,
+                                   headers=headers)
+        self.assertEquals(self.srmock.status, falcon.HTTP_200)
+        self.assertEquals(self.srmock.headers_dict['Content-Type'],
+                          'text/event-stream')
+
+        self.assertEquals(next(events), 'retry: 10\n\n')
+        return events
+
+    def _read(self, event):
+        fields = dict(line.split(': ', 1)
+                      for line in event.rstrip('\n').split('\n'))
+        return fields.get('id'), json.loads(fields['data'])
+
+    def test_push(self):
+        self._post_messages(1, 2)
+        events = self._subscribe()
+
+        id1, message1 = self._read(next(events))
+        id2, message2 = self._read(next(events))
+
+        self.assertIsNone(id1)
+        self.assertIsNotNone(id2)
+        self.assertEquals([message1['body'], message2['body']], [1, 2])
+        self.assertTrue(message1['href'].startswith(
+            self.queue_path + '/messages/'))
+
+        # NOTE: The stream is suspended until the next event is read
+        self._post_messages(3)
+        id3, message3 = self._read(next(events))
+        self.assertEquals(message3['body'], 3)
+
+        # Resumes after the last event seen
+        events = self._subscribe(headers={'Last-Event-ID': id2})
+        self.assertEquals(self._read(next(events)), (id3, message3))
+
+    def test_heartbeat(self):
+        self.config('drivers:transport:wsgi', subscription_heartbeat=0)
+
+        events = self._subscribe()
+        self.assertEquals(next(events), ':\n\n')
+
+        self._post_messages(1)
+        self.assertEquals(self._read(next(events))[1]['body'], 1)
+
+    def test_lifetime(self):
+        self.config('drivers:transport:wsgi', subscription_lifetime=0)
+        self._post_messages(1)
+
+        events = self._subscribe()
+        self.assertEquals(self._read(next(events))[1]['body'], 1)
+        self.assertRaises(StopIteration, next, events)
+
+    def test_needs_concurrency(self):
+        self.transport.notifier.max_waiters = 0
+
+        self.simulate_get(self.subscription_path, self.project_id,
+                          headers={'Accept': 'text/event-stream'})
+        self.assertEquals(self.srmock.status, falcon.HTTP_503)
+
+    def test_limit(self):
+        self.config('drivers:transport:wsgi', subscription_limit=1)
+
+        events = self._subscribe()
+
+        self.simulate_get(self.subscription_path, self.project_id,
+                          headers={'Accept': 'text/event-stream'})
+        self.assertEquals(self.srmock.status, falcon.HTTP_503)
+        self.assertIn('Retry-After', self.srmock.headers_dict)
+
+        # NOTE: Closed by the server once the client is gone
+        events.close()
+        self._subscribe().close()
+
+    def test_requests_served_meanwhile(self):
+        self.transport.notifier.max_waiters = 1
+        events = self._subscribe()
+
+        # NOTE: The stream holds the only waiter slot, so the other
+        # requests answer at once.
+        start = time.time()
+        self.simulate_get(self.queue_path + '/messages', self.project_id,
+                          query_string='wait=10',
+                          headers={'Client-ID': '30387f00'})
+        self.assertEquals(self.srmock.status, falcon.HTTP_204)
+        self.assertThat(time.time() - start, matchers.LessThan(5))
+
+        self._post_messages(1)
+        self.assertEquals(self._read(next(events))[1]['body'], 1)
+
+        self.simulate_get(self.subscription_path, self.project_id,
+                          headers={'Accept': 'text/event-stream'})
+        self.assertEquals(self.srmock.status, falcon.HTTP_503)
+
+        events.close()
+        self.assertEquals(self.transport.notifier._waiters, 0)
+
+    def test_nonexistent_queue(self):
+        self.simulate_get('/v1/queues/nonexistent/subscription',
+                          self.project_id)
+        self.assertEquals(self.srmock.status, falcon.HTTP_404)
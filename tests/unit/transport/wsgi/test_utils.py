@@ -19,7 +19,9 @@ import io
 import falcon
 import json
 import testtools
+from testtools import matchers
 
+from marconi.queues.transport import utils as transport_utils
 from marconi.queues.transport.wsgi import utils
 
 
@@ -118,7 +120,7 @@ class TestWSGIutils(testtools.TestCase):
 
         filtered = utils.filter_stream(doc_stream, len(document),
                                        doctype=utils.JSONArray, spec=None)
-        self.assertEqual(filtered, things)
+        self.assertEqual(list(filtered), things)
 
     def test_filter_star(self):
         doc = {'ttl': 300, 'body': {'event': 'start_backup'}}
@@ -159,6 +161,54 @@ class TestWSGIutils(testtools.TestCase):
                           utils.filter_stream, stream, len(document), spec,
                           doctype=utils.JSONObject)
 
+    def test_filter_stream_array_incrementally(self):
+        array = [{u'body': {u'x': n, u'y': u'\u00e9' * n}, u'ttl': 60 + n}
+                 for n in range(30)]
+        document = json.dumps(array, ensure_ascii=False, indent=2)
+        encoded = document.encode('utf-8')
+        stream = io.BytesIO(encoded)
+
+        # NOTE: Chunks this small cut through the values, numbers
+        # and multibyte characters of the document.
+        objects = transport_utils.read_json_array(stream, len(encoded),
+                                                  chunk_size=3)
+        self.assertThat(stream.tell(), matchers.LessThan(10))
+
+        self.assertEqual(next(objects), array[0])
+        self.assertThat(stream.tell(),
+                        matchers.LessThan(len(encoded)))
+        self.assertEqual(list(objects), array[1:])
+
+    def test_filter_stream_array_bad_element(self):
+        document = (u'[{"body": 1}, {"bodie": 2}, {"body": 3}' +
+                    u' ' * (64 * 1024))
+        stream = io.StringIO(document)
+        spec = [('body', '*')]
+
+        filtered = utils.filter_stream(stream, len(document), spec,
+                                       doctype=utils.JSONArray)
+        self.assertEqual(next(filtered), {'body': 1})
+        self.assertRaises(falcon.HTTPBadRequest, next, filtered)
+        self.assertThat(stream.tell(),
+                        matchers.LessThan(len(document)))
+
+    def test_filter_stream_array_malformed(self):
+        for document in (u'', u' [', u'[1,', u'[1 2]', u'[1,]', u'[1] 2',
+                         u'[[1, 2]', u'[9223372036854775808]'):
+            stream = io.StringIO(document)
+
+            def read():
+                return list(utils.filter_stream(stream, len(document),
+                                                doctype=utils.JSONArray))
+
+            self.assertRaises(falcon.HTTPBadRequest, read)
+
+        for document in (u'[]', u' [ ] ', u'[[]]'):
+            stream = io.StringIO(document)
+            filtered = utils.filter_stream(stream, len(document),
+                                           doctype=utils.JSONArray)
+            self.assertEqual(list(filtered), json.loads(document))
+
     def test_filter_stream_wrong_use(self):
         document = u'3'
         stream = io.StringIO(document)
@@ -0,0 +1,91 @@
+# Copyright (c) 2013 Rackspace, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+
+import msgpack
+
+from marconi.queues.storage import sqlite
+from marconi import tests as testing
+
+try:
+    import zmq
+except ImportError:
+    zmq = None
+
+
+class TestDriver(testing.TestBase):
+
+    def setUp(self):
+        super(TestDriver, self).setUp()
+
+        if zmq is None:
+            self.skipTest('pyzmq is not installed')
+
+        from marconi.queues.transport.zmq import driver
+
+        # NOTE: SQLite connections can not be shared between threads,
+        # so the queue is created by the serving thread.
+        def serve():
+            storage = sqlite.Driver()
+            storage.queue_controller.create('fizbit', project=None)
+            driver.Driver(storage).serve(server)
+
+        # NOTE: The serving thread never returns, so neither the
+        # socket nor the context are closed.
+        self.context = zmq.Context()
+
+        server = driver.make_socket(self.context)
+        server.bind('inproc://marconi')
+
+        thread = threading.Thread(target=serve)
+        thread.daemon = True
+        thread.start()
+
+    def test_dealer(self):
+        client = self.context.socket(zmq.DEALER)
+        client.connect('inproc://marconi')
+        self.addCleanup(client.close, 0)
+
+        # NOTE: Requests may be pipelined; the replies come in order
+        client.send(msgpack.packb(['post', None, 'fizbit', {
+            'client_id': '30387f00',
+            'messages': [{'ttl': 60, 'body': 1}],
+        }]))
+        client.send(msgpack.packb(['list', None, 'fizbit', {
+            'client_id': '30387f00',
+            'echo': True,
+        }]))
+
+        status, body = msgpack.unpackb(client.recv())
+        self.assertEqual(status, 201)
+        ids = body['ids']
+
+        status, body = msgpack.unpackb(client.recv())
+        self.assertEqual(status, 200)
+        self.assertEqual([message['id'] for message in body['messages']],
+                         ids)
+
+    def test_message_size_limit(self):
+        from marconi.queues.transport.zmq import driver
+
+        # NOTE: Sockets can not be shared between threads, so check a
+        # socket of its own rather than the one being served.
+        self.config('drivers:transport:zmq', content_max_length=1024)
+
+        sock = driver.make_socket(self.context)
+        self.addCleanup(sock.close, 0)
+
+        self.assertEqual(sock.getsockopt(zmq.MAXMSGSIZE), 1024)
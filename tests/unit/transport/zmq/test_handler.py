@@ -0,0 +1,134 @@
+# Copyright (c) 2013 Rackspace, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import ddt
+import msgpack
+
+from marconi.queues.storage import sqlite
+from marconi.queues.transport.zmq import handler
+from marconi import tests as testing
+
+
+@ddt.ddt
+class TestHandler(testing.TestBase):
+
+    def setUp(self):
+        super(TestHandler, self).setUp()
+
+        storage = sqlite.Driver()
+        self.handler = handler.Handler(storage)
+
+        self.project_id = '7e55e1a7e'
+        storage.queue_controller.create('fizbit', project=self.project_id)
+
+    def _request(self, operation, queue='fizbit', **args):
+        request = msgpack.packb([operation, self.project_id, queue, args],
+                                use_bin_type=True)
+        return msgpack.unpackb(self.handler(request), encoding='utf-8')
+
+    def _post(self, *bodies):
+        messages = [{'ttl': 300, 'body': body} for body in bodies]
+        status, body = self._request('post', client_id='30387f00',
+                                     messages=messages)
+
+        self.assertEqual(status, 201)
+        self.assertFalse(body['partial'])
+        return body['ids']
+
+    def test_lifecycle(self):
+        ids = self._post({'event': 'BackupStarted'}, 2, u'\u2603')
+        self.assertEqual(len(ids), 3)
+
+        status, body = self._request('list', client_id='30387f00',
+                                     echo=True, limit=2)
+        self.assertEqual(status, 200)
+        self.assertEqual([message['id'] for message in body['messages']],
+                         ids[:2])
+        self.assertEqual(body['messages'][0]['body'],
+                         {'event': 'BackupStarted'})
+
+        status, body = self._request('list', client_id='30387f00',
+                                     echo=True, marker=body['marker'])
+        self.assertEqual(status, 200)
+        self.assertEqual(body['messages'][0]['body'], u'\u2603')
+
+        status, body = self._request('list', client_id='30387f00',
+                                     echo=True, marker=body['marker'])
+        self.assertEqual(status, 204)
+
+        status, body = self._request('claim', ttl=60, grace=60, limit=1)
+        self.assertEqual(status, 201)
+        self.assertEqual(body['messages'][0]['id'], ids[0])
+        claim_id = body['claim_id']
+
+        status, body = self._request('delete', ids=ids[1:2],
+                                     claim_id=claim_id)
+        self.assertEqual(status, 403)
+
+        status, body = self._request('delete', ids=ids[:1],
+                                     claim_id=claim_id)
+        self.assertEqual(status, 204)
+
+        status, body = self._request('delete', ids=ids[1:])
+        self.assertEqual(status, 204)
+
+        status, body = self._request('claim', ttl=60, grace=60)
+        self.assertEqual(status, 204)
+
+    def test_no_echo(self):
+        self._post(1)
+
+        status, body = self._request('list', client_id='30387f00')
+        self.assertEqual(status, 204)
+
+        status, body = self._request('list', client_id='8ed2d4d5')
+        self.assertEqual(status, 200)
+
+    def test_nonexistent_queue(self):
+        status, body = self._request('post', queue='nonexistent',
+                                     client_id='30387f00',
+                                     messages=[{'ttl': 300, 'body': 1}])
+        self.assertEqual(status, 404)
+
+    @ddt.data(
+        msgpack.packb('post'),
+        msgpack.packb(['post', None, 'fizbit']),
+        msgpack.packb(['post', None, 'fizbit', []]),
+        msgpack.packb(['fetch', None, 'fizbit', {}]),
+        '\xc1',
+    )
+    def test_bad_envelope(self, request):
+        status, body = msgpack.unpackb(self.handler(request))
+        self.assertEqual(status, 400)
+
+    @ddt.data(
+        ('post', {'messages': [{'ttl': 300, 'body': 1}]}),
+        ('post', {'client_id': '30387f00', 'messages': {}}),
+        ('post', {'client_id': '30387f00', 'messages': [{'ttl': 300}]}),
+        ('post', {'client_id': '30387f00',
+                  'messages': [{'ttl': '300', 'body': 1}]}),
+        ('post', {'client_id': '30387f00',
+                  'messages': [{'ttl': 30, 'body': 1}]}),
+        ('post', {'client_id': '30387f00', 'messages': []}),
+        ('list', {'client_id': '30387f00', 'limit': 0}),
+        ('list', {'client_id': '30387f00', 'echo': 'yes'}),
+        ('claim', {'ttl': 60}),
+        ('claim', {'ttl': 60, 'grace': True}),
+        ('claim', {'ttl': 60, 'grace': 60, 'limit': 100}),
+        ('delete', {'ids': 'a,b'}),
+    )
+    def test_bad_arguments(self, (operation, args)):
+        status, body = self._request(operation, **args)
+        self.assertEqual(status, 400)